@@ -0,0 +1,120 @@
+"""Simulate many clients sharing one graph through AsyncGraph.
+
+Each client sends a mix of searches, entity lookups, aggregations and
+edits. With --mode blocking the same calls go straight to the Graph on the
+event loop, for comparison. A ticker measures how late the loop runs, which
+is what other handlers on the same loop would wait.
+
+Run from the repository root:
+
+    PYTHONPATH=lifegraph python benchmarks/bench_async.py --n 100000 --clients 10 100 --mode async blocking
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from uuid import uuid4
+from graph import Graph
+from async_graph import AsyncGraph
+
+def synthetic_graph(n, n_cities=200):
+    graph = Graph(data_path=None)
+    graph.schema.create_type("city")
+    graph.schema.create_type("person")
+    graph.schema.add_property("city", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    graph.schema.add_property("person", "hometown", "city")
+    city_ids = [str(uuid4()) for _ in range(n_cities)]
+    for i, id in enumerate(city_ids):
+        graph.entities.load_entity(id, {"@type": "city", "name": f"city_{i}"})
+    for i in range(n):
+        graph.entities.load_entity(str(uuid4()), {
+            "@type": "person", "name": f"person_{i}", "age": i % 100, "hometown": city_ids[i % n_cities]})
+    graph.build_indexes()
+    return graph
+
+class BlockingGraph():
+    """The AsyncGraph calls used by clients, run directly on the loop."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    async def search(self, *args, **kwargs):
+        return self.graph.search(*args, **kwargs)
+
+    async def get_entity(self, id):
+        return self.graph.entities.to_dict(id)
+
+    async def categorical_aggregation(self, *args, **kwargs):
+        return self.graph.categorical_aggregation(*args, **kwargs)
+
+    async def edit_property(self, *args):
+        return self.graph.edit_property(*args)
+
+async def client(graph, person_ids, n_requests, latencies, rng):
+    aggregations = [{"depth": 0, "pointing_property": "hometown", "aggregation_type": "city"}]
+    for _ in range(n_requests):
+        roll = rng.random()
+        start = time.perf_counter()
+        if roll < 0.5:
+            await graph.search(f"person_{rng.randrange(len(person_ids))}", type="person", property="name")
+        elif roll < 0.8:
+            await graph.get_entity(rng.choice(person_ids))
+        elif roll < 0.95:
+            await graph.categorical_aggregation(rng.sample(person_ids, 500), "age", "mean", aggregations)
+        else:
+            await graph.edit_property(rng.choice(person_ids), "age", rng.randrange(100))
+        latencies.append(time.perf_counter() - start)
+        # Stands in for the network I/O between requests
+        await asyncio.sleep(0)
+
+async def ticker(lags, interval=0.005):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+async def run(graph, person_ids, mode, n_clients, n_requests):
+    graph = AsyncGraph(graph) if mode == "async" else BlockingGraph(graph)
+    latencies = []
+    lags = []
+    tick = asyncio.create_task(ticker(lags))
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(graph, person_ids, n_requests, latencies, random.Random(i)) for i in range(n_clients)])
+    elapsed = time.perf_counter() - start
+    tick.cancel()
+    return {
+        "mode": mode,
+        "clients": n_clients,
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+        "loop_lag_p99": percentile(lags, 0.99),
+        "loop_lag_max": max(lags, default=0.0)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--mode", nargs="+", default=["async", "blocking"])
+    args = parser.parse_args()
+
+    for mode in args.mode:
+        for n_clients in args.clients:
+            # AsyncGraph takes over writes to the graph, so each run gets its own
+            graph = synthetic_graph(args.n)
+            person_ids = graph.get_ids_of_type("person")
+            print(json.dumps(asyncio.run(run(graph, person_ids, mode, n_clients, args.requests))))
+
+if __name__ == "__main__":
+    main()
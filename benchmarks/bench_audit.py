@@ -0,0 +1,53 @@
+"""Compare serial and parallel full graph audits.
+
+Run from the repository root:
+
+    PYTHONPATH=lifegraph python benchmarks/bench_audit.py --n 1000000 --processes 1 2 4 8
+"""
+import json
+import time
+import argparse
+from uuid import uuid4
+from graph import Graph
+
+def synthetic_graph(n, n_cities=200):
+    graph = Graph(data_path=None)
+    graph.schema.create_type("city")
+    graph.schema.create_type("person")
+    graph.schema.add_property("city", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    graph.schema.add_property("person", "hometown", "city")
+    city_ids = [str(uuid4()) for _ in range(n_cities)]
+    for i, id in enumerate(city_ids):
+        graph.entities.load_entity(id, {"@type": "city", "name": f"city_{i}"})
+    for i in range(n):
+        person = {"@type": "person", "name": f"person_{i}", "hometown": city_ids[i % n_cities]}
+        # Leave some violations for the audit to find
+        if i % 10:
+            person["age"] = i % 100
+        graph.entities.load_entity(str(uuid4()), person)
+    return graph
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    graph = synthetic_graph(args.n)
+    expected = None
+    for processes in args.processes:
+        start = time.perf_counter()
+        audit_results = graph.audit(processes=processes)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = audit_results
+        print(json.dumps({
+            "processes": processes,
+            "violations": len(audit_results),
+            "seconds": elapsed,
+            "identical": audit_results == expected}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compare the memory used by plain entity dicts and the EntityStore.
+
+Run from the repository root:
+
+    PYTHONPATH=lifegraph python benchmarks/bench_entities.py --n 1000000
+"""
+import json
+import argparse
+import tracemalloc
+from uuid import uuid4
+from entities import EntityStore
+
+def synthetic_entities(n, n_countries=200):
+    country_ids = [str(uuid4()) for _ in range(n_countries)]
+    for i in range(n):
+        # Round trip through JSON so strings are not shared, as after a load
+        yield str(uuid4()), json.loads(json.dumps({
+            "@type": "person",
+            "name": f"person_{i % 1000}",
+            "age": i % 100,
+            "country": country_ids[i % n_countries]}))
+
+def measure(n, build):
+    tracemalloc.start()
+    entities = build(synthetic_entities(n))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(entities), current / 1024 / 1024
+
+def build_dict(entities):
+    return dict(entities)
+
+def build_store(entities):
+    store = EntityStore()
+    for id, entity in entities:
+        store.load_entity(id, entity)
+    return store
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    args = parser.parse_args()
+    for name, build in [("dict", build_dict), ("store", build_store)]:
+        n, mb = measure(args.n, build)
+        print(json.dumps({"representation": name, "entities": n, "mb": mb}))
+
+if __name__ == "__main__":
+    main()
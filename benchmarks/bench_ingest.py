@@ -0,0 +1,63 @@
+"""Compare building a graph with create_from_type / edit_property calls
+against a single bulk_ingest call.
+
+Run from the repository root:
+
+    PYTHONPATH=lifegraph python benchmarks/bench_ingest.py --n 100000
+"""
+import json
+import time
+import argparse
+from graph import Graph
+
+def empty_graph():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("city")
+    graph.schema.create_type("person")
+    graph.schema.add_property("city", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    graph.schema.add_property("person", "hometown", "city")
+    return graph
+
+def ingest_one_by_one(n, n_cities):
+    graph = empty_graph()
+    city_ids = []
+    for i in range(n_cities):
+        id = graph.create_from_type("city")
+        graph.edit_property(id, "name", f"city_{i}")
+        city_ids.append(id)
+    for i in range(n):
+        id = graph.create_from_type("person")
+        graph.edit_property(id, "name", f"person_{i}")
+        graph.edit_property(id, "age", i % 100)
+        graph.edit_property(id, "hometown", city_ids[i % n_cities])
+    return graph
+
+def ingest_bulk(n, n_cities):
+    graph = empty_graph()
+    records = [{"@type": "city", "@key": i, "name": f"city_{i}"} for i in range(n_cities)]
+    records.extend(
+        {"@type": "person", "name": f"person_{i}", "age": i % 100, "hometown": {"@ref": i % n_cities}}
+        for i in range(n))
+    graph.bulk_ingest(records)
+    return graph
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--n-cities", type=int, default=200)
+    args = parser.parse_args()
+
+    for name, ingest in [("one_by_one", ingest_one_by_one), ("bulk", ingest_bulk)]:
+        start = time.perf_counter()
+        graph = ingest(args.n, args.n_cities)
+        elapsed = time.perf_counter() - start
+        print(json.dumps({
+            "method": name,
+            "entities": len(graph.graph),
+            "seconds": elapsed,
+            "entities_per_second": len(graph.graph) / elapsed}))
+
+if __name__ == "__main__":
+    main()
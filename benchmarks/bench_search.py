@@ -0,0 +1,72 @@
+"""Compare Graph.search against the previous full scan implementation.
+
+Run from the repository root:
+
+    PYTHONPATH=lifegraph python benchmarks/bench_search.py --n 100000
+"""
+import json
+import time
+import random
+import argparse
+from fuzzywuzzy import process
+from graph import Graph
+
+def search_by_scan(graph, value, type=None):
+    # Graph.search before the search index: score every value of every
+    # entity on every call
+    if type:
+        search_ids = graph.get_ids_of_type(type)
+    else:
+        search_ids = graph.graph.keys()
+    search_properties = graph.schema.get_all_string_properties()
+    search_candidates = []
+    for id in search_ids:
+        for _type, property in search_properties:
+            if graph.graph[id]["@type"] == _type:
+                search_candidates.append((id, graph.graph[id][property]))
+    match = process.extract(value, [x[1] for x in search_candidates], limit=1)
+    return [x[0] for x in search_candidates if x[1] == match[0][0]]
+
+def synthetic_graph(n):
+    graph = Graph(data_path=None)
+    graph.schema.create_type("person")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    random.seed(0)
+    syllables = ["ha", "mi", "sh", "pe", "ter", "jo", "an", "na", "li", "sa", "ro", "ben"]
+    names = []
+    for i in range(n):
+        id = graph.create_from_type("person")
+        name = "".join(random.choice(syllables) for _ in range(4)).title() + f" {i}"
+        graph.edit_property(id, "name", name)
+        graph.edit_property(id, "age", i % 100)
+        names.append(name)
+    return graph, names
+
+def timed(fun, queries):
+    start = time.perf_counter()
+    results = [fun(x) for x in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph, names = synthetic_graph(args.n)
+    build_seconds = time.perf_counter() - start
+    queries = random.sample(names, args.queries)
+
+    scan_seconds, scan_results = timed(lambda x: search_by_scan(graph, x), queries)
+    index_seconds, index_results = timed(lambda x: graph.search(x), queries)
+    print(json.dumps({
+        "entities": args.n,
+        "build_seconds": build_seconds,
+        "scan_seconds_per_query": scan_seconds,
+        "index_seconds_per_query": index_seconds,
+        "same_results": scan_results == index_results}))
+
+if __name__ == "__main__":
+    main()
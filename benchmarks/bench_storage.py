@@ -0,0 +1,78 @@
+"""Compare load time and peak RSS of the JSON and columnar storage backends.
+
+Run from the repository root:
+
+    PYTHONPATH=lifegraph python benchmarks/bench_storage.py --n 1000000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from uuid import uuid4
+from storage import JsonStorage, convert_storage, storage_backends
+
+def synthetic_graph(n, n_countries=200):
+    countries = {}
+    for i in range(n_countries):
+        countries[str(uuid4())] = {"@type": "country", "name": f"country_{i}"}
+    country_ids = list(countries)
+    people = {}
+    for i in range(n):
+        people[str(uuid4())] = {
+            "@type": "person",
+            "name": f"person_{i}",
+            "age": i % 100,
+            "country": country_ids[i % n_countries]}
+    return {"country": countries, "person": people}
+
+def measure_load(data_path, storage):
+    backend = storage_backends[storage](data_path)
+    start = time.perf_counter()
+    n = 0
+    for type in backend.list_types():
+        n += len(backend.load_type(type))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"storage": storage, "entities": n, "seconds": elapsed, "max_rss_mb": max_rss_mb()}))
+
+def max_rss_mb():
+    # ru_maxrss survives execve on Linux, so prefer the per process VmHWM
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if sys.platform == "darwin":
+        max_rss = max_rss / 1024
+    return max_rss / 1024
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--measure", choices=list(storage_backends))
+    parser.add_argument("--data-path")
+    args = parser.parse_args()
+
+    if args.measure:
+        measure_load(args.data_path, args.measure)
+        return
+
+    with tempfile.TemporaryDirectory() as data_path:
+        json_storage = JsonStorage(data_path)
+        for type, entities in synthetic_graph(args.n).items():
+            json_storage.save_type(type, entities)
+        convert_storage(data_path, source="json", target="columnar")
+
+        # Each backend loads in a fresh interpreter so peak RSS is not shared
+        for storage in storage_backends:
+            subprocess.run(
+                [sys.executable, __file__, "--measure", storage, "--data-path", data_path],
+                check=True, env=dict(os.environ))
+
+if __name__ == "__main__":
+    main()
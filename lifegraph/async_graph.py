@@ -0,0 +1,87 @@
+import asyncio
+import functools as ft
+from graph import Graph
+from concurrency import ConcurrentGraph
+
+async def run_in_executor(executor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, ft.partial(fn, *args, **kwargs))
+
+async def open_graph(data_path=None, storage="json", lazy=False, executor=None):
+    # Loads the graph files without blocking the event loop
+    graph = await run_in_executor(executor, Graph, data_path=data_path, storage=storage, lazy=lazy)
+    concurrent_graph = await run_in_executor(executor, ConcurrentGraph, graph)
+    return AsyncGraph(concurrent_graph, executor=executor)
+
+class AsyncGraph():
+    """Coroutine API over a ConcurrentGraph.
+
+    Reads run on a snapshot in the executor (the loop's default thread pool
+    if executor is None), so searches, traversals, aggregations and audits
+    do not stall the event loop or wait for writers. Writes and file I/O
+    also run in the executor, where they take their turn for the write
+    lock. Passing a Graph wraps it in a ConcurrentGraph, after which it
+    should only be written through this object."""
+
+    def __init__(self, graph, executor=None):
+        self.concurrent_graph = graph if isinstance(graph, ConcurrentGraph) else ConcurrentGraph(graph)
+        self.graph = self.concurrent_graph.graph
+        self.executor = executor
+
+    async def read(self, method, *args, **kwargs):
+        return await run_in_executor(self.executor, self.concurrent_graph.read, method, *args, **kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        return await run_in_executor(self.executor, self.concurrent_graph.write, fn, *args, **kwargs)
+
+    async def get_entity(self, id):
+        # A single lookup is cheap enough to run on the loop
+        with self.concurrent_graph.snapshot() as snapshot:
+            return dict(snapshot.graph[id])
+
+    async def get_ids_of_type(self, type):
+        return await self.read("get_ids_of_type", type)
+
+    async def search(self, value, type=None, property=None, limit=1):
+        return await self.read("search", value, type=type, property=property, limit=limit)
+
+    async def search_out_from_id_property(self, id, property, max_depth=None, unknown="skip"):
+        return await self.read("search_out_from_id_property", id, property, max_depth=max_depth, unknown=unknown)
+
+    async def categorical_aggregation_paths(self, ids, max_depth=None):
+        return await self.read("categorical_aggregation_paths", ids, max_depth=max_depth)
+
+    async def categorical_aggregation(self, ids, value_property, aggregation_fun, aggregations, q=0.5, max_depth=None):
+        return await self.read("categorical_aggregation", ids, value_property, aggregation_fun, aggregations, q=q, max_depth=max_depth)
+
+    async def query(self, text):
+        return await self.read("query", text)
+
+    async def audit(self):
+        # Serial, as forking a process pool from a worker thread is unsafe
+        return await self.read("audit")
+
+    async def edit_property(self, id, property, value):
+        return await self.write(self.graph.edit_property, id, property, value)
+
+    async def create_from_type(self, type):
+        return await self.write(self.graph.create_from_type, type)
+
+    async def create_from_copy(self, id):
+        return await self.write(self.graph.create_from_copy, id)
+
+    async def bulk_ingest(self, records):
+        return await self.write(self.graph.bulk_ingest, records)
+
+    async def edit_schema(self, op, *args, **kwargs):
+        # Calls a Schema mutation such as "add_property" as a write
+        return await self.write(getattr(self.graph.schema, op), *args, **kwargs)
+
+    async def save_graph(self):
+        return await self.write(self.graph.save_graph)
+
+    async def compact(self):
+        return await self.write(self.graph.compact)
+
+    async def close(self):
+        return await self.write(self.graph.close)
@@ -0,0 +1,106 @@
+import multiprocessing
+from collections import namedtuple
+
+# Set in the parent before the pool forks, so workers read the graph and its
+# schema from inherited memory instead of having them pickled to them
+shared_graph = None
+shared_ids = None
+
+class Violation(namedtuple("Violation", [
+        "entity_id", "property", "kind", "expected_type", "observed_type", "pointed_id"])):
+    """One audit finding. kind is "missing_property", "unknown_entity" or
+    "wrong_type"; observed_type and pointed_id are None where they do not
+    apply."""
+
+    __slots__ = ()
+
+    def message(self):
+        if self.kind == "missing_property":
+            return f"Entity {self.entity_id} is missing required property {self.property}"
+        if self.kind == "unknown_entity":
+            return f"Entity '{self.entity_id}' property '{self.property}' points to unknown entity '{self.pointed_id}'. Expected type '{self.expected_type}'."
+        return f"Entity '{self.entity_id}' property '{self.property}' points to entity '{self.pointed_id}' of type '{self.observed_type}'. Expected type '{self.expected_type}'."
+
+class IncrementalAuditor():
+    """Keeps the current audit Violations of a Graph and re-checks only what
+    changed since the last check: entities that were written, entities
+    pointing at entities that were inserted, removed or changed type, and
+    entities of types whose schema changed."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.violations = {}
+        # Ordered sets of ids to re-check and of ids whose referrers need it
+        self.dirty_ids = dict.fromkeys(graph.graph.keys())
+        self.dirty_targets = {}
+        graph.listeners.append(self)
+        graph.schema.listeners.append(self)
+
+    def entity_changed(self, id, property, old_value, new_value):
+        self.dirty_ids[id] = None
+        if property is None or property == "@type":
+            self.dirty_targets[id] = None
+
+    def schema_changed(self, op, args, types):
+        for type in types:
+            self.dirty_ids.update(dict.fromkeys(self.graph.get_ids_of_type(type)))
+            if op in ["make_parent", "edit_parent", "remove_parent", "batch"]:
+                # Which types a reference accepts depends on the hierarchy
+                for child_type in self.graph.schema.get_type_with_child_ids(type):
+                    self.dirty_targets.update(dict.fromkeys(self.graph.get_ids_of_type(child_type)))
+
+    def check(self):
+        for target in self.dirty_targets:
+            self.dirty_ids.update(dict.fromkeys(x for x, _ in self.graph.get_inbound_edges(target)))
+        new, resolved = [], []
+        for id in self.dirty_ids:
+            previous = self.violations.pop(id, [])
+            current = self.graph.audit_entity(id) if id in self.graph.graph else []
+            if current:
+                self.violations[id] = current
+            new.extend(x for x in current if x not in previous)
+            resolved.extend(x for x in previous if x not in current)
+        self.dirty_ids = {}
+        self.dirty_targets = {}
+        return new, resolved
+
+    def get_violations(self):
+        return [x for violations in self.violations.values() for x in violations]
+
+def audit_chunk(bounds):
+    start, end = bounds
+    missing_properties, wrong_pointers = [], []
+    for k in shared_ids[start:end]:
+        missing_properties.extend(shared_graph.audit_entity_has_schema_properties(k))
+        wrong_pointers.extend(shared_graph.audit_entity_points_to_correct_type(k))
+    return missing_properties, wrong_pointers
+
+def get_chunks(n, n_chunks):
+    size = -(-n // n_chunks) if n_chunks else n
+    return [(start, min(start + size, n)) for start in range(0, n, max(size, 1))]
+
+def parallel_audit(graph, processes=None, chunks_per_process=4):
+    """Audit every entity of graph across a pool of processes.
+
+    Ids are split into contiguous chunks in graph order and the partial
+    results are merged in chunk order, so the output is identical to
+    Graph.audit(). Falls back to a serial audit where processes cannot be
+    forked."""
+    global shared_graph, shared_ids
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    ids = list(graph.graph.keys())
+    if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return graph.audit()
+
+    shared_graph, shared_ids = graph, ids
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(processes) as pool:
+            results = pool.map(audit_chunk, get_chunks(len(ids), processes * chunks_per_process))
+    finally:
+        shared_graph, shared_ids = None, None
+
+    audit_results = [x for missing_properties, _ in results for x in missing_properties]
+    audit_results.extend(x for _, wrong_pointers in results for x in wrong_pointers)
+    return audit_results
@@ -1,5 +1,5 @@
 import sys
-from schema import Schema
+from graph import Graph
 
 def free_text_entry(text):
 
@@ -22,6 +22,11 @@ def free_text_entry(text):
         schema.remove_property(
             id=text_split[-2],
             property=text_split[-1])
+    if "rename property" == lead_text:
+        schema.rename_property(
+            id=text_split[-3],
+            property=text_split[-2],
+            new_property=text_split[-1])
     if "make parent" == lead_text:
         schema.make_parent(
             parent_id=text_split[-2],
@@ -33,10 +38,16 @@ def free_text_entry(text):
     if "drop parent" == lead_text:
         schema.remove_parent(
             id=text_split[-1])
+    if "compact schema" == lead_text:
+        # Saves the graph files too, so both logs are emptied together
+        graph.compact()
 
-    schema.close()
+    graph.close()
 
 if __name__ == "__main__":
     data_path = "./data"
-    schema = Schema(data_path=data_path)
+    # Opened through the Graph so that property changes migrate its data.
+    # Lazily, so only the types a command touches are loaded
+    graph = Graph(data_path=data_path, lazy=True)
+    schema = graph.schema
     free_text_entry(sys.argv[1])
@@ -0,0 +1,398 @@
+import copy
+import threading
+from bisect import bisect_right
+from collections.abc import Mapping
+from entities import MISSING
+from fuzzywuzzy import process
+from graph import Graph
+from schema import Schema
+from search_index import SearchIndex
+from traversal_cache import TraversalCache
+
+# Returned for entities with no change recorded after a snapshot's version
+UNCHANGED = object()
+# Returned for reads of entities that are not in the live store
+ABSENT = object()
+
+class ConcurrentGraph():
+    """Shares a Graph between threads: writers take turns, readers use
+    snapshots and never wait for them.
+
+    Every write runs through write() under a lock and commits a new
+    version. Before an entity is first changed by a write, a copy of it is
+    kept in a history of (version, entity) pairs, with None for entities
+    that did not exist yet. A snapshot reads the live entities and then the
+    history, using the copy from the first write after its version if
+    there is one, so it sees the graph as it was when it was taken. The
+    history is dropped once no snapshot needs it.
+
+    Snapshots take a copy of the schema, which is only replaced by writes
+    that change it. Any Graph method that only reads works on a snapshot.
+    While the schema has not changed since, type, inbound and search
+    lookups read the live indexes and correct them for entities written
+    after the snapshot. Otherwise the snapshot indexes its own entities.
+
+    Lazy graphs are loaded in full first, as loading a type is a write."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        if graph.lazy:
+            graph.graph.ensure_all_types_loaded()
+        self.write_lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.version = 0
+        self.writing_version = None
+        self.writer = None
+        self.recorded = set()
+        self.history = {}
+        # (version, id) of every history entry, in version order
+        self.changes = []
+        # version -> number of open snapshots of it
+        self.active_snapshots = {}
+        # Odd while a write that changed the schema is reindexing
+        self.schema_epoch = 0
+        self.schema = self.copy_schema()
+        graph.entities.before_write = self.record_history
+        # Before the graph reindexes, so readers know the indexes are moving
+        graph.schema.listeners.insert(0, self)
+
+    def copy_schema(self):
+        schema = Schema()
+        schema.schema = copy.deepcopy(self.graph.schema.schema)
+        return schema
+
+    def write(self, fn, *args, **kwargs):
+        with self.write_lock:
+            self.writing_version = self.version + 1
+            self.writer = threading.get_ident()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # A failed write may still have changed entities
+                self.commit()
+
+    def commit(self):
+        schema = self.copy_schema() if self.schema_epoch % 2 else self.schema
+        with self.snapshot_lock:
+            self.version = self.writing_version
+            if self.schema_epoch % 2:
+                self.schema_epoch += 1
+                self.schema = schema
+            self.writing_version = None
+            self.writer = None
+            self.recorded = set()
+            self.prune_history()
+
+    def prune_history(self):
+        # Only changes after the oldest open snapshot are still needed
+        if not self.active_snapshots:
+            self.history = {}
+            self.changes = []
+            return
+        oldest = min(self.active_snapshots)
+        if self.changes and self.changes[0][0] <= oldest:
+            self.changes = self.changes[bisect_right(self.changes, oldest, key=lambda x: x[0]):]
+            self.history = {
+                id: [x for x in entries if x[0] > oldest]
+                for id, entries in self.history.items() if entries[-1][0] > oldest}
+
+    def record_history(self, id):
+        self.raise_if_write_not_serialised(id)
+        if id in self.recorded:
+            return
+        self.recorded.add(id)
+        entity = self.graph.entities.to_dict(id) if id in self.graph.entities else None
+        self.history.setdefault(id, []).append((self.writing_version, entity))
+        self.changes.append((self.writing_version, id))
+
+    def raise_if_write_not_serialised(self, id):
+        try:
+            assert self.writer == threading.get_ident()
+        except AssertionError:
+            raise AssertionError(f"Entity {id} can only be changed through ConcurrentGraph.write.")
+
+    def schema_changed(self, op, args, types):
+        if self.schema_epoch % 2 == 0:
+            self.schema_epoch += 1
+
+    def get_past_entity(self, id, version):
+        # The entity as of version if it changed since, otherwise UNCHANGED
+        for entry_version, entity in self.history.get(id, ()):
+            if entry_version > version:
+                return entity
+        return UNCHANGED
+
+    def get_changed_ids(self, version):
+        changes = self.changes
+        return dict.fromkeys(id for _, id in changes[bisect_right(changes, version, key=lambda x: x[0]):])
+
+    def snapshot(self):
+        with self.snapshot_lock:
+            snapshot = Snapshot(self, self.version, self.schema_epoch, self.schema)
+            self.active_snapshots[self.version] = self.active_snapshots.get(self.version, 0) + 1
+        return snapshot
+
+    def release(self, snapshot):
+        with self.snapshot_lock:
+            self.active_snapshots[snapshot.version] -= 1
+            if not self.active_snapshots[snapshot.version]:
+                del self.active_snapshots[snapshot.version]
+
+    def read(self, method, *args, **kwargs):
+        # Calls a read method of the Graph on a fresh snapshot
+        with self.snapshot() as snapshot:
+            return getattr(snapshot, method)(*args, **kwargs)
+
+    def edit_property(self, id, property, value):
+        return self.write(self.graph.edit_property, id, property, value)
+
+    def create_from_type(self, type):
+        return self.write(self.graph.create_from_type, type)
+
+    def create_from_copy(self, id):
+        return self.write(self.graph.create_from_copy, id)
+
+    def create_from_smart_copy(self, id):
+        return self.write(self.graph.create_from_smart_copy, id)
+
+    def bulk_ingest(self, records):
+        return self.write(self.graph.bulk_ingest, records)
+
+    def save_graph(self):
+        return self.write(self.graph.save_graph)
+
+class SnapshotEntities(Mapping):
+    """The entities of a ConcurrentGraph as of a version, as plain dicts."""
+
+    def __init__(self, concurrent_graph, version):
+        self.concurrent_graph = concurrent_graph
+        self.store = concurrent_graph.graph.entities
+        self.version = version
+
+    def read_live(self, fn, *args):
+        # Returns ABSENT if the entity is not in the live store. Reads
+        # that overlap a write of the entity can fail or see it half written,
+        # but its history entry is recorded first and replaces the result.
+        while True:
+            try:
+                return fn(*args)
+            except (KeyError, IndexError):
+                return ABSENT
+            except RuntimeError:
+                # Another entity of the same type gained a column
+                continue
+
+    def get_entity(self, id):
+        entity = self.read_live(self.store.to_dict, id)
+        past_entity = self.concurrent_graph.get_past_entity(id, self.version)
+        if past_entity is not UNCHANGED:
+            return past_entity
+        return None if entity is ABSENT else entity
+
+    def peek_value(self, id, property):
+        value = self.read_live(self.store.peek_value, id, property)
+        past_entity = self.concurrent_graph.get_past_entity(id, self.version)
+        if past_entity is not UNCHANGED:
+            if past_entity is None:
+                raise KeyError(id)
+            if property == "@type":
+                return past_entity["@type"]
+            return past_entity.get(property, MISSING)
+        if value is ABSENT:
+            raise KeyError(id)
+        return value
+
+    def get_value(self, id, property):
+        value = self.peek_value(id, property)
+        if value is MISSING:
+            raise KeyError(property)
+        return value
+
+    def get_properties(self, id):
+        return list(self[id])
+
+    def to_dict(self, id):
+        return dict(self[id])
+
+    def get_changed_ids(self):
+        return self.concurrent_graph.get_changed_ids(self.version)
+
+    def __getitem__(self, id):
+        entity = self.get_entity(id)
+        if entity is None:
+            raise KeyError(id)
+        return entity
+
+    def __contains__(self, id):
+        exists = id in self.store.handles
+        past_entity = self.concurrent_graph.get_past_entity(id, self.version)
+        if past_entity is not UNCHANGED:
+            return past_entity is not None
+        return exists
+
+    def __iter__(self):
+        ids = list(self.store.handles)
+        changed_ids = self.get_changed_ids()
+        for id in ids:
+            if id not in changed_ids:
+                yield id
+        for id in changed_ids:
+            if id in self:
+                yield id
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class SnapshotSearchIndex(SearchIndex):
+    """Search lookups of a Snapshot: the live search index, without the
+    entities written after the snapshot, plus an index of those entities as
+    they were."""
+
+    def __init__(self, snapshot):
+        super().__init__()
+        self.snapshot = snapshot
+        self.live = snapshot.concurrent_graph.graph.search_index
+
+    def get_overlay(self):
+        changed_ids = self.snapshot.entities.get_changed_ids()
+        overlay = SearchIndex()
+        for id in changed_ids:
+            entity = self.snapshot.entities.get_entity(id)
+            if entity is not None:
+                for property in self.snapshot.schema.get_properties_of_kind(entity["@type"], "string"):
+                    if property in entity:
+                        overlay.add(entity["@type"], property, id, entity[property])
+        return changed_ids, overlay
+
+    def get_exact(self, type, property, value):
+        ids = self.snapshot.read_live_index(self.live.get_exact, type, property, value)
+        if ids is None:
+            return self.snapshot.search_index.get_exact(type, property, value)
+        changed_ids, overlay = self.get_overlay()
+        return [x for x in ids if x not in changed_ids] + overlay.get_exact(type, property, value)
+
+    def get_live_postings(self, value, type, property):
+        # Candidate values with their ids, read before the changes so that
+        # any write they reflect is in the history
+        fields = self.live.get_fields(type=type, property=property)
+        postings = {}
+        for candidate in self.live.get_candidates(value, fields):
+            postings[candidate] = [x for field in fields for x in field.postings.get(candidate, {})]
+        return postings
+
+    def search(self, value, type=None, property=None, limit=1, sort_key=None):
+        postings = self.snapshot.read_live_index(self.get_live_postings, value, type, property)
+        if postings is None:
+            return self.snapshot.search_index.search(value, type=type, property=property, limit=limit, sort_key=sort_key)
+        changed_ids, overlay = self.get_overlay()
+        postings = {
+            candidate: [x for x in ids if x not in changed_ids]
+            for candidate, ids in postings.items()}
+        fields = overlay.get_fields(type=type, property=property)
+        for candidate in overlay.get_candidates(value, fields):
+            postings.setdefault(candidate, []).extend(
+                x for field in fields for x in field.postings.get(candidate, {}))
+        candidates = {x: str(x) for x, ids in postings.items() if ids}
+        if not candidates:
+            return []
+        ids = {}
+        for _, _, match in process.extract(value, candidates, limit=limit):
+            match_ids = [x for x in postings[match] if x not in ids]
+            ids.update(dict.fromkeys(sorted(match_ids, key=sort_key)))
+        return list(ids)
+
+class Snapshot(Graph):
+    """A read only Graph over a ConcurrentGraph as of one version.
+
+    Snapshots are meant to be used by one thread, and released with close()
+    or by using them in a with block."""
+
+    def __init__(self, concurrent_graph, version, schema_epoch, schema):
+        self.concurrent_graph = concurrent_graph
+        self.version = version
+        self.schema_epoch = schema_epoch
+        self.schema = schema
+        self.data_path = None
+        self.lazy = False
+        self.mutation_log = None
+        self.entities = SnapshotEntities(concurrent_graph, version)
+        self.graph = self.entities
+        self.listeners = []
+        self.incremental_auditor = None
+        # Entities never change under a snapshot, so its traversal cache
+        # needs no invalidation
+        self.traversal_cache = TraversalCache()
+        self.search_index = SnapshotSearchIndex(self)
+        self.own_indexes = False
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.concurrent_graph.release(self)
+
+    def read_live_index(self, fn, *args):
+        # Returns None, and indexes the snapshot itself, if the schema
+        # changed since the snapshot, as the live indexes follow it
+        while not self.own_indexes:
+            if self.concurrent_graph.schema_epoch != self.schema_epoch:
+                self.build_indexes()
+                self.own_indexes = True
+                break
+            try:
+                result = fn(*args)
+            except RuntimeError:
+                # A write changed the index while it was read
+                continue
+            if self.concurrent_graph.schema_epoch == self.schema_epoch:
+                return result
+        return None
+
+    def get_ids_of_type(self, type):
+        live = self.concurrent_graph.graph.type_index
+        ids = self.read_live_index(lambda: list(live.get(type, {})))
+        if ids is None:
+            return super().get_ids_of_type(type)
+        changed_ids = self.entities.get_changed_ids()
+        ids = [x for x in ids if x not in changed_ids]
+        for id in changed_ids:
+            entity = self.entities.get_entity(id)
+            if entity is not None and entity["@type"] == type:
+                ids.append(id)
+        return ids
+
+    def get_inbound_edges(self, id, property=None):
+        live = self.concurrent_graph.graph.inbound_index
+        edges = self.read_live_index(lambda: list(live.get(id, {})))
+        if edges is None:
+            return super().get_inbound_edges(id, property)
+        changed_ids = self.entities.get_changed_ids()
+        edges = [x for x in edges if x[0] not in changed_ids]
+        for source_id in changed_ids:
+            entity = self.entities.get_entity(source_id)
+            if entity is None:
+                continue
+            for _property in self.schema.get_properties_of_kind(entity["@type"], "reference"):
+                if entity.get(_property) == id:
+                    edges.append((source_id, _property))
+        return [x for x in edges if property is None or x[1] == property]
+
+    def search(self, value, type=None, property=None, limit=1):
+        handles = self.concurrent_graph.graph.entities.handles
+        return self.search_index.search(value, type=type, property=property, limit=limit,
+            sort_key=lambda x: handles.get(x, -1))
+
+    def insert_entity(self, id, data):
+        self.raise_read_only()
+
+    def set_property(self, id, property, value):
+        self.raise_read_only()
+
+    def raise_read_only(self):
+        raise AssertionError("Snapshots are read only. Write through ConcurrentGraph.write.")
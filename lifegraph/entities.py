@@ -0,0 +1,322 @@
+import sys
+from array import array
+from collections.abc import MutableMapping
+
+# Marks a property an entity does not have in its type's column
+MISSING = object()
+
+def intern_value(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+class EntityTable():
+    """Entities of one type, stored as one list per property.
+
+    Rows of removed entities are cleared and kept in free_rows, for append
+    to reuse."""
+
+    __slots__ = ("type", "ids", "columns", "free_rows")
+
+    def __init__(self, type):
+        self.type = type
+        self.ids = []
+        self.columns = {}
+        self.free_rows = []
+
+    def add_column(self, property):
+        self.columns[property] = [MISSING] * len(self.ids)
+
+    def append(self, id, entity):
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.ids[row] = id
+        else:
+            row = len(self.ids)
+            self.ids.append(id)
+            for column in self.columns.values():
+                column.append(MISSING)
+        self.set_values(row, entity)
+        return row
+
+    def overwrite(self, row, entity):
+        for column in self.columns.values():
+            column[row] = MISSING
+        self.set_values(row, entity)
+
+    def set_values(self, row, entity):
+        for property, value in entity.items():
+            if property == "@type":
+                continue
+            if property not in self.columns:
+                self.add_column(property)
+            self.columns[property][row] = intern_value(value)
+
+    def extend(self, ids, entities):
+        # append for many entities, filling a column at a time
+        for entity in entities:
+            for property in entity:
+                if property != "@type" and property not in self.columns:
+                    self.add_column(property)
+        self.ids.extend(ids)
+        for property, column in self.columns.items():
+            column.extend([intern_value(x.get(property, MISSING)) for x in entities])
+
+    def clear_row(self, row):
+        self.ids[row] = None
+        for column in self.columns.values():
+            column[row] = MISSING
+        self.free_rows.append(row)
+
+class EntityView(MutableMapping):
+    """Dict-like view of one entity in an EntityStore."""
+
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, id):
+        self.store = store
+        self.id = id
+
+    def __getitem__(self, property):
+        return self.store.get_value(self.id, property)
+
+    def __setitem__(self, property, value):
+        self.store.set_value(self.id, property, value)
+
+    def __delitem__(self, property):
+        self.store.delete_value(self.id, property)
+
+    def __contains__(self, property):
+        return self.store.peek_value(self.id, property) is not MISSING
+
+    def __iter__(self):
+        return iter(self.store.get_properties(self.id))
+
+    def __len__(self):
+        return len(self.store.get_properties(self.id))
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class EntityStore(MutableMapping):
+    """Entity mapping that shares the property layout of each type.
+
+    Every id is interned once and mapped to an integer handle, which indexes
+    the parallel handle_tables / handle_rows arrays locating the entity in
+    the EntityTable of its type. Handles of removed ids are kept in
+    free_handles and given to the next new ids. Lookups return EntityView
+    objects.
+
+    If set, listener is told about every write made through the mapping or
+    its views: entity_inserted(id), entity_removing(id) and
+    property_changed(id, property, old_value, new_value), where MISSING
+    stands in for an absent property. If set, before_write(id) is called
+    before any of those writes touches the entity. load_entity does not
+    notify."""
+
+    def __init__(self):
+        self.tables = {}
+        self.handles = {}
+        self.handle_tables = []
+        self.handle_rows = array("q")
+        self.free_handles = []
+        self.listener = None
+        self.before_write = None
+
+    def get_table(self, type):
+        if type not in self.tables:
+            self.tables[type] = EntityTable(type)
+        return self.tables[type]
+
+    def locate(self, id):
+        handle = self.handles[id]
+        return self.handle_tables[handle], self.handle_rows[handle]
+
+    def load_entity(self, id, entity):
+        id = sys.intern(id)
+        table = self.get_table(entity["@type"])
+        if id in self.handles:
+            handle = self.handles[id]
+            if self.handle_tables[handle] is table:
+                # An entity keeps its row while its type stays the same
+                table.overwrite(self.handle_rows[handle], entity)
+            else:
+                self.handle_tables[handle].clear_row(self.handle_rows[handle])
+                self.handle_rows[handle] = table.append(id, entity)
+                self.handle_tables[handle] = table
+        elif self.free_handles:
+            handle = self.free_handles.pop()
+            self.handle_rows[handle] = table.append(id, entity)
+            self.handle_tables[handle] = table
+            self.handles[id] = handle
+        else:
+            self.handle_rows.append(table.append(id, entity))
+            self.handle_tables.append(table)
+            self.handles[id] = len(self.handle_tables) - 1
+
+    def load_entities(self, ids, entities):
+        # load_entity for a batch of ids that are not in the store yet
+        ids = [sys.intern(x) for x in ids]
+        indexes_by_type = {}
+        for i, entity in enumerate(entities):
+            indexes_by_type.setdefault(entity["@type"], []).append(i)
+        locations = [None] * len(ids)
+        for type, indexes in indexes_by_type.items():
+            table = self.get_table(type)
+            start = len(table.ids)
+            table.extend([ids[i] for i in indexes], [entities[i] for i in indexes])
+            for row, i in enumerate(indexes, start):
+                locations[i] = (table, row)
+        # Handles follow the order of ids, as if loaded one at a time
+        self.handles.update(zip(ids, range(len(self.handle_tables), len(self.handle_tables) + len(ids))))
+        self.handle_tables.extend(x[0] for x in locations)
+        self.handle_rows.extend(x[1] for x in locations)
+
+    def peek_value(self, id, property):
+        table, row = self.locate(id)
+        if property == "@type":
+            return table.type
+        if property in table.columns:
+            return table.columns[property][row]
+        return MISSING
+
+    def get_value(self, id, property):
+        value = self.peek_value(id, property)
+        if value is MISSING:
+            raise KeyError(property)
+        return value
+
+    def set_value(self, id, property, value):
+        old_value = self.peek_value(id, property)
+        if self.before_write is not None:
+            self.before_write(id)
+        if property == "@type":
+            entity = self.to_dict(id)
+            entity["@type"] = value
+            self.load_entity(id, entity)
+        else:
+            table, row = self.locate(id)
+            if property not in table.columns:
+                table.add_column(property)
+            table.columns[property][row] = intern_value(value)
+        if self.listener is not None:
+            self.listener.property_changed(id, property, old_value, value)
+
+    def delete_value(self, id, property):
+        try:
+            assert property != "@type"
+        except AssertionError:
+            raise AssertionError(f"Entity {id} property @type cannot be removed.")
+        old_value = self.get_value(id, property)
+        if self.before_write is not None:
+            self.before_write(id)
+        table, row = self.locate(id)
+        table.columns[property][row] = MISSING
+        if self.listener is not None:
+            self.listener.property_changed(id, property, old_value, MISSING)
+
+    def get_properties(self, id):
+        table, row = self.locate(id)
+        return ["@type"] + [x for x, column in table.columns.items() if column[row] is not MISSING]
+
+    def to_dict(self, id):
+        table, row = self.locate(id)
+        entity = {"@type": table.type}
+        for property, column in table.columns.items():
+            if column[row] is not MISSING:
+                entity[property] = column[row]
+        return entity
+
+    def __getitem__(self, id):
+        if id not in self.handles:
+            raise KeyError(id)
+        return EntityView(self, id)
+
+    def __contains__(self, id):
+        return id in self.handles
+
+    def __setitem__(self, id, entity):
+        if self.before_write is not None:
+            self.before_write(id)
+        if self.listener is not None and id in self.handles:
+            self.listener.entity_removing(id)
+        self.load_entity(id, entity)
+        if self.listener is not None:
+            self.listener.entity_inserted(id)
+
+    def __delitem__(self, id):
+        if self.before_write is not None and id in self.handles:
+            self.before_write(id)
+        if self.listener is not None and id in self.handles:
+            self.listener.entity_removing(id)
+        table, row = self.locate(id)
+        table.clear_row(row)
+        self.free_handles.append(self.handles.pop(id))
+
+    def __iter__(self):
+        return iter(self.handles)
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __repr__(self):
+        return f"EntityStore({len(self.handles)} entities, {len(self.tables)} types)"
+
+class LazyEntities(MutableMapping):
+    """Entity mapping that loads type files on first access.
+
+    Lookups of ids that are not loaded yet load the remaining types one at a
+    time until the id is found, so callers that know the type of an id
+    should load it with ensure_type_loaded first."""
+
+    def __init__(self, types, load_type, entities=None):
+        self.entities = {} if entities is None else entities
+        self.unloaded_types = dict.fromkeys(types)
+        self.load_type = load_type
+
+    def check_if_type_is_loaded(self, type):
+        return type not in self.unloaded_types
+
+    def ensure_type_loaded(self, type):
+        if type in self.unloaded_types:
+            del self.unloaded_types[type]
+            self.load_type(type)
+
+    def ensure_all_types_loaded(self):
+        while self.unloaded_types:
+            self.ensure_type_loaded(next(iter(self.unloaded_types)))
+
+    def load_until_found(self, id):
+        while id not in self.entities and self.unloaded_types:
+            self.ensure_type_loaded(next(iter(self.unloaded_types)))
+        return id in self.entities
+
+    def __getitem__(self, id):
+        if not self.load_until_found(id):
+            raise KeyError(id)
+        return self.entities[id]
+
+    def __contains__(self, id):
+        return self.load_until_found(id)
+
+    def __setitem__(self, id, entity):
+        self.entities[id] = entity
+
+    def __delitem__(self, id):
+        if not self.load_until_found(id):
+            raise KeyError(id)
+        del self.entities[id]
+
+    def __iter__(self):
+        self.ensure_all_types_loaded()
+        return iter(self.entities)
+
+    def __len__(self):
+        self.ensure_all_types_loaded()
+        return len(self.entities)
+
+    def __repr__(self):
+        return f"LazyEntities({len(self.entities)} loaded, {len(self.unloaded_types)} types unloaded)"
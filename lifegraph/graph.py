@@ -1,42 +1,268 @@
-import os
-import json
 from uuid import uuid4
 from schema import Schema
-from fuzzywuzzy import process
+from persistence import MutationLog
+from storage import storage_backends
+from entities import EntityStore, LazyEntities, MISSING
+from search_index import SearchIndex
+from traversal_cache import TraversalCache
+from query import Query
+from audit import IncrementalAuditor, Violation, parallel_audit
+from migrations import Migrations
 import pandas as pd
 import logging
 import functools as ft
+import itertools
+from collections import deque
 
 class Graph:
-    def __init__(self, data_path=None):
+    # Depth at which searches that run into a reference cycle stop, when
+    # they are not given a max_depth
+    cycle_max_depth = 6
+
+    def __init__(self, data_path=None, storage="json", lazy=False):
         self.data_path = data_path
         self.schema = Schema(data_path=self.data_path)
+        self.lazy = lazy and data_path is not None
 
+        # self.entities holds the loaded entities, self.graph is the mapping
+        # callers use (the same store unless loading lazily)
         if data_path is None:
-            self.graph = {}
+            self.entities = EntityStore()
+            self.graph = self.entities
+            self.mutation_log = None
+        else:
+            self.storage = storage_backends[storage](self.data_path)
+            if self.lazy:
+                self.entities = EntityStore()
+                self.graph = LazyEntities(self.get_stored_types(), self.load_type, entities=self.entities)
+            else:
+                self.entities = self.load_graph()
+                self.graph = self.entities
+            self.mutation_log = MutationLog(f"{self.data_path}/graph_log.jsonl")
+        self.build_indexes()
+        self.dirty_types = set()
+        self.entities.listener = self
+        self.schema.listeners.append(self)
+        # Told entity_changed(id, property, old_value, new_value) after every
+        # entity write, with property None when a whole entity is inserted
+        # or removed
+        self.listeners = []
+        self.incremental_auditor = None
+        if self.mutation_log is not None:
+            self.replay_mutation_log()
+            # Stored graphs follow schema property changes, resuming any
+            # migration an earlier session did not finish
+            self.migrations = Migrations(self)
         else:
-            self.graph = self.load_graph()
+            self.migrations = None
+
+    def get_stored_types(self):
+        return [x for x in self.schema.schema.keys() if self.storage.has_type(x)]
 
     def load_graph(self):
-        graph = {}
-        for type in self.schema.schema.keys():
-            type_fn = f"{self.data_path}/graph/{type}.json"
-            if os.path.exists(type_fn):
-                with open(type_fn, "r") as f:
-                    graph.update(json.load(f))
-        return graph
+        entities = EntityStore()
+        for type in self.get_stored_types():
+            for id, entity in self.storage.load_type(type).items():
+                entities.load_entity(id, entity)
+        return entities
+
+    def load_type(self, type):
+        # Only called by LazyEntities, which has already marked the type as loaded
+        for id, entity in self.storage.load_type(type).items():
+            self.entities.load_entity(id, entity)
+            self.index_entity(id)
+
+    def ensure_types_loaded(self, types):
+        if self.lazy:
+            for type in types:
+                self.graph.ensure_type_loaded(type)
+
+    def ensure_types_referencing_loaded(self, type):
+        # Entities of this type can be pointed at through properties that
+        # expect the type itself or any of its ancestors
+        pointed_types = self.schema.get_parent_ids(type) | set([type])
+        self.ensure_types_loaded([
+            x for x in self.schema.schema.keys()
+            if not pointed_types.isdisjoint(self.schema.schema[x]["properties"].values())])
 
     def flat(self, x):
         return [item for sublist in x for item in sublist]
 
     def save_graph(self):
-        data_types = set([self.graph[x]["@type"] for x in self.graph.keys()])
-        for type in data_types:
-            type_fn = f"{self.data_path}/graph/{type}.json"
-            type_entities = [x for x in self.graph.keys() if self.graph[x]["@type"] == type]
-            with open(type_fn, "w") as f:
-                json.dump({k: self.graph[k] for k in type_entities}, f,
-                    indent=4, sort_keys=True)
+        # Entities can be created in types that a lazy graph has not loaded
+        # yet, and the type file is rewritten as a whole
+        self.ensure_types_loaded(list(self.dirty_types))
+        for type in sorted(self.dirty_types):
+            type_entities = self.type_index.get(type, {})
+            if type_entities or self.storage.has_type(type):
+                self.storage.save_type(type, {k: self.entities.to_dict(k) for k in type_entities})
+            self.dirty_types.discard(type)
+
+    def replay_mutation_log(self):
+        for record in self.mutation_log.replay():
+            for id, data in record["entities"].items():
+                self.ensure_types_loaded([data["@type"]])
+                self.insert_entity(id, data)
+
+    def log_mutation(self, op, args, ids):
+        if self.mutation_log is not None:
+            self.mutation_log.append({
+                "op": op,
+                "args": args,
+                "entities": {x: self.entities.to_dict(x) for x in ids}})
+
+    def compact(self):
+        self.save_graph()
+        self.schema.compact()
+        if self.mutation_log is not None:
+            self.mutation_log.truncate()
+
+    def close(self):
+        self.schema.close()
+        if self.mutation_log is not None:
+            self.mutation_log.close()
+
+    def mark_dirty(self, id):
+        self.dirty_types.add(self.graph[id]["@type"])
+
+    def build_indexes(self):
+        # type -> ids of that type and target id -> (source id, property)
+        # edges pointing at it. Inner dicts are used as ordered sets so
+        # lookups keep the insertion order of the graph. These and the
+        # search index are kept up to date by the entity store listener
+        # methods below.
+        self.type_index = {}
+        self.inbound_index = {}
+        self.search_index = SearchIndex()
+        self.traversal_cache = TraversalCache()
+        for id in self.entities.keys():
+            self.index_entity(id)
+
+    def check_if_property_is_reference(self, id, property):
+        return self.schema.get_property_kind(self.entities.peek_value(id, "@type"), property) == "reference"
+
+    def index_edge(self, id, property):
+        value = self.entities.peek_value(id, property)
+        if value is not MISSING and value != "UNKNOWN" and self.check_if_property_is_reference(id, property):
+            self.inbound_index.setdefault(value, {})[(id, property)] = None
+
+    def unindex_edge(self, id, property, value):
+        self.inbound_index.get(value, {}).pop((id, property), None)
+
+    def check_if_property_is_searchable(self, type, property):
+        return self.schema.get_property_kind(type, property) == "string"
+
+    def index_search_value(self, id, property):
+        type = self.entities.peek_value(id, "@type")
+        value = self.entities.peek_value(id, property)
+        if value is not MISSING and self.check_if_property_is_searchable(type, property):
+            self.search_index.add(type, property, id, value)
+
+    def unindex_search_value(self, id, property, value, type=None):
+        if type is None:
+            type = self.entities.peek_value(id, "@type")
+        self.search_index.remove(type, property, id, value)
+
+    def index_entity(self, id):
+        type = self.entities.peek_value(id, "@type")
+        self.type_index.setdefault(type, {})[id] = None
+        # Only reference and string properties are indexed, so look those
+        # up from the schema rather than checking every property
+        for property in self.schema.get_properties_of_kind(type, "reference"):
+            value = self.entities.peek_value(id, property)
+            if value is not MISSING and value != "UNKNOWN":
+                self.inbound_index.setdefault(value, {})[(id, property)] = None
+        for property in self.schema.get_properties_of_kind(type, "string"):
+            value = self.entities.peek_value(id, property)
+            if value is not MISSING:
+                self.search_index.add(type, property, id, value)
+
+    def unindex_entity(self, id):
+        type = self.entities.peek_value(id, "@type")
+        self.type_index.get(type, {}).pop(id, None)
+        for property in self.entities.get_properties(id)[1:]:
+            value = self.entities.peek_value(id, property)
+            self.unindex_edge(id, property, value)
+            self.unindex_search_value(id, property, value, type=type)
+
+    def notify_listeners(self, id, property=None, old_value=None, new_value=None):
+        for listener in self.listeners:
+            listener.entity_changed(id, property, old_value, new_value)
+
+    def entity_inserted(self, id):
+        self.traversal_cache.invalidate_entity(id)
+        self.index_entity(id)
+        self.mark_dirty(id)
+        self.notify_listeners(id)
+
+    def entity_removing(self, id):
+        self.traversal_cache.invalidate_entity(id)
+        self.mark_dirty(id)
+        self.unindex_entity(id)
+        self.notify_listeners(id)
+
+    def property_changed(self, id, property, old_value, new_value):
+        self.traversal_cache.invalidate_entity(id)
+        if property == "@type":
+            self.dirty_types.add(old_value)
+            self.type_index.get(old_value, {}).pop(id, None)
+            # Whether a property is a reference depends on the type
+            for _property in self.entities.get_properties(id)[1:]:
+                value = self.entities.peek_value(id, _property)
+                self.unindex_edge(id, _property, value)
+                self.unindex_search_value(id, _property, value, type=old_value)
+            self.index_entity(id)
+        else:
+            # Only reference and string properties are indexed
+            type = self.entities.peek_value(id, "@type")
+            kind = self.schema.get_property_kind(type, property)
+            if kind == "reference":
+                self.unindex_edge(id, property, old_value)
+                if new_value is not MISSING and new_value != "UNKNOWN":
+                    self.inbound_index.setdefault(new_value, {})[(id, property)] = None
+            elif kind == "string":
+                self.search_index.remove(type, property, id, old_value)
+                if new_value is not MISSING:
+                    self.search_index.add(type, property, id, new_value)
+        self.mark_dirty(id)
+        self.notify_listeners(id, property, old_value, new_value)
+
+    def reindex_properties(self, id):
+        type = self.entities.peek_value(id, "@type")
+        for property in self.entities.get_properties(id)[1:]:
+            value = self.entities.peek_value(id, property)
+            self.unindex_edge(id, property, value)
+            self.unindex_search_value(id, property, value, type=type)
+            self.index_edge(id, property)
+            self.index_search_value(id, property)
+
+    def schema_changed(self, op, args, types):
+        # Property kinds decide what the inbound and search indexes hold and
+        # which properties traversals follow
+        if op in ["add_property", "edit_property", "remove_property", "rename_property", "batch"]:
+            self.traversal_cache.clear()
+            for type in types:
+                for id in list(self.type_index.get(type, {})):
+                    self.reindex_properties(id)
+
+    def insert_entity(self, id, data):
+        self.graph[id] = data
+
+    def set_property(self, id, property, value):
+        self.graph[id][property] = value
+
+    def get_inbound_edges(self, id, property=None):
+        if self.lazy and id in self.graph:
+            self.ensure_types_referencing_loaded(self.graph[id]["@type"])
+        edges = self.inbound_index.get(id, {})
+        return [x for x in edges if property is None or x[1] == property]
+
+    def get_inbound_ids(self, id, property=None, type=None):
+        inbound_ids = {}
+        for source_id, _property in self.get_inbound_edges(id, property):
+            if type is None or self.graph[source_id]["@type"] == type:
+                inbound_ids[source_id] = None
+        return list(inbound_ids)
 
     def create_from_type(self, type):
         type_model = self.schema.show_type(type)
@@ -45,47 +271,57 @@ class Graph:
         for k, v in type_model["properties"].items():
             data[k] = "UNKNOWN"
         uuid = str(uuid4())
-        self.graph[uuid] = data
+        self.insert_entity(uuid, data)
+        self.log_mutation("create_from_type", {"type": type}, [uuid])
         return uuid
 
+    def iter_entity_schema_violations(self, k):
+        entity = self.graph[k]
+        expected_type = entity["@type"]
+        expected_schema = self.schema.schema[expected_type]
+        for property in expected_schema["properties"].keys():
+            if property not in entity:
+                yield Violation(k, property, "missing_property", expected_schema["properties"][property], None, None)
+
+    def iter_entity_pointer_violations(self, k):
+        entity = self.graph[k]
+        data_observed_type = entity["@type"]
+        for property in self.schema.get_properties_of_kind(data_observed_type, "reference"):
+            if property not in entity:
+                continue
+            pointed_entity_id = entity[property]
+            schema_expected_type = self.schema.schema[data_observed_type]["properties"][property]
+            schema_expected_types = self.schema.get_type_with_child_ids(schema_expected_type)
+            try:
+                data_pointed_type = self.graph[pointed_entity_id]["@type"]
+            except KeyError:
+                yield Violation(k, property, "unknown_entity", schema_expected_type, None, pointed_entity_id)
+                continue
+            if data_pointed_type not in schema_expected_types:
+                yield Violation(k, property, "wrong_type", schema_expected_type, data_pointed_type, pointed_entity_id)
+
+    def audit_entity_has_schema_properties(self, k):
+        return [x.message() for x in self.iter_entity_schema_violations(k)]
+
+    def audit_entity_points_to_correct_type(self, k):
+        return [x.message() for x in self.iter_entity_pointer_violations(k)]
+
+    def audit_entity(self, k):
+        return list(self.iter_entity_schema_violations(k)) + list(self.iter_entity_pointer_violations(k))
+
     def audit_entities_have_schema_properties(self, audit_results):
         for k in self.graph.keys():
-            entity = self.graph[k]
-            expected_type = entity["@type"]
-            expected_schema = self.schema.schema[expected_type]
-            for property in expected_schema["properties"].keys():
-                try:
-                    assert property in entity.keys()
-                except AssertionError:
-                    audit_results.append(f"Entity {k} is missing required property {property}")
-                    pass
+            audit_results.extend(self.audit_entity_has_schema_properties(k))
         return audit_results
 
     def audit_entity_properties_point_to_correct_type(self, audit_results):
         for k in self.graph.keys():
-            entity = self.graph[k]
-            data_observed_type = entity["@type"]
-            for property in entity.keys():
-                if property != "@type":
-                    pointed_entity_id = entity[property]
-                    schema_expected_type = self.schema.schema[data_observed_type]["properties"][property]
-                    if schema_expected_type not in self.schema.leaf_types:
-                        schema_expected_types = list(self.schema.get_child_ids(schema_expected_type)) + [schema_expected_type]
-                        try:
-                            data_pointed_type = self.graph[pointed_entity_id]["@type"]
-                        except KeyError:
-                            audit_results.append(f"Entity '{k}' property '{property}' points to unknown entity '{pointed_entity_id}'. Expected type '{schema_expected_type}'.")
-                            continue
-
-                        try:
-                            assert data_pointed_type in schema_expected_types
-                        except AssertionError:
-                            audit_results.append(f"Entity '{k}' property '{property}' points to entity '{pointed_entity_id}' of type '{data_pointed_type}'. Expected type '{schema_expected_type}'.")
-                            pass
+            audit_results.extend(self.audit_entity_points_to_correct_type(k))
         return audit_results
 
     def get_ids_of_type(self, type):
-        return [x for x in self.graph.keys() if self.graph[x]["@type"] == type]
+        self.ensure_types_loaded([type])
+        return list(self.type_index.get(type, {}))
 
     def raise_if_id_not_in_graph(self, id):
         try:
@@ -93,16 +329,31 @@ class Graph:
         except AssertionError:
             raise AssertionError(f"Entity {id} not in graph.")
 
-    def audit(self):
-        audit_results = []
-        audit_results = self.audit_entities_have_schema_properties(audit_results)
-        audit_results = self.audit_entity_properties_point_to_correct_type(audit_results)
-        return audit_results
+    def audit(self, processes=1):
+        if processes != 1:
+            return parallel_audit(self, processes=processes)
+        return [x.message() for x in self.iter_audit()]
+
+    def iter_audit(self, limit=None):
+        # Yields Violation records in the order audit() lists its messages,
+        # stopping after limit of them
+        violations = itertools.chain(
+            (x for k in self.graph.keys() for x in self.iter_entity_schema_violations(k)),
+            (x for k in self.graph.keys() for x in self.iter_entity_pointer_violations(k)))
+        return itertools.islice(violations, limit)
+
+    def audit_incremental(self):
+        # Returns the (new, resolved) violations since the previous call. The
+        # first call audits every entity.
+        if self.incremental_auditor is None:
+            self.incremental_auditor = IncrementalAuditor(self)
+        return self.incremental_auditor.check()
 
     def create_from_copy(self, id):
         self.raise_if_id_not_in_graph(id)
         uuid = str(uuid4())
-        self.graph[uuid] = self.graph[id].copy()
+        self.insert_entity(uuid, self.graph[id].copy())
+        self.log_mutation("create_from_copy", {"id": id}, [uuid])
         return uuid
 
     def create_from_smart_copy(self, id):
@@ -124,23 +375,17 @@ class Graph:
             else:
                 data[property] = self.graph[id][property]
         uuid = str(uuid4())
-        self.graph[uuid] = data
+        self.insert_entity(uuid, data)
+        self.log_mutation("create_from_smart_copy", {"id": id}, [uuid])
         return uuid
 
-    def search(self, value, type=None):
-        # DEV: In the future this could also have a constraint for property name
-        if type:
-            search_ids = self.get_ids_of_type(type)
-        else:
-            search_ids = self.graph.keys()
-        search_properties = self.schema.get_all_string_properties()
-        search_candidates = []
-        for id in search_ids:
-            for type, property in search_properties:
-                if self.graph[id]["@type"] == type:
-                    search_candidates.append((id, self.graph[id][property]))
-        match = process.extract(value, [x[1] for x in search_candidates], limit=1)
-        return [x[0] for x in search_candidates if x[1] == match[0][0]]
+    def search(self, value, type=None, property=None, limit=1):
+        if type is not None:
+            self.ensure_types_loaded([type])
+        elif self.lazy:
+            self.graph.ensure_all_types_loaded()
+        return self.search_index.search(value, type=type, property=property, limit=limit,
+            sort_key=self.entities.handles.get)
 
     def raise_if_ids_not_the_same_type(self, ids):
         type = self.graph[ids[0]]["@type"]
@@ -150,36 +395,188 @@ class Graph:
         except AssertionError:
             raise AssertionError(f"IDs point to more than one type: {', '.join(list(id_types))}.")
 
-    def search_out_from_id_property(self, id, property):
-        original_id, original_property = id, property
-        ids_to_explore = [(0, id, [property])]
+    def search_out_from_id_property(self, id, property, max_depth=None, unknown="skip"):
+        # Paths out of (id, property), breadth first. Entities already on the
+        # path to an entity are not followed again, so cycles end. Searches
+        # that run into a reference cycle stop at depth cycle_max_depth
+        # unless max_depth is given, as the paths around a cycle multiply
+        # with every lap. Edges to "UNKNOWN" or missing values are skipped,
+        # included with type "UNKNOWN" or raise an AssertionError, depending
+        # on unknown.
+        if max_depth is not None and (id, property) not in self.traversal_cache:
+            rows = self.iter_paths_out(id, property, max_depth)
+        else:
+            rows = self.get_paths_out(id, property)
+            if rows is None:
+                # Paths around reference cycles depend on the path taken, so
+                # they are searched directly and not cached
+                rows = self.iter_paths_out(id, property, self.cycle_max_depth if max_depth is None else max_depth)
         paths_out = []
-        while len(ids_to_explore) > 0:
-            (depth, id, properties) = ids_to_explore[0]
-            id_type = self.graph[id]["@type"]
-            for property in properties:
-                schema_expected_type = self.schema.schema[id_type]["properties"][property]
-                if schema_expected_type not in self.schema.leaf_types:
-                    pointed_id = self.graph[id][property]
-                    pointed_id_type = self.graph[pointed_id]["@type"]
-                    pointed_id_properties = [x for x in self.schema.schema[pointed_id_type]["properties"].keys() if x != "@tyoe"]
-                    ids_to_explore.append((depth+1, pointed_id, pointed_id_properties))
-                    paths_out.append({
-                        "original_id": original_id,
-                        "original_property": original_property,
-                        "depth": depth,
-                        "pointing_property": property,
-                        "pointed_id": pointed_id,
-                        "pointed_id_type": pointed_id_type})
-
-            del ids_to_explore[0]
+        for depth, pointing_property, pointed_id, pointed_id_type in rows:
+            if max_depth is not None and depth > max_depth:
+                break
+            if pointed_id_type is None:
+                if unknown == "skip":
+                    continue
+                self.raise_if_unknown_edge_not_allowed(id, pointing_property, unknown)
+                pointed_id_type = "UNKNOWN"
+            paths_out.append({
+                "original_id": id,
+                "original_property": property,
+                "depth": depth,
+                "pointing_property": pointing_property,
+                "pointed_id": pointed_id,
+                "pointed_id_type": pointed_id_type})
         return paths_out
 
-    def categorical_aggregation_groups(self, ids):
+    def iter_out_from_id_property(self, id, property, max_depth=None, unknown="skip"):
+        # Generator version of search_out_from_id_property, which searches
+        # as it goes instead of building (and caching) every path first
+        for depth, pointing_property, pointed_id, pointed_id_type in self.iter_paths_out(id, property, max_depth):
+            if pointed_id_type is None:
+                if unknown == "skip":
+                    continue
+                self.raise_if_unknown_edge_not_allowed(id, pointing_property, unknown)
+                pointed_id_type = "UNKNOWN"
+            yield {
+                "original_id": id,
+                "original_property": property,
+                "depth": depth,
+                "pointing_property": pointing_property,
+                "pointed_id": pointed_id,
+                "pointed_id_type": pointed_id_type}
+
+    def raise_if_unknown_edge_not_allowed(self, id, property, unknown):
+        try:
+            assert unknown == "include"
+        except AssertionError:
+            raise AssertionError(f"Paths out of entity '{id}' reach an unknown value of property '{property}'.")
+
+    def get_pointed_id(self, id, property):
+        # Returns the pointed id and its type. The type is None for unknown
+        # values, returned as "UNKNOWN", and for ids not in the graph
+        if self.lazy:
+            id_type = self.entities.peek_value(id, "@type")
+            schema_expected_type = self.schema.schema[id_type]["properties"][property]
+            self.ensure_types_loaded(self.schema.get_type_with_child_ids(schema_expected_type))
+        pointed_id = self.entities.peek_value(id, property)
+        if pointed_id is MISSING or pointed_id == "UNKNOWN":
+            return "UNKNOWN", None
+        if pointed_id in self.entities:
+            return pointed_id, self.entities.peek_value(pointed_id, "@type")
+        if pointed_id in self.graph:
+            return pointed_id, self.graph[pointed_id]["@type"]
+        return pointed_id, None
+
+    def check_if_property_is_followed(self, id, property):
+        return self.schema.get_property_kind(self.graph[id]["@type"], property) == "reference"
+
+    def iter_pointed_ids(self, id):
+        for property in self.schema.get_properties_of_kind(self.graph[id]["@type"], "reference"):
+            pointed_id, pointed_id_type = self.get_pointed_id(id, property)
+            if pointed_id_type is not None:
+                yield pointed_id
+
+    def check_if_reaches_cycle(self, id, reaches_cycle):
+        # Whether a reference cycle can be reached from id, searched depth
+        # first. reaches_cycle maps ids to the answer, or to None while they
+        # are on the search path, and can be shared between calls.
+        if id not in reaches_cycle:
+            reaches_cycle[id] = None
+            # [id, pointed ids left to search, reaches a cycle]
+            stack = [[id, self.iter_pointed_ids(id), False]]
+            while stack:
+                entry = stack[-1]
+                for pointed_id in entry[1]:
+                    if pointed_id not in reaches_cycle:
+                        reaches_cycle[pointed_id] = None
+                        stack.append([pointed_id, self.iter_pointed_ids(pointed_id), False])
+                        break
+                    if reaches_cycle[pointed_id] is not False:
+                        entry[2] = True
+                else:
+                    stack.pop()
+                    reaches_cycle[entry[0]] = entry[2]
+                    if stack and entry[2]:
+                        stack[-1][2] = True
+        return reaches_cycle[id]
+
+    def iter_paths_out(self, id, property, max_depth=None):
+        # Yields (depth, pointing_property, pointed_id, pointed_id_type) rows.
+        # Each queued entity carries the entities on its path, which it does
+        # not follow again.
+        if not self.check_if_property_is_followed(id, property):
+            return
+        ids_to_explore = deque([(0, id, [property], frozenset([id]))])
+        while ids_to_explore:
+            depth, id, properties, path = ids_to_explore.popleft()
+            for property in properties:
+                pointed_id, pointed_id_type = self.get_pointed_id(id, property)
+                yield (depth, property, pointed_id, pointed_id_type)
+                if pointed_id_type is None or pointed_id in path:
+                    continue
+                if max_depth is None or depth < max_depth:
+                    ids_to_explore.append((
+                        depth + 1,
+                        pointed_id,
+                        self.schema.get_properties_of_kind(pointed_id_type, "reference"),
+                        path | set([pointed_id])))
+
+    def get_paths_out(self, id, property):
+        # Breadth first paths out of (id, property), built from the cached
+        # paths out of the pointed entity's own reference properties. Keys
+        # are expanded iteratively: first to queue the keys they need, then,
+        # once those are cached, to combine them. Returns None if the paths
+        # run into a reference cycle.
+        root_key = (id, property)
+        keys_to_explore = [root_key]
+        expanding = set()
+        while keys_to_explore:
+            key = keys_to_explore[-1]
+            if key in self.traversal_cache:
+                keys_to_explore.pop()
+                continue
+            id, property = key
+            if not self.check_if_property_is_followed(id, property):
+                self.traversal_cache.put(key, (), [id], [])
+                keys_to_explore.pop()
+                continue
+            pointed_id, pointed_id_type = self.get_pointed_id(id, property)
+            if pointed_id_type is None:
+                # A missing id becomes known once it is inserted
+                self.traversal_cache.put(key, ((0, property, pointed_id, None), ), [id, pointed_id], [])
+                keys_to_explore.pop()
+                continue
+            child_keys = [(pointed_id, x) for x in self.schema.get_properties_of_kind(pointed_id_type, "reference")]
+
+            if key not in expanding:
+                expanding.add(key)
+                for child_key in child_keys:
+                    if child_key in expanding and child_key not in self.traversal_cache:
+                        return None
+                    keys_to_explore.append(child_key)
+                continue
+
+            # Rows of each child are in breadth first order, so merging them
+            # depth by depth keeps the order of a single breadth first search
+            rows_by_depth = {}
+            for child_key in child_keys:
+                for depth, pointing_property, _pointed_id, _pointed_id_type in self.traversal_cache.get(child_key):
+                    rows_by_depth.setdefault(depth + 1, []).append(
+                        (depth + 1, pointing_property, _pointed_id, _pointed_id_type))
+            rows = [(0, property, pointed_id, pointed_id_type)]
+            for depth in sorted(rows_by_depth):
+                rows.extend(rows_by_depth[depth])
+            self.traversal_cache.put(key, tuple(rows), [id, pointed_id], child_keys)
+            expanding.discard(key)
+            keys_to_explore.pop()
+        return self.traversal_cache.get(root_key)
+
+    def categorical_aggregation_groups(self, ids, max_depth=None):
         self.raise_if_ids_not_the_same_type(ids)
         [self.raise_if_id_not_in_graph(x) for x in ids]
 
-        expected_properties = self.schema.schema[self.graph[ids[0]]["@type"]]["properties"].keys()
+        expected_properties = self.schema.get_properties_of_kind(self.graph[ids[0]]["@type"], "reference")
         search_starts = []
         for id in ids:
             for property in expected_properties:
@@ -187,28 +584,84 @@ class Graph:
 
         aggregation_paths = []
         for id, property in search_starts:
-            agg_paths_out = self.search_out_from_id_property(id, property)
+            agg_paths_out = self.search_out_from_id_property(id, property, max_depth=max_depth)
             if agg_paths_out:
                 aggregation_paths.append(agg_paths_out)
 
         return pd.DataFrame(self.flat(aggregation_paths))
 
-    def categorical_aggregation_paths(self, ids):
-        aggregation_groups = self.categorical_aggregation_groups(ids)
-        aggregation_paths = aggregation_groups.groupby(
-            ["depth", "pointing_property", "pointed_id_type"], as_index=False
-        ).agg({"pointed_id": [pd.Series.nunique, "count"]})
-        aggregation_paths.columns = ["depth", "pointing_property", "aggregation_type", "n_groups", "aggregation_proportion"]
-        aggregation_paths["aggregation_proportion"] = aggregation_paths["aggregation_proportion"] / len(ids)
+    def categorical_aggregation_paths(self, ids, max_depth=None):
+        self.raise_if_ids_not_the_same_type(ids)
+        [self.raise_if_id_not_in_graph(x) for x in ids]
+
+        # Paths are followed a depth at a time from the schema: the frontier
+        # maps each type reached at this depth to the entities reached, and
+        # every reference property of the type is followed for all of them
+        # at once. This gives the same paths as a search out of every
+        # (id, property), so each path carries the depth its search stops
+        # at. Paths are kept as (id, parent path) pairs, cheaper to extend
+        # than sets for the short paths aggregations follow
+        type = self.graph[ids[0]]["@type"]
+        frontier = {}
+        reaches_cycle = {}
+        for property in self.schema.get_properties_of_kind(type, "reference"):
+            for id in ids:
+                search_max_depth = max_depth
+                if max_depth is None:
+                    pointed_id, pointed_id_type = self.get_pointed_id(id, property)
+                    if pointed_id_type is not None and self.check_if_reaches_cycle(pointed_id, reaches_cycle):
+                        search_max_depth = self.cycle_max_depth
+                frontier.setdefault(type, []).append(((id, None), property, search_max_depth))
+        pointed_ids_by_path = {}
+        depth = 0
+        while frontier:
+            next_frontier = {}
+            for type, searches in frontier.items():
+                for property in self.schema.get_properties_of_kind(type, "reference"):
+                    for path, start_property, search_max_depth in searches:
+                        # Only the starting property is followed at depth 0
+                        if depth == 0 and property != start_property:
+                            continue
+                        pointed_id, pointed_id_type = self.get_pointed_id(path[0], property)
+                        # Unknown edges and cycles end a path, as in
+                        # search_out_from_id_property
+                        if pointed_id_type is None:
+                            continue
+                        pointed_ids_by_path.setdefault((depth, property, pointed_id_type), []).append(pointed_id)
+                        if search_max_depth is not None and depth >= search_max_depth:
+                            continue
+                        if not self.check_if_id_on_path(pointed_id, path):
+                            next_frontier.setdefault(pointed_id_type, []).append(
+                                ((pointed_id, path), start_property, search_max_depth))
+            frontier = next_frontier
+            depth += 1
+
+        aggregation_paths = pd.DataFrame(
+            [(*path, len(set(x)), len(x) / len(ids)) for path, x in sorted(pointed_ids_by_path.items())],
+            columns=["depth", "pointing_property", "aggregation_type", "n_groups", "aggregation_proportion"])
         return aggregation_paths
 
+    def check_if_id_on_path(self, id, path):
+        while path is not None:
+            if path[0] == id:
+                return True
+            path = path[1]
+        return False
+
     def categorical_aggregation(self,
         ids,
         value_property,
         aggregation_fun,
-        aggregations):
+        aggregations,
+        q=0.5,
+        max_depth=None):
+        # aggregation_fun is the name of a built in reduction ("mean", "sum",
+        # "count", "min", "max", "median" or "quantile" of q) or a function
+        # called with the list of values of each group
 
-        aggregation_groups = self.categorical_aggregation_groups(ids)
+        self.raise_if_ids_not_the_same_type(ids)
+        self.schema.raise_if_property_not_on_type(self.graph[ids[0]]["@type"], value_property)
+        aggregation_groups = self.categorical_aggregation_groups(ids, max_depth=max_depth)
         aggregation_lookups = []
         with pd.option_context('display.max_rows', None, 'display.max_columns', None):
             for i, aggregation in enumerate(aggregations):
@@ -225,16 +678,50 @@ class Graph:
             aggregation_lookups)
         group_columns = list(aggregation_join_table.drop("original_id", axis=1).columns)
 
-        aggregated = []
+        # Look every value up once into a column, then let pandas group it.
+        # Entities without the property get None.
+        aggregation_join_table["value"] = [
+            None if value is MISSING else value
+            for value in (self.entities.peek_value(x, value_property) for x in aggregation_join_table["original_id"])]
+        if isinstance(aggregation_fun, str):
+            self.raise_if_aggregation_not_supported(aggregation_fun)
+            # Missing and UNKNOWN values are skipped, as pandas skips NaN.
+            # count, min and max also work on strings and dates.
+            values = aggregation_join_table["value"].where(
+                aggregation_join_table["value"].map(lambda x: x is not None and x != "UNKNOWN"))
+            if aggregation_fun in ["mean", "sum", "median", "quantile"]:
+                values = pd.to_numeric(values, errors="coerce")
+            grouped = values.groupby([aggregation_join_table[x] for x in group_columns])
+            if aggregation_fun == "quantile":
+                result = grouped.quantile(q)
+            else:
+                result = getattr(grouped, aggregation_fun)()
+        else:
+            grouped = aggregation_join_table.groupby(group_columns)["value"]
+            result = grouped.agg(lambda x: aggregation_fun(list(x)))
 
-        for name, group in aggregation_join_table.groupby(group_columns):
-            vals = [self.graph[x][value_property] for x in group["original_id"]]
+        aggregated = []
+        for name, value in result.items():
             aggregated.append({
-                "value": aggregation_fun(vals),
-                "group": name
+                "value": value.item() if hasattr(value, "item") else value,
+                "group": name if isinstance(name, tuple) else (name, )
             })
         return aggregated
 
+    def raise_if_aggregation_not_supported(self, aggregation_fun):
+        try:
+            assert aggregation_fun in ["mean", "sum", "count", "min", "max", "median", "quantile"]
+        except AssertionError:
+            raise AssertionError(f"Aggregation {aggregation_fun} is not supported.")
+
+    def iter_query(self, text):
+        # Streams QueryRow results of a question such as
+        # "@person (constraint: hometown -> London) -> employer -> @company"
+        return Query(self, text).iter_rows()
+
+    def query(self, text):
+        return list(self.iter_query(text))
+
     def get_expected_pointed_type(self, id, property):
         self.raise_if_id_not_in_graph(id)
         entity_type = self.graph[id]["@type"]
@@ -253,7 +740,98 @@ class Graph:
         expected_type = self.get_expected_pointed_type(id, property)
         if expected_type not in self.schema.leaf_types:
             self.raise_if_id_not_expected_type(value, expected_type)
-        self.graph[id][property] = value
+        self.set_property(id, property, value)
+        self.log_mutation("edit_property", {"id": id, "property": property, "value": value}, [id])
+
+    def bulk_ingest(self, records):
+        # Creates one entity per record and returns their ids in record order.
+        # A record holds "@type", property values and optionally a "@key" that
+        # other records in the batch can point to with {"@ref": key}.
+        # Everything is validated before anything is inserted.
+        records = list(records)
+        ids = [str(uuid4()) for _ in records]
+        keys = {}
+        for i, record in enumerate(records):
+            if "@key" in record:
+                self.raise_if_key_in_batch(record["@key"], keys)
+                keys[record["@key"]] = i
+
+        entities = [None] * len(records)
+        for type, indexes in self.group_records_by_type(records).items():
+            self.schema.raise_if_type_not_in_schema(type)
+            properties = self.schema.schema[type]["properties"]
+            reference_properties = set(self.schema.get_properties_of_kind(type, "reference"))
+            unknown_entity = {"@type": type, **dict.fromkeys(properties, "UNKNOWN")}
+            for i in indexes:
+                data = unknown_entity.copy()
+                for property, value in records[i].items():
+                    if property in ["@type", "@key"]:
+                        continue
+                    if property not in properties:
+                        self.schema.raise_if_property_not_on_type(type, property)
+                    if property in reference_properties and value != "UNKNOWN":
+                        value, pointed_type = self.resolve_bulk_reference(value, keys, records, ids)
+                        self.raise_if_type_not_expected_type(value, pointed_type, properties[property])
+                    data[property] = value
+                entities[i] = data
+
+        # Every entity is new, so they are loaded without notifying the
+        # entity store listener and indexed here in one pass, with the
+        # schema looked up once per type
+        if self.entities.before_write is not None:
+            for id in ids:
+                self.entities.before_write(id)
+        self.entities.load_entities(ids, entities)
+        types = set(x["@type"] for x in entities)
+        reference_properties = {x: self.schema.get_properties_of_kind(x, "reference") for x in types}
+        string_properties = {x: self.schema.get_properties_of_kind(x, "string") for x in types}
+        for id, data in zip(ids, entities):
+            type = data["@type"]
+            self.type_index.setdefault(type, {})[id] = None
+            for property in reference_properties[type]:
+                if data[property] != "UNKNOWN":
+                    self.inbound_index.setdefault(data[property], {})[(id, property)] = None
+            for property in string_properties[type]:
+                self.search_index.add(type, property, id, data[property])
+        # The new ids may be pointed to by references that were unknown
+        self.traversal_cache.clear()
+        self.dirty_types.update(types)
+        for id in ids:
+            self.notify_listeners(id)
+        self.log_mutation("bulk_ingest", {"n": len(ids)}, ids)
+        return ids
+
+    def group_records_by_type(self, records):
+        records_by_type = {}
+        for i, record in enumerate(records):
+            try:
+                type = record["@type"]
+            except KeyError:
+                raise AssertionError(f"Record {i} has no @type.")
+            records_by_type.setdefault(type, []).append(i)
+        return records_by_type
+
+    def raise_if_key_in_batch(self, key, keys):
+        try:
+            assert key not in keys
+        except AssertionError:
+            raise AssertionError(f"Key {key} is used by more than one record.")
+
+    def resolve_bulk_reference(self, value, keys, records, ids):
+        if isinstance(value, dict):
+            try:
+                i = keys[value["@ref"]]
+            except KeyError:
+                raise AssertionError(f"Reference {value.get('@ref')} not in batch.")
+            return ids[i], records[i]["@type"]
+        self.raise_if_id_not_in_graph(value)
+        return value, self.graph[value]["@type"]
+
+    def raise_if_type_not_expected_type(self, id, observed_type, expected_type):
+        try:
+            assert observed_type in self.schema.get_type_with_child_ids(expected_type)
+        except AssertionError:
+            raise AssertionError(f"Entity '{id}' has type '{observed_type}'. Expected type '{expected_type}'.")
 
     # then actually try to use the graph for something messy & record the pain points (changing / migrating schema etc)
 
@@ -0,0 +1,135 @@
+import time
+import pandas as pd
+from entities import MISSING
+
+class ImportReport():
+    """Row counts and timing of one import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.rejections = []
+        self.seconds = 0.0
+
+    def reject(self, row, reason, max_rejections):
+        self.rejected += 1
+        if len(self.rejections) < max_rejections:
+            self.rejections.append((row, reason))
+
+    def get_throughput(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return (
+            f"Imported {self.imported} of {self.rows} rows ({self.rejected} rejected) "
+            f"in {self.seconds:.2f}s, {self.get_throughput():.0f} rows/s")
+
+def read_chunks(fn, columns, chunksize):
+    # Every column is read as a string, values are converted per property
+    if fn.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading parquet files requires pyarrow.")
+        for batch in pq.ParquetFile(fn).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas().astype("string")
+    else:
+        yield from pd.read_csv(
+            fn, usecols=columns, chunksize=chunksize, dtype="string", keep_default_na=False)
+
+class Importer():
+    """Streams rows of a CSV or Parquet file into entities of one type.
+
+    mapping is {column: property}. Reference properties are resolved to
+    existing entities by id or, if reference_keys names a key property of
+    the pointed type ({property: key_property}), by an exact match on that
+    property. With search=True values without an exact match fall back to
+    the best Graph.search match. Rows with values that cannot be converted
+    or resolved are rejected and counted; everything else is inserted with
+    Graph.bulk_ingest one chunk at a time."""
+
+    def __init__(self, graph, type, mapping, reference_keys=None, search=False, chunksize=10_000, max_rejections=100):
+        self.graph = graph
+        self.type = type
+        self.mapping = mapping
+        self.reference_keys = {} if reference_keys is None else reference_keys
+        self.search = search
+        self.chunksize = chunksize
+        self.max_rejections = max_rejections
+        self.reference_lookups = {}
+
+        self.graph.schema.raise_if_type_not_in_schema(type)
+        for property in mapping.values():
+            self.graph.schema.raise_if_property_not_on_type(type, property)
+
+    def get_reference_lookup(self, property):
+        # value of the key property -> id, for entities of the pointed type
+        if property not in self.reference_lookups:
+            expected_type = self.graph.schema.schema[self.type]["properties"][property]
+            key_property = self.reference_keys.get(property)
+            lookup = {}
+            for type in self.graph.schema.get_type_with_child_ids(expected_type):
+                for id in self.graph.get_ids_of_type(type):
+                    key = id if key_property is None else self.graph.entities.peek_value(id, key_property)
+                    if key is not MISSING and key != "UNKNOWN":
+                        lookup.setdefault(str(key), id)
+            self.reference_lookups[property] = lookup
+        return self.reference_lookups[property]
+
+    def search_reference(self, property, value):
+        expected_type = self.graph.schema.schema[self.type]["properties"][property]
+        ids = self.graph.search(value, type=expected_type, property=self.reference_keys.get(property))
+        return ids[0] if ids else None
+
+    def convert_column(self, property, column):
+        # Returns the converted column and a mask of rows it could not convert
+        kind = self.graph.schema.get_property_kind(self.type, property)
+        if kind == "integer":
+            converted = pd.to_numeric(column, errors="coerce")
+            invalid = converted.isna() | (converted != converted.round())
+            return converted.astype("Int64").where(~invalid).astype(object), invalid
+        if kind == "reference":
+            lookup = self.get_reference_lookup(property)
+            converted = column.map(lookup).astype(object)
+            invalid = converted.isna()
+            if self.search and invalid.any():
+                for value in column[invalid].unique():
+                    id = self.search_reference(property, value)
+                    if id is not None:
+                        # Remember the match for the rest of the file
+                        lookup[value] = id
+                converted = column.map(lookup).astype(object)
+                invalid = converted.isna()
+            return converted, invalid
+        return column.astype(object), pd.Series(False, index=column.index)
+
+    def import_chunk(self, chunk, report):
+        records = pd.DataFrame(index=chunk.index)
+        rejected = pd.Series(False, index=chunk.index)
+        for column, property in self.mapping.items():
+            values = chunk[column]
+            # Empty cells are unknown values rather than errors
+            empty = values.isna() | (values == "")
+            converted, invalid = self.convert_column(property, values[~empty])
+            invalid = invalid.reindex(chunk.index, fill_value=False)
+            for row in invalid[invalid & ~rejected].index:
+                report.reject(int(row), f"Column {column} value {values[row]!r} is not a valid {property}.", self.max_rejections)
+            rejected |= invalid
+            records[property] = converted.reindex(chunk.index).where(~empty, "UNKNOWN")
+
+        records = records[~rejected]
+        records.insert(0, "@type", self.type)
+        self.graph.bulk_ingest(records.to_dict("records"))
+        report.rows += len(chunk)
+        report.imported += len(records)
+
+    def import_file(self, fn):
+        report = ImportReport()
+        start = time.perf_counter()
+        for chunk in read_chunks(fn, list(self.mapping), self.chunksize):
+            # Row numbers in rejections count data rows from 0
+            chunk.index = pd.RangeIndex(report.rows, report.rows + len(chunk))
+            self.import_chunk(chunk, report)
+        report.seconds = time.perf_counter() - start
+        return report
@@ -0,0 +1,139 @@
+import os
+import json
+from persistence import write_json_atomic
+
+class Migrations():
+    """Rewrites graph data to follow schema property changes.
+
+    Every add, remove, rename or edit of a property becomes a migration
+    over the changed type and its subtypes, applied one type at a time in
+    chunks of entities: added properties are set to "UNKNOWN", removed ones
+    are dropped and renamed ones are moved. Edited properties are re-checked
+    against their new type and the values that no longer fit are recorded
+    as audit Violations rather than thrown away.
+
+    Pending migrations and their progress are saved to migrations.json in
+    the graph's data path after every chunk, and resumed when the graph is
+    next opened. A migration is saved before its schema change is logged,
+    with the size of the schema log at that point, so it cannot be lost
+    between the two; one whose change never reached the log is dropped.
+    A Graph with a data path creates its own Migrations when it opens;
+    in-memory graphs only migrate if one is created for them.
+    Each step only changes entities that still need it, so repeating part
+    of a chunk after a crash is harmless."""
+
+    migration_ops = ["add_property", "remove_property", "rename_property", "edit_property"]
+
+    def __init__(self, graph, auto=True, chunk_size=10_000):
+        self.graph = graph
+        self.auto = auto
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.completed = []
+        if graph.data_path is not None:
+            self.fn = f"{graph.data_path}/migrations.json"
+            if os.path.exists(self.fn):
+                with open(self.fn, "r") as f:
+                    self.pending = json.load(f)["pending"]
+        else:
+            self.fn = None
+        graph.schema.before_log = self.queue
+        graph.schema.listeners.append(self)
+        self.drop_unlogged()
+        if self.auto and self.pending:
+            self.run()
+
+    def save(self):
+        if self.fn is not None:
+            write_json_atomic(self.fn, {"pending": self.pending})
+
+    def get_schema_log_size(self):
+        mutation_log = self.graph.schema.mutation_log
+        return None if mutation_log is None else mutation_log.size()
+
+    def queue(self, op, args, types):
+        # Called by the schema before the change is logged
+        mutations = args["mutations"] if op == "batch" else [{"op": op, "args": args}]
+        for mutation in mutations:
+            if mutation["op"] in self.migration_ops:
+                self.pending.append({
+                    "op": mutation["op"],
+                    "args": mutation["args"],
+                    "types": sorted(self.graph.schema.get_type_with_child_ids(mutation["args"]["id"])),
+                    "done_types": [],
+                    "position": 0,
+                    "violations": [],
+                    "logged": False,
+                    "schema_log_size": self.get_schema_log_size()})
+        self.save()
+
+    def schema_changed(self, op, args, types):
+        for migration in self.pending:
+            migration["logged"] = True
+        self.save()
+        if self.auto:
+            self.run()
+
+    def drop_unlogged(self):
+        # A migration not yet marked as logged was saved just before a
+        # crash. Its change was logged if the schema log, whose torn
+        # records the schema has already dropped, grew past the saved size.
+        schema_log_size = self.get_schema_log_size()
+        if any(not x["logged"] for x in self.pending):
+            self.pending = [
+                x for x in self.pending
+                if x["logged"] or schema_log_size is None or x["schema_log_size"] < schema_log_size]
+            for migration in self.pending:
+                migration["logged"] = True
+            self.save()
+
+    def run(self):
+        # Applies pending migrations in order, returning the ones completed
+        completed = []
+        while self.pending:
+            migration = self.pending[0]
+            for type in migration["types"]:
+                if type not in migration["done_types"]:
+                    self.migrate_type(migration, type)
+                    migration["done_types"].append(type)
+                    migration["position"] = 0
+                    self.save()
+            completed.append(self.pending.pop(0))
+            self.save()
+        self.completed.extend(completed)
+        return completed
+
+    def migrate_type(self, migration, type):
+        # Sorted, as rewritten entities move in the type index and position
+        # has to point at the same entity when resuming
+        ids = sorted(self.graph.get_ids_of_type(type))
+        for start in range(migration["position"], len(ids), self.chunk_size):
+            changed_ids = []
+            for id in ids[start:start + self.chunk_size]:
+                if self.migrate_entity(migration, id):
+                    changed_ids.append(id)
+            if changed_ids:
+                self.graph.log_mutation(f"migrate_{migration['op']}", migration["args"], changed_ids)
+            migration["position"] = start + self.chunk_size
+            self.save()
+
+    def migrate_entity(self, migration, id):
+        # Returns whether the entity changed
+        entity = self.graph.graph[id]
+        property = migration["args"]["property"]
+        if migration["op"] == "add_property" and property not in entity:
+            entity[property] = "UNKNOWN"
+            return True
+        if migration["op"] == "remove_property" and property in entity:
+            del entity[property]
+            return True
+        if migration["op"] == "rename_property" and property in entity:
+            value = entity[property]
+            del entity[property]
+            entity[migration["args"]["new_property"]] = value
+            return True
+        if migration["op"] == "edit_property":
+            for violation in self.graph.iter_entity_pointer_violations(id):
+                if violation.property == property and violation.pointed_id != "UNKNOWN":
+                    migration["violations"].append(list(violation))
+        return False
@@ -0,0 +1,77 @@
+import os
+import json
+import tempfile
+
+# The umask is read once, as reading it means briefly changing it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def replace_file(tmp_fn, fn):
+    # tempfile creates files only the owner can read, so the file taking
+    # fn's place gets fn's mode, or the mode open() gives a new file
+    try:
+        mode = os.stat(fn).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+    os.chmod(tmp_fn, mode)
+    os.replace(tmp_fn, fn)
+
+def write_json_atomic(fn, data):
+    dir_name = os.path.dirname(fn) or "."
+    with tempfile.NamedTemporaryFile("w", dir=dir_name, suffix=".tmp", delete=False) as f:
+        try:
+            json.dump(data, f, indent=4, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.remove(f.name)
+            raise
+    replace_file(f.name, fn)
+
+class MutationLog():
+    """Append-only JSON lines log of mutations made since the last snapshot.
+
+    Records hold the state of everything the mutation touched, so replaying
+    a record twice (e.g. after a crash mid-compaction) is harmless."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.file = None
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        if self.file is None:
+            self.file = open(self.fn, "a", encoding="utf-8")
+        self.file.write("".join(json.dumps(x, sort_keys=True) + "\n" for x in records))
+        self.file.flush()
+
+    def size(self):
+        # Every append is flushed, so this counts all records written
+        return os.path.getsize(self.fn) if os.path.exists(self.fn) else 0
+
+    def replay(self):
+        if not os.path.exists(self.fn):
+            return []
+        records = []
+        valid_size = 0
+        with open(self.fn, "r", encoding="utf-8") as f:
+            for line in f:
+                # A crash mid-append can leave a torn final record behind
+                if not line.endswith("\n"):
+                    break
+                records.append(json.loads(line))
+                valid_size += len(line.encode("utf-8"))
+        if valid_size != os.path.getsize(self.fn):
+            os.truncate(self.fn, valid_size)
+        return records
+
+    def truncate(self):
+        self.close()
+        open(self.fn, "w").close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
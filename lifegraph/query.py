@@ -0,0 +1,294 @@
+import re
+from collections import namedtuple
+from entities import MISSING
+
+# A type in a query, with the constraints its entities must meet. Each
+# constraint is a chain of (property, target) hops, where the target is a
+# Step or, at the end of a chain, a Literal.
+Step = namedtuple("Step", ["type", "constraints"])
+Literal = namedtuple("Literal", ["value"])
+
+# One result of a query: the ids matched at each step, ending early with
+# "UNKNOWN" when the path runs into an unknown value. unknown_edge is the
+# (id, property) pair holding that value, None when the path is complete.
+QueryRow = namedtuple("QueryRow", ["ids", "unknown_edge"])
+
+class QueryParser():
+    """Parses the question syntax sketched in main.py:
+
+        @application (constraint: to -> EU) -> by -> @government
+            (constraint: country -> @country -> continent -> Europe)
+
+    A constraint can repeat its own type first ("@application -> to -> EU")
+    and can be quoted. Literals are bare words or quoted strings."""
+
+    token_pattern = re.compile(r'\s*(->|\(|\)|constraint:|"[^"]*"|(?:(?!->)[^\s()"])+)')
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self.tokenize(text)
+        self.position = 0
+
+    def tokenize(self, text):
+        tokens = []
+        position = 0
+        while text[position:].strip():
+            match = self.token_pattern.match(text, position)
+            self.raise_if_no_token(match, text[position:])
+            tokens.append(match.group(1))
+            position = match.end()
+        return tokens
+
+    def raise_if_no_token(self, match, rest):
+        try:
+            assert match is not None
+        except AssertionError:
+            raise AssertionError(f"Could not parse query at '{rest.strip()}'.")
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return None
+
+    def next(self):
+        token = self.peek()
+        self.raise_if_unexpected_token(token, token is not None, "more query")
+        self.position += 1
+        return token
+
+    def expect(self, expected):
+        token = self.next()
+        self.raise_if_unexpected_token(token, token == expected, f"'{expected}'")
+
+    def raise_if_unexpected_token(self, token, condition, expected):
+        try:
+            assert condition
+        except AssertionError:
+            raise AssertionError(f"Could not parse query at '{token}'. Expected {expected}.")
+
+    def parse_query(self):
+        steps = [self.parse_step()]
+        properties = []
+        while self.peek() == "->":
+            self.expect("->")
+            properties.append(self.parse_property())
+            self.expect("->")
+            steps.append(self.parse_step())
+        self.raise_if_unexpected_token(self.peek(), self.peek() is None, "the end of the query")
+        return steps, properties
+
+    def parse_property(self):
+        token = self.next()
+        self.raise_if_unexpected_token(token, token not in ["->", "(", ")", "constraint:"] and not token.startswith("@"), "a property")
+        return token.strip('"')
+
+    def parse_step(self):
+        token = self.next()
+        self.raise_if_unexpected_token(token, token.startswith("@"), "a @type")
+        type = token[1:]
+        constraints = []
+        while self.peek() == "(" and self.peek(1) == "constraint:":
+            self.expect("(")
+            self.expect("constraint:")
+            if self.peek() is not None and self.peek().startswith('"'):
+                parser = QueryParser(self.next()[1:-1])
+                constraints.append(parser.parse_constraint(type))
+                parser.raise_if_unexpected_token(parser.peek(), parser.peek() is None, "the end of the constraint")
+            else:
+                constraints.append(self.parse_constraint(type))
+            self.expect(")")
+        return Step(type, constraints)
+
+    def parse_constraint(self, type):
+        # The constraint may start by naming the type it constrains
+        if self.peek() == f"@{type}" and self.peek(1) == "->":
+            self.position += 2
+        hops = []
+        while True:
+            property = self.parse_property()
+            self.expect("->")
+            token = self.peek()
+            if token is not None and token.startswith("@"):
+                hops.append((property, self.parse_step()))
+            else:
+                hops.append((property, Literal(self.next().strip('"'))))
+                break
+            if self.peek() != "->":
+                break
+            self.expect("->")
+        return hops
+
+class Query():
+    """A parsed question over a Graph.
+
+    Constrained steps are resolved backwards from their literals through
+    exact search index lookups and inbound edges, and the query starts
+    from the step with the fewest candidates. From there it follows
+    properties forwards and inbound edges backwards, so only entities on
+    matching paths are visited."""
+
+    def __init__(self, graph, text):
+        self.graph = graph
+        self.schema = graph.schema
+        self.text = text
+        self.steps, self.properties = QueryParser(text).parse_query()
+        self.raise_if_query_not_in_schema()
+        self.candidates = None
+        self.start = None
+
+    def raise_if_query_not_in_schema(self):
+        for i, step in enumerate(self.steps):
+            self.schema.raise_if_type_not_in_schema(step.type)
+            self.raise_if_steps_not_valid(step)
+            if i < len(self.properties):
+                self.raise_if_leaf_type_not_last(step.type)
+                self.schema.raise_if_property_not_on_type(step.type, self.properties[i])
+
+    def raise_if_steps_not_valid(self, step):
+        for hops in step.constraints:
+            type = step.type
+            for property, target in hops:
+                self.schema.raise_if_property_not_on_type(type, property)
+                if isinstance(target, Step):
+                    self.schema.raise_if_type_not_in_schema(target.type)
+                    self.raise_if_steps_not_valid(target)
+                    type = target.type
+
+    def raise_if_leaf_type_not_last(self, type):
+        try:
+            assert type not in self.schema.leaf_types
+        except AssertionError:
+            raise AssertionError(f"Type {type} can only be the last step of a query.")
+
+    def get_types(self, type):
+        return self.schema.get_type_with_child_ids(type)
+
+    def get_ids_of_types(self, type):
+        ids = {}
+        for _type in sorted(self.get_types(type)):
+            ids.update(dict.fromkeys(self.graph.get_ids_of_type(_type)))
+        return ids
+
+    def get_literal_ids(self, type, value):
+        # Entities of type with the literal as id or as a string value
+        types = self.get_types(type)
+        ids = {}
+        if value in self.graph.graph and self.graph.graph[value]["@type"] in types:
+            ids[value] = None
+        for _type in sorted(types):
+            self.graph.ensure_types_loaded([_type])
+            for property in self.schema.get_properties_of_kind(_type, "string"):
+                ids.update(dict.fromkeys(self.graph.search_index.get_exact(_type, property, value)))
+        return ids
+
+    def get_sources(self, type, property, target_ids):
+        # Entities of type pointing at any of target_ids through property
+        types = self.get_types(type)
+        self.graph.ensure_types_loaded(types)
+        sources = {}
+        for target_id in target_ids:
+            for source_id, _ in self.graph.get_inbound_edges(target_id, property):
+                if self.graph.entities.peek_value(source_id, "@type") in types:
+                    sources[source_id] = None
+        return sources
+
+    def get_step_candidates(self, step):
+        # Ids meeting every constraint of step, or None if it has none
+        candidates = None
+        for hops in step.constraints:
+            ids = self.get_hops_candidates(step.type, hops)
+            candidates = ids if candidates is None else {x: None for x in candidates if x in ids}
+        return candidates
+
+    def get_hops_candidates(self, type, hops):
+        property, target = hops[0]
+        if isinstance(target, Literal):
+            if self.schema.get_property_kind(type, property) != "reference":
+                return {
+                    x: None for x in self.get_ids_of_types(type)
+                    if str(self.graph.entities.peek_value(x, property)) == target.value}
+            expected_type = self.schema.schema[type]["properties"][property]
+            return self.get_sources(type, property, self.get_literal_ids(expected_type, target.value))
+
+        target_ids = self.get_step_candidates(target)
+        if len(hops) > 1:
+            hop_ids = self.get_hops_candidates(target.type, hops[1:])
+            target_ids = hop_ids if target_ids is None else {x: None for x in target_ids if x in hop_ids}
+        if target_ids is None:
+            # Only the type of the pointed entity is constrained
+            types = self.get_types(target.type)
+            return {
+                x: None for x in self.get_ids_of_types(type)
+                if self.get_pointed_type(x, property) in types}
+        return self.get_sources(type, property, target_ids)
+
+    def get_pointed_type(self, id, property):
+        pointed_id = self.graph.entities.peek_value(id, property)
+        if pointed_id is MISSING or pointed_id == "UNKNOWN" or pointed_id not in self.graph.graph:
+            return None
+        return self.graph.graph[pointed_id]["@type"]
+
+    def plan(self):
+        # Candidates of every constrained step; the query starts from the
+        # smallest of them, or from the first step if nothing is constrained
+        if self.candidates is None:
+            self.candidates = [self.get_step_candidates(x) for x in self.steps]
+            constrained = [i for i, x in enumerate(self.candidates) if x is not None]
+            self.start = min(constrained, key=lambda i: len(self.candidates[i])) if constrained else 0
+        return self.start
+
+    def explain(self):
+        start = self.plan()
+        return {
+            "start_step": start,
+            "start_type": self.steps[start].type,
+            "candidates": [None if x is None else len(x) for x in self.candidates]}
+
+    def check_if_id_matches_step(self, i, id):
+        if self.candidates[i] is not None:
+            return id in self.candidates[i]
+        return self.graph.graph[id]["@type"] in self.get_types(self.steps[i].type)
+
+    def iter_backward(self, i, id):
+        # Partial paths from step 0 up to (and including) id at step i
+        if i == 0:
+            yield [id]
+            return
+        property = self.properties[i - 1]
+        for source_id in self.get_sources(self.steps[i - 1].type, property, [id]):
+            if self.check_if_id_matches_step(i - 1, source_id):
+                for path in self.iter_backward(i - 1, source_id):
+                    yield path + [id]
+
+    def iter_forward(self, i, id):
+        # Rest of the paths from id at step i to the last step
+        if i == len(self.steps) - 1:
+            yield [id], None
+            return
+        property = self.properties[i]
+        value = self.graph.entities.peek_value(id, property)
+        if value is MISSING or value == "UNKNOWN":
+            yield [id, "UNKNOWN"], (id, property)
+            return
+        next_type = self.steps[i + 1].type
+        if next_type in self.schema.leaf_types:
+            yield [id, value], None
+            return
+        self.graph.ensure_types_loaded(self.get_types(next_type))
+        if value in self.graph.graph and self.check_if_id_matches_step(i + 1, value):
+            for path, unknown_edge in self.iter_forward(i + 1, value):
+                yield [id] + path, unknown_edge
+
+    def iter_rows(self):
+        start = self.plan()
+        if self.candidates[start] is None:
+            start_ids = self.get_ids_of_types(self.steps[start].type)
+        else:
+            start_ids = self.candidates[start]
+        for id in start_ids:
+            backward_paths = list(self.iter_backward(start, id))
+            if not backward_paths:
+                continue
+            for forward_path, unknown_edge in self.iter_forward(start, id):
+                for backward_path in backward_paths:
+                    yield QueryRow(backward_path + forward_path[1:], unknown_edge)
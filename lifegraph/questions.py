@@ -0,0 +1,171 @@
+import os
+import json
+from persistence import write_json_atomic
+from query import Query, QueryParser, Step
+
+class QuestionRegistry():
+    """Saved questions over a Graph with their cached answers.
+
+    Each answer records what it depends on: the types its steps and
+    constraints name (with their subtypes), the (type, property) pairs it
+    follows and the ids in the answer. Graph and Schema changes only mark
+    the questions that depend on them as stale, and refresh() re-evaluates
+    just those, reporting the ones whose answer changed or that started or
+    stopped failing. Questions are saved to questions.json in the graph's
+    data path, and are stale after loading as the graph may have moved on."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.questions = {}
+        # Dependencies of each question as sets, for checking changes
+        self.dependency_sets = {}
+        self.stale = {}
+        if graph.data_path is not None:
+            self.fn = f"{graph.data_path}/questions.json"
+            if os.path.exists(self.fn):
+                with open(self.fn, "r") as f:
+                    self.questions = json.load(f)
+                self.stale = dict.fromkeys(self.questions)
+        else:
+            self.fn = None
+        for text, question in self.questions.items():
+            self.dependency_sets[text] = self.get_dependency_sets(question["dependencies"])
+        graph.listeners.append(self)
+        graph.schema.listeners.append(self)
+
+    def save(self):
+        if self.fn is not None:
+            write_json_atomic(self.fn, self.questions)
+
+    def ask(self, text):
+        if text not in self.questions or text in self.stale:
+            self.set_question(text, self.evaluate(text))
+            self.stale.pop(text, None)
+            self.save()
+        return self.questions[text]
+
+    def forget(self, text):
+        self.questions.pop(text, None)
+        self.dependency_sets.pop(text, None)
+        self.stale.pop(text, None)
+        self.save()
+
+    def set_question(self, text, question):
+        self.questions[text] = question
+        self.dependency_sets[text] = self.get_dependency_sets(question["dependencies"])
+
+    def get_dependency_sets(self, dependencies):
+        return {
+            "types": set(dependencies["types"]),
+            "declared_types": set(dependencies["declared_types"]),
+            "properties": set(tuple(x) for x in dependencies["properties"])}
+
+    def evaluate(self, text):
+        try:
+            steps, properties = QueryParser(text).parse_query()
+        except AssertionError as e:
+            # Syntax errors do not depend on the graph
+            return {"answer": None, "error": str(e), "dependencies": {"types": [], "declared_types": [], "properties": [], "ids": []}}
+        dependencies = self.get_dependencies(steps, properties)
+        try:
+            rows = [[x.ids, None if x.unknown_edge is None else list(x.unknown_edge)] for x in Query(self.graph, text).iter_rows()]
+        except (AssertionError, KeyError) as e:
+            return {"answer": None, "error": str(e), "dependencies": dependencies}
+        dependencies["ids"] = sorted(set(x for ids, _ in rows for x in ids if x != "UNKNOWN" and x in self.graph.graph))
+        return {"answer": rows, "error": None, "dependencies": dependencies}
+
+    def get_dependencies(self, steps, properties):
+        declared_types = set()
+        properties_followed = set()
+
+        def add_step(step):
+            declared_types.add(step.type)
+            for hops in step.constraints:
+                type = step.type
+                for property, target in hops:
+                    add_property(type, property)
+                    if isinstance(target, Step):
+                        add_step(target)
+                        type = target.type
+                    elif self.graph.schema.get_property_kind(type, property) == "reference":
+                        add_literal(self.graph.schema.schema[type]["properties"][property])
+
+        def add_literal(type):
+            # Literals match ids or any string value of the pointed type
+            declared_types.add(type)
+            for _type in self.graph.schema.get_type_with_child_ids(type):
+                for property in self.graph.schema.get_properties_of_kind(_type, "string"):
+                    properties_followed.add((_type, property))
+
+        def add_property(type, property):
+            for _type in self.graph.schema.get_type_with_child_ids(type):
+                properties_followed.add((_type, property))
+
+        for i, step in enumerate(steps):
+            add_step(step)
+            if i < len(properties):
+                add_property(step.type, properties[i])
+
+        types = set()
+        for type in declared_types:
+            types.update(self.graph.schema.get_type_with_child_ids(type))
+        return {
+            "types": sorted(types),
+            "declared_types": sorted(declared_types),
+            "properties": sorted([list(x) for x in properties_followed]),
+            "ids": []}
+
+    def mark_stale(self, check):
+        for text, dependencies in self.dependency_sets.items():
+            if text not in self.stale and check(dependencies):
+                self.stale[text] = None
+
+    def entity_changed(self, id, property, old_value, new_value):
+        # Removed entities are still in the graph while this is called
+        type = self.graph.entities.peek_value(id, "@type") if id in self.graph.entities else None
+        types = set([type, old_value if property == "@type" else None]) - set([None])
+
+        def check(dependencies):
+            if property is None or property == "@type":
+                return not types.isdisjoint(dependencies["types"])
+            return (type, property) in dependencies["properties"]
+        self.mark_stale(check)
+
+    def schema_changed(self, op, args, types):
+        # A type can join or leave the subtypes a question covers through
+        # its own or any ancestor's parent changing
+        changed_types = set(types)
+        ancestors = set()
+        for type in types:
+            ancestors.update(self.graph.schema.get_parent_ids(type))
+
+        def check(dependencies):
+            if not changed_types.isdisjoint(dependencies["types"]):
+                return True
+            return op in ["make_parent", "edit_parent", "remove_parent", "batch"] and not ancestors.isdisjoint(dependencies["declared_types"])
+        self.mark_stale(check)
+
+    def refresh(self):
+        # Re-evaluates stale questions and returns those whose result changed
+        changes = []
+        for text in list(self.stale):
+            old = self.questions[text]
+            new = self.evaluate(text)
+            self.set_question(text, new)
+            if old["error"] is None and new["error"] is not None:
+                status = "failed"
+            elif old["error"] is not None and new["error"] is None:
+                status = "resolved"
+            elif old["answer"] != new["answer"] or old["error"] != new["error"]:
+                status = "changed"
+            else:
+                continue
+            changes.append({
+                "question": text,
+                "status": status,
+                "old_answer": old["answer"],
+                "new_answer": new["answer"],
+                "error": new["error"]})
+        self.stale = {}
+        self.save()
+        return changes
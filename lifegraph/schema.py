@@ -1,5 +1,8 @@
+import copy
 import json
 import logging
+from contextlib import contextmanager
+from persistence import MutationLog, write_json_atomic
 
 class Schema():
 
@@ -7,9 +10,17 @@ class Schema():
 
         self.data_path = data_path
         self.leaf_types = ["string", "integer", "date"]
+        self.hierarchy = None
+        self.property_catalogue = {}
+        self.pending_batch = None
+        self.listeners = []
+        # If set, before_log(op, args, types) is called before a mutation is
+        # logged, to save anything replaying the log will depend on
+        self.before_log = None
         
         if self.data_path is None:
             self.schema = {}
+            self.mutation_log = None
         else:
             print("HEY!")
             self.schema = self.load_schema()
@@ -18,6 +29,8 @@ class Schema():
                 encoding='utf-8',
                 format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                 level=logging.INFO)
+            self.mutation_log = MutationLog(f"{self.data_path}/schema_log.jsonl")
+            self.replay_mutation_log()
         self.logger = logging.getLogger(__name__)
 
     def get_accepted_schema_values(self):
@@ -28,23 +41,123 @@ class Schema():
             return json.load(f)
 
     def save_schema(self):
-        with open(f"{self.data_path}/schema.json", "w") as f:
-            json.dump(self.schema, f, indent=4, sort_keys=True)
+        write_json_atomic(f"{self.data_path}/schema.json", self.schema)
+
+    def replay_mutation_log(self):
+        for record in self.mutation_log.replay():
+            self.schema.update(record["types"])
+        self.invalidate_hierarchy()
+        self.property_catalogue = {}
+
+    def log_mutation(self, op, args, types):
+        if self.pending_batch is not None:
+            self.pending_batch["mutations"].append({"op": op, "args": args})
+            self.pending_batch["types"].update(types)
+            return
+        if self.before_log is not None:
+            self.before_log(op, args, types)
+        if self.mutation_log is not None:
+            self.mutation_log.append({
+                "op": op,
+                "args": args,
+                "types": {x: self.schema[x] for x in types}})
+        for listener in self.listeners:
+            listener.schema_changed(op, args, types)
+
+    @contextmanager
+    def batch(self):
+        # Mutations in a batch are applied to the named type straight away,
+        # but only propagated to descendants (and logged, as one record) when
+        # the batch commits. Any error up to the end of propagation rolls the
+        # whole batch back. Once logged, listeners see a committed batch, so
+        # their errors do not roll it back.
+        if self.pending_batch is not None:
+            yield self
+            return
+        snapshot = copy.deepcopy(self.schema)
+        self.pending_batch = {"mutations": [], "property_mutations": [], "types": set()}
+        try:
+            yield self
+            batch = self.pending_batch
+            self.pending_batch = None
+            types = self.propagate_batch(batch)
+        except BaseException:
+            self.schema.clear()
+            self.schema.update(snapshot)
+            self.invalidate_hierarchy()
+            self.property_catalogue = {}
+            raise
+        finally:
+            self.pending_batch = None
+        if batch["mutations"]:
+            self.logger.info(f"COMMIT BATCH OF {len(batch['mutations'])} MUTATIONS")
+            self.log_mutation("batch", {"mutations": batch["mutations"]}, types)
+
+    def propagate_batch(self, batch):
+        # Returns the types the batch changed
+        hierarchy = self.get_hierarchy()
+        mutations_by_type = {}
+        for i, (op, id, property, value_id) in enumerate(batch["property_mutations"]):
+            mutations_by_type.setdefault(id, []).append((i, op, property, value_id))
 
-    def close(self):
+        children = set()
+        for id in mutations_by_type.keys():
+            children.update(hierarchy["descendants"].get(id, ()))
+        # One pass over the affected types, parents before children, applying
+        # everything queued on their ancestors in the order it was queued
+        children = sorted(children, key=lambda x: (len(hierarchy["ancestors"][x]), x))
+        for child in children:
+            inherited = sorted(
+                [x for parent in hierarchy["ancestors"][child] for x in mutations_by_type.get(parent, [])],
+                key=lambda x: x[0])
+            for _, op, property, value_id in inherited:
+                self.apply_property_mutation(op, child, property, value_id)
+        return sorted(batch["types"] | set(children))
+
+    def apply_property_mutation(self, op, id, property, value_id=None):
+        if op == "remove_property":
+            self.remove_property(id, property, auto=True)
+        else:
+            getattr(self, op)(id, property, value_id, auto=True)
+
+    def propagate_property_mutation(self, op, id, property, value_id=None):
+        args = {"id": id, "property": property}
+        if op == "rename_property":
+            args["new_property"] = value_id
+        elif value_id is not None:
+            args["value_id"] = value_id
+        if self.pending_batch is not None:
+            self.pending_batch["property_mutations"].append((op, id, property, value_id))
+            self.log_mutation(op, args, [id])
+            return
+        # Children are all descendants, so they are not recursed into
+        children = sorted(self.get_child_ids(id))
+        for child in children:
+            self.apply_property_mutation(op, child, property, value_id)
+        self.log_mutation(op, args, [id] + children)
+
+    def compact(self):
         self.save_schema()
+        if self.mutation_log is not None:
+            self.mutation_log.truncate()
+
+    def close(self):
+        if self.mutation_log is not None:
+            self.mutation_log.close()
 
     def create_type(self, id):
         self.raise_if_type_in_schema(id)
         self.schema[id] = {"properties": {}}
+        self.invalidate_hierarchy()
         self.logger.info(f"CREATE TYPE {id}")
+        self.log_mutation("create_type", {"id": id}, [id])
 
     def show_type(self, id):
         self.raise_if_type_not_in_schema(id)
         return self.schema[id]
 
     def check_if_type_is_in_schema(self, id):
-        return id in self.get_accepted_schema_values() + list(self.schema.keys())
+        return id in self.leaf_types or id in self.schema
 
     def check_if_property_is_on_type(self, id, property):
         self.raise_if_type_not_in_schema(id)
@@ -89,39 +202,38 @@ class Schema():
         except AssertionError:
             raise AssertionError(f"Type {id} has no parent.")
 
-    def get_child_ids(self, id):
-        """hacky hacky. seems to work."""
-
-        no_parent = [x for x in self.schema.keys() if "@parent" not in self.schema[x].keys()]
-        parent = [x for x in self.schema.keys() if "@parent" in self.schema[x].keys()]
-
-        inheritance = []
-        for _id in no_parent + parent:
-            if "@parent" in self.schema[_id].keys():
-                inheritance.append(set([self.schema[_id]["@parent"], _id]))
+    def invalidate_hierarchy(self):
+        self.hierarchy = None
+
+    def get_hierarchy(self):
+        # Ancestor and descendant closures of every type, rebuilt only after
+        # a type is created or a parent changes
+        if self.hierarchy is None:
+            ancestors = {}
+            descendants = {id: set() for id in self.schema.keys()}
+            for id in self.schema.keys():
+                ancestors[id] = []
+                parent = self.schema[id].get("@parent")
+                while parent is not None and parent != id and parent not in ancestors[id]:
+                    ancestors[id].append(parent)
+                    descendants.setdefault(parent, set()).add(id)
+                    parent = self.schema.get(parent, {}).get("@parent")
+            self.hierarchy = {
+                "ancestors": ancestors,
+                "descendants": descendants,
+                "type_with_descendants": {id: frozenset(descendants[id] | set([id])) for id in descendants}}
+        return self.hierarchy
 
-        children_candidates = set()
-        for rel in inheritance:
-            if id in rel:
-                children_candidates.update(rel)
-            if not rel.isdisjoint(children_candidates):
-                children_candidates.update(rel)
-
-        children = set()
-        for _id in children_candidates:
-            if "@parent" in self.schema[_id].keys():
-                children.update([_id])
-        if id in children:
-            children.remove(id)
+    def get_child_ids(self, id):
+        return set(self.get_hierarchy()["descendants"].get(id, ()))
 
-        return children
+    def get_type_with_child_ids(self, id):
+        return self.get_hierarchy()["type_with_descendants"].get(id, frozenset([id]))
 
-    def get_parent_ids(self, id, parents=set()):
-        try:
-            parents.update([self.schema[id]["@parent"]])
-            self.get_parent_ids(self.schema[id]["@parent"], parents=parents)
-        except KeyError:
-            pass
+    def get_parent_ids(self, id, parents=None):
+        if parents is None:
+            parents = set()
+        parents.update(self.get_hierarchy()["ancestors"].get(id, ()))
         return parents
 
     def get_parent_properties(self, id):
@@ -142,15 +254,15 @@ class Schema():
         except AssertionError:
             raise AssertionError(f"Property {property} is an inherited property for type {id}.")
 
-    def add_property(self, id, property, value_id):
+    def add_property(self, id, property, value_id, auto=False):
         self.raise_if_type_not_in_schema(id)
         self.raise_if_type_not_in_schema(value_id)
         self.raise_if_property_is_on_type(id, property)
         self.schema[id]["properties"][property] = value_id
+        self.property_catalogue.pop(id, None)
         self.logger.info(f"CREATE PROPERTY {property} VALUE {value_id} ON TYPE {id}")
-        children = self.get_child_ids(id)
-        for child in children:
-            self.add_property(child, property, value_id)
+        if not auto:
+            self.propagate_property_mutation("add_property", id, property, value_id)
 
     def edit_property(self, id, property, value_id, auto=False):
         self.raise_if_type_not_in_schema(id)
@@ -162,10 +274,10 @@ class Schema():
 
         old_value_id = self.schema[id]["properties"][property]
         self.schema[id]["properties"][property] = value_id
+        self.property_catalogue.pop(id, None)
         self.logger.info(f"UPDATE PROPERTY {property} FROM VALUE {old_value_id} TO VALUE {value_id} ON TYPE {id}")
-        children = self.get_child_ids(id)
-        for child in children:
-            self.edit_property(child, property, value_id, auto=True)
+        if not auto:
+            self.propagate_property_mutation("edit_property", id, property, value_id)
 
     def remove_property(self, id, property, auto=False):
         self.raise_if_type_not_in_schema(id)
@@ -175,17 +287,35 @@ class Schema():
             self.raise_if_property_is_from_a_parent(id, property)
 
         self.schema[id]["properties"].pop(property)
+        self.property_catalogue.pop(id, None)
         self.logger.info(f"REMOVE PROPERTY {property} ON TYPE {id}")
-        children = self.get_child_ids(id)
-        for child in children:
-            self.remove_property(child, property, auto=True)
+        if not auto:
+            self.propagate_property_mutation("remove_property", id, property)
+
+    def rename_property(self, id, property, new_property, auto=False):
+        self.raise_if_type_not_in_schema(id)
+        self.raise_if_property_not_on_type(id, property)
+        self.raise_if_property_is_on_type(id, new_property)
+
+        if not auto:
+            self.raise_if_property_is_from_a_parent(id, property)
+
+        # Rebuilt to keep the renamed property in its place
+        self.schema[id]["properties"] = {
+            new_property if k == property else k: v for k, v in self.schema[id]["properties"].items()}
+        self.property_catalogue.pop(id, None)
+        self.logger.info(f"RENAME PROPERTY {property} TO {new_property} ON TYPE {id}")
+        if not auto:
+            self.propagate_property_mutation("rename_property", id, property, new_property)
 
     def make_parent(self, parent_id, id):
         self.raise_if_type_not_in_schema(id)
         self.raise_if_type_not_in_schema(parent_id)
         self.raise_if_type_has_parent(id)
         self.schema[id]["@parent"] = parent_id
+        self.invalidate_hierarchy()
         self.logger.info(f"CREATE PARENT {parent_id} ON TYPE {id}")
+        self.log_mutation("make_parent", {"parent_id": parent_id, "id": id}, [id])
 
     def edit_parent(self, id, parent_id):
         self.raise_if_type_not_in_schema(id)
@@ -193,17 +323,42 @@ class Schema():
         self.raise_if_type_has_no_parent(id)
         old_parent_id = self.schema[id]["@parent"]
         self.schema[id]["@parent"] = parent_id
+        self.invalidate_hierarchy()
         self.logger.info(f"UPDATE PARENT FROM VALUE {old_parent_id} TO VALUE {parent_id} ON TYPE {id}")
+        self.log_mutation("edit_parent", {"id": id, "parent_id": parent_id}, [id])
 
     def remove_parent(self, id):
         self.raise_if_type_not_in_schema(id)
         self.raise_if_type_has_no_parent(id)
         self.schema[id].pop("@parent")
+        self.invalidate_hierarchy()
         self.logger.info(f"REMOVE PARENT ON TYPE {id}")
+        self.log_mutation("remove_parent", {"id": id}, [id])
+
+    def get_property_catalogue(self, id):
+        # Properties of a type grouped by the kind of value they hold, rebuilt
+        # after a property of the type changes
+        if id not in self.property_catalogue:
+            catalogue = {x: [] for x in self.leaf_types + ["reference"]}
+            for property, value_id in self.schema[id]["properties"].items():
+                catalogue[value_id if value_id in self.leaf_types else "reference"].append(property)
+            self.property_catalogue[id] = catalogue
+        return self.property_catalogue[id]
+
+    def get_properties_of_kind(self, id, kind):
+        if id not in self.schema:
+            return []
+        return self.get_property_catalogue(id)[kind]
+
+    def get_property_kind(self, id, property):
+        if id not in self.schema or property not in self.schema[id]["properties"]:
+            return None
+        value_id = self.schema[id]["properties"][property]
+        return value_id if value_id in self.leaf_types else "reference"
 
     def get_all_string_properties(self):
         string_properties = []
         for type in self.schema.keys():
-            for property in self.schema[type]["properties"]:
+            for property in self.get_properties_of_kind(type, "string"):
                 string_properties.append((type, property))
         return string_properties
@@ -0,0 +1,111 @@
+import threading
+from collections import Counter
+from fuzzywuzzy import process, utils
+
+class SearchField():
+    """Values of one (type, property) pair and the trigrams they contain.
+
+    Values added to or dropped from postings are queued in pending and only
+    added to or removed from grams when the field is next searched."""
+
+    __slots__ = ("postings", "grams", "pending")
+
+    def __init__(self):
+        self.postings = {}
+        self.grams = {}
+        self.pending = set()
+
+class SearchIndex():
+    """Trigram inverted index over entity property values.
+
+    Values are grouped by (type, property) field so type and property
+    filters only touch the matching fields. A query counts the trigrams
+    each indexed value shares with it, keeps the max_candidates values with
+    the most overlap and only scores those with fuzzywuzzy.
+
+    Writes only update the postings, so the trigrams of a value are worked
+    out once, by the first search after it was added or dropped. Searches
+    from other threads may apply those changes while a writer adds more, so
+    the pending queues are guarded by a lock."""
+
+    def __init__(self, max_candidates=1000):
+        self.fields = {}
+        self.max_candidates = max_candidates
+        self.pending_lock = threading.Lock()
+
+    def get_grams(self, value):
+        text = utils.full_process(str(value))
+        padded = f"  {text} "
+        return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def add(self, type, property, id, value):
+        field = self.fields.get((type, property))
+        if field is None:
+            field = self.fields[(type, property)] = SearchField()
+        if value not in field.postings:
+            field.postings[value] = {}
+            with self.pending_lock:
+                field.pending.add(value)
+        field.postings[value][id] = None
+
+    def remove(self, type, property, id, value):
+        field = self.fields.get((type, property))
+        if field is None or value not in field.postings:
+            return
+        field.postings[value].pop(id, None)
+        if not field.postings[value]:
+            del field.postings[value]
+            with self.pending_lock:
+                field.pending.add(value)
+
+    def update_grams(self, field):
+        with self.pending_lock:
+            for value in field.pending:
+                if value in field.postings:
+                    for gram in self.get_grams(value):
+                        field.grams.setdefault(gram, set()).add(value)
+                else:
+                    for gram in self.get_grams(value):
+                        if gram in field.grams:
+                            field.grams[gram].discard(value)
+                            if not field.grams[gram]:
+                                del field.grams[gram]
+            field.pending.clear()
+
+    def get_fields(self, type=None, property=None):
+        return [
+            field for (_type, _property), field in self.fields.items()
+            if (type is None or _type == type) and (property is None or _property == property)]
+
+    def get_exact(self, type, property, value):
+        field = self.fields.get((type, property))
+        if field is None:
+            return []
+        return list(field.postings.get(value, {}))
+
+    def get_candidates(self, value, fields):
+        for field in fields:
+            if field.pending:
+                self.update_grams(field)
+        overlap = Counter()
+        for gram in self.get_grams(value):
+            for field in fields:
+                for candidate in field.grams.get(gram, ()):
+                    overlap[candidate] += 1
+        if not overlap:
+            # Nothing shares a trigram with the query (e.g. very short
+            # values), so fall back to scoring every value
+            return [x for field in fields for x in field.postings.keys()]
+        return [x for x, _ in overlap.most_common(self.max_candidates)]
+
+    def search(self, value, type=None, property=None, limit=1, sort_key=None):
+        fields = self.get_fields(type=type, property=property)
+        candidates = self.get_candidates(value, fields)
+        if not candidates:
+            return []
+        matches = process.extract(value, {x: str(x) for x in candidates}, limit=limit)
+        ids = {}
+        for _, _, match in matches:
+            match_ids = [x for field in fields for x in field.postings.get(match, {}) if x not in ids]
+            ids.update(dict.fromkeys(sorted(match_ids, key=sort_key)))
+        return list(ids)
@@ -0,0 +1,177 @@
+import os
+import json
+import struct
+import tempfile
+import numpy as np
+from persistence import write_json_atomic, replace_file
+
+class JsonStorage():
+    """One indented JSON object per type in graph/{type}.json."""
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+
+    def type_fn(self, type):
+        return f"{self.data_path}/graph/{type}.json"
+
+    def list_types(self):
+        graph_path = f"{self.data_path}/graph"
+        if not os.path.exists(graph_path):
+            return []
+        return sorted(x[:-len(".json")] for x in os.listdir(graph_path) if x.endswith(".json"))
+
+    def has_type(self, type):
+        return os.path.exists(self.type_fn(type))
+
+    def load_type(self, type):
+        with open(self.type_fn(type), "r") as f:
+            return json.load(f)
+
+    def save_type(self, type, entities):
+        os.makedirs(f"{self.data_path}/graph", exist_ok=True)
+        write_json_atomic(self.type_fn(type), entities)
+
+class ColumnarStorage():
+    """One binary file per type in columnar/{type}.lgc.
+
+    The file holds a JSON header followed by 8-byte aligned column blocks:
+    the entity ids as fixed width utf-8 bytes, then one int32 code column
+    per property. Every property is dictionary encoded (references included),
+    with the dictionaries kept in the header and -1 marking a missing
+    property. Columns are read through np.memmap."""
+
+    magic = b"LGCOL001"
+    missing_code = -1
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+
+    def type_fn(self, type):
+        return f"{self.data_path}/columnar/{type}.lgc"
+
+    def list_types(self):
+        columnar_path = f"{self.data_path}/columnar"
+        if not os.path.exists(columnar_path):
+            return []
+        return sorted(x[:-len(".lgc")] for x in os.listdir(columnar_path) if x.endswith(".lgc"))
+
+    def has_type(self, type):
+        return os.path.exists(self.type_fn(type))
+
+    def read_header(self, fn):
+        with open(fn, "rb") as f:
+            magic = f.read(len(self.magic))
+            try:
+                assert magic == self.magic
+            except AssertionError:
+                raise AssertionError(f"File {fn} is not a columnar type file.")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            return json.loads(f.read(header_length).decode("utf-8"))
+
+    def load_type_columns(self, type):
+        fn = self.type_fn(type)
+        header = self.read_header(fn)
+        rows = header["rows"]
+        if rows == 0:
+            ids = np.empty(0, dtype=f"S{header['id_width']}")
+        else:
+            ids = np.memmap(fn, dtype=f"S{header['id_width']}", mode="r",
+                offset=header["offsets"]["@id"], shape=(rows,))
+        columns = {}
+        for property in header["properties"]:
+            if rows == 0:
+                columns[property] = np.empty(0, dtype="<i4")
+            else:
+                columns[property] = np.memmap(fn, dtype="<i4", mode="r",
+                    offset=header["offsets"][property], shape=(rows,))
+        return ids, columns, header["dictionaries"]
+
+    def load_type(self, type):
+        ids, columns, dictionaries = self.load_type_columns(type)
+        missing = object()
+        decoded = []
+        for property, codes in columns.items():
+            lookup = np.empty(len(dictionaries[property]) + 1, dtype=object)
+            lookup[:-1] = dictionaries[property]
+            lookup[self.missing_code] = missing
+            decoded.append((property, lookup[codes].tolist()))
+
+        entities = {}
+        for i, id in enumerate(ids.tolist()):
+            entity = {"@type": type}
+            for property, values in decoded:
+                if values[i] is not missing:
+                    entity[property] = values[i]
+            entities[id.decode("utf-8")] = entity
+        return entities
+
+    def encode_column(self, entities, property):
+        dictionary = {}
+        codes = np.empty(len(entities), dtype="<i4")
+        for i, entity in enumerate(entities):
+            if property in entity:
+                codes[i] = dictionary.setdefault(entity[property], len(dictionary))
+            else:
+                codes[i] = self.missing_code
+        return list(dictionary), codes
+
+    def save_type(self, type, entities):
+        properties = sorted(set(x for entity in entities.values() for x in entity.keys() if x != "@type"))
+        encoded_ids = [x.encode("utf-8") for x in entities.keys()]
+        id_width = max([len(x) for x in encoded_ids] + [1])
+        blocks = [("@id", np.array(encoded_ids, dtype=f"S{id_width}"))]
+        dictionaries = {}
+        for property in properties:
+            dictionaries[property], codes = self.encode_column(entities.values(), property)
+            blocks.append((property, codes))
+
+        # Offsets depend on the header length, so size the header with
+        # placeholder offsets of the final width before writing it out
+        header = {
+            "type": type,
+            "rows": len(entities),
+            "id_width": id_width,
+            "properties": properties,
+            "dictionaries": dictionaries,
+            "offsets": {name: 0 for name, _ in blocks}}
+        while True:
+            header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+            offset = self.align(len(self.magic) + 8 + len(header_bytes))
+            offsets = {}
+            for name, block in blocks:
+                offsets[name] = offset
+                offset = self.align(offset + block.nbytes)
+            if offsets == header["offsets"]:
+                break
+            header["offsets"] = offsets
+
+        os.makedirs(f"{self.data_path}/columnar", exist_ok=True)
+        fn = self.type_fn(type)
+        with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(fn), suffix=".tmp", delete=False) as f:
+            try:
+                f.write(self.magic)
+                f.write(struct.pack("<Q", len(header_bytes)))
+                f.write(header_bytes)
+                for name, block in blocks:
+                    f.write(b"\0" * (offsets[name] - f.tell()))
+                    f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                os.remove(f.name)
+                raise
+        replace_file(f.name, fn)
+
+    def align(self, offset):
+        return (offset + 7) // 8 * 8
+
+storage_backends = {
+    "json": JsonStorage,
+    "columnar": ColumnarStorage,
+}
+
+def convert_storage(data_path, source="json", target="columnar"):
+    source_storage = storage_backends[source](data_path)
+    target_storage = storage_backends[target](data_path)
+    for type in source_storage.list_types():
+        target_storage.save_type(type, source_storage.load_type(type))
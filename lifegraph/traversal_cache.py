@@ -0,0 +1,42 @@
+class TraversalCache():
+    """Memoised paths out of (entity id, property) pairs.
+
+    Each entry holds the rows found by following property out of id, as
+    (depth, pointing_property, pointed_id, pointed_id_type) tuples relative
+    to id. Entries are built from the entries of the pointed entity, so the
+    cache also records which entities each entry read directly and which
+    entries were built from it. Invalidating an entity drops every entry
+    that read it and, in turn, every entry built from those."""
+
+    def __init__(self):
+        self.entries = {}
+        self.dependents = {}
+        self.parents = {}
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        return self.entries[key]
+
+    def put(self, key, rows, ids_read, child_keys):
+        self.entries[key] = rows
+        for id in ids_read:
+            self.dependents.setdefault(id, set()).add(key)
+        for child_key in child_keys:
+            self.parents.setdefault(child_key, set()).add(key)
+
+    def invalidate_entity(self, id):
+        keys = list(self.dependents.pop(id, ()))
+        while keys:
+            key = keys.pop()
+            if self.entries.pop(key, None) is not None:
+                keys.extend(self.parents.pop(key, ()))
+
+    def clear(self):
+        self.entries = {}
+        self.dependents = {}
+        self.parents = {}
+
+    def __len__(self):
+        return len(self.entries)
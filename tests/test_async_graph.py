@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from graph import Graph
+from async_graph import AsyncGraph, open_graph
+
+@pytest.fixture()
+def mock_async_graph():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("country")
+    graph.schema.create_type("person")
+    graph.schema.add_property("country", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    graph.schema.add_property("person", "country", "country")
+    graph.insert_entity("se", {"@type": "country", "name": "Sweden"})
+    graph.insert_entity("fi", {"@type": "country", "name": "Finland"})
+    graph.insert_entity("anna", {"@type": "person", "name": "Anna", "age": 30, "country": "se"})
+    graph.insert_entity("bo", {"@type": "person", "name": "Bo", "age": 40, "country": "se"})
+    return AsyncGraph(graph)
+
+def test_reads_and_writes_as_coroutines(mock_async_graph):
+    graph = mock_async_graph
+
+    async def main():
+        assert await graph.search("Swedn", type="country") == ["se"]
+        await graph.edit_property("bo", "country", "fi")
+        aggregated, paths, entity = await asyncio.gather(
+            graph.categorical_aggregation(
+                ["anna", "bo"], "age", "sum",
+                [{"depth": 0, "pointing_property": "country", "aggregation_type": "country"}]),
+            graph.search_out_from_id_property("anna", "country"),
+            graph.get_entity("bo"))
+        return aggregated, paths, entity
+
+    aggregated, paths, entity = asyncio.run(main())
+    assert sorted(aggregated, key=lambda x: x["group"]) == [
+        {"value": 40, "group": ("fi", )},
+        {"value": 30, "group": ("se", )}]
+    assert [x["pointed_id"] for x in paths] == ["se"]
+    assert entity == {"@type": "person", "name": "Bo", "age": 40, "country": "fi"}
+
+def test_concurrent_clients_see_every_write(mock_async_graph):
+    graph = mock_async_graph
+
+    async def client(i):
+        id = await graph.create_from_type("person")
+        await graph.edit_property(id, "name", f"client_{i}")
+        return await graph.search(f"client_{i}", type="person", property="name")
+
+    async def main():
+        return await asyncio.gather(*[client(i) for i in range(20)])
+
+    results = asyncio.run(main())
+    assert all(len(x) == 1 for x in results)
+    assert len(set(x[0] for x in results)) == 20
+    assert len(graph.graph.get_ids_of_type("person")) == 22
+
+def test_errors_are_raised_to_the_caller(mock_async_graph):
+    with pytest.raises(AssertionError) as e:
+        asyncio.run(mock_async_graph.edit_property("anna", "country", "bo"))
+    assert "Entity 'bo' has type 'person'. Expected type 'country'." in str(e.value)
+
+def test_open_and_save_graph(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+
+    async def create():
+        graph = await open_graph(data_path=str(tmp_path))
+        await graph.edit_schema("create_type", "country")
+        await graph.edit_schema("add_property", "country", "name", "string")
+        ids = await graph.bulk_ingest([{"@type": "country", "name": "Sweden"}])
+        await graph.save_graph()
+        await graph.close()
+        return ids
+
+    async def reopen():
+        graph = await open_graph(data_path=str(tmp_path))
+        entity = await graph.get_entity(ids[0])
+        await graph.close()
+        return entity
+
+    ids = asyncio.run(create())
+    assert asyncio.run(reopen()) == {"@type": "country", "name": "Sweden"}
@@ -0,0 +1,123 @@
+import pytest
+from graph import Graph
+from audit import Violation, get_chunks
+
+def messages(violations):
+    return [x.message() for x in violations]
+
+@pytest.fixture()
+def mock_graph_with_person_hometown():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("person")
+    graph.schema.create_type("city")
+    graph.schema.create_type("country")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "hometown", "city")
+    graph.schema.add_property("city", "name", "string")
+    graph.graph["london"] = {"@type": "city", "name": "London"}
+    graph.graph["a"] = {"@type": "person", "name": "A", "hometown": "london"}
+    graph.graph["b"] = {"@type": "person", "name": "B", "hometown": "london"}
+    return graph
+
+def test_audit_incremental_first_check_matches_audit(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.graph["c"] = {"@type": "person", "hometown": "london"}
+    new, resolved = graph.audit_incremental()
+    assert messages(new) == graph.audit()
+    assert resolved == []
+
+def test_audit_incremental_only_rechecks_changed_entities(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.audit_incremental()
+    checked = []
+    audit_entity = graph.audit_entity
+    graph.audit_entity = lambda k: checked.append(k) or audit_entity(k)
+    del graph.graph["a"]["name"]
+    new, resolved = graph.audit_incremental()
+    assert checked == ["a"]
+    assert messages(new) == ["Entity a is missing required property name"]
+    graph.graph["a"]["name"] = "A"
+    new, resolved = graph.audit_incremental()
+    assert new == []
+    assert messages(resolved) == ["Entity a is missing required property name"]
+    assert graph.incremental_auditor.get_violations() == []
+
+def test_audit_incremental_rechecks_referrers_of_retyped_entity(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.audit_incremental()
+    graph.graph["london"]["@type"] = "country"
+    new, _ = graph.audit_incremental()
+    assert sorted(messages(new)) == [
+        "Entity 'a' property 'hometown' points to entity 'london' of type 'country'. Expected type 'city'.",
+        "Entity 'b' property 'hometown' points to entity 'london' of type 'country'. Expected type 'city'."]
+    assert sorted(messages(graph.incremental_auditor.get_violations())) == sorted(graph.audit())
+
+def test_audit_incremental_rechecks_referrers_of_removed_entity(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.audit_incremental()
+    del graph.graph["london"]
+    new, _ = graph.audit_incremental()
+    assert len(new) == 2
+    assert sorted(messages(graph.incremental_auditor.get_violations())) == sorted(graph.audit())
+
+def test_audit_incremental_rechecks_types_with_schema_changes(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.audit_incremental()
+    graph.schema.add_property("person", "age", "integer")
+    new, _ = graph.audit_incremental()
+    assert sorted(messages(new)) == [
+        "Entity a is missing required property age",
+        "Entity b is missing required property age"]
+    graph.schema.remove_property("person", "age")
+    new, resolved = graph.audit_incremental()
+    assert new == []
+    assert len(resolved) == 2
+
+def test_audit_incremental_rechecks_referrers_after_parent_change(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.schema.create_type("village")
+    graph.graph["c"] = {"@type": "person", "name": "C", "hometown": "v"}
+    graph.graph["v"] = {"@type": "village", "name": "V"}
+    new, _ = graph.audit_incremental()
+    assert len(new) == 1
+    graph.schema.make_parent("city", "village")
+    new, resolved = graph.audit_incremental()
+    assert new == []
+    assert messages(resolved) == ["Entity 'c' property 'hometown' points to entity 'v' of type 'village'. Expected type 'city'."]
+
+def test_parallel_audit_matches_serial_audit(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    for i in range(50):
+        graph.graph[f"p{i}"] = {"@type": "person", "hometown": "london" if i % 3 else "nowhere"}
+        if i % 2:
+            graph.graph[f"p{i}"]["name"] = f"P{i}"
+    assert graph.audit(processes=3) == graph.audit()
+
+def test_get_chunks_covers_all_ids():
+    chunks = get_chunks(10, 4)
+    assert chunks == [(0, 3), (3, 6), (6, 9), (9, 10)]
+    assert get_chunks(0, 4) == []
+
+def test_iter_audit_yields_violation_records(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    graph.graph["c"] = {"@type": "person", "hometown": "nowhere"}
+    violations = list(graph.iter_audit())
+    assert violations == [
+        Violation("c", "name", "missing_property", "string", None, None),
+        Violation("c", "hometown", "unknown_entity", "city", None, "nowhere")]
+    assert messages(violations) == graph.audit()
+
+def test_iter_audit_stops_at_limit(mock_graph_with_person_hometown):
+    graph = mock_graph_with_person_hometown
+    for i in range(10):
+        graph.graph[f"p{i}"] = {"@type": "person"}
+    checked = []
+    iter_entity_schema_violations = graph.iter_entity_schema_violations
+    graph.iter_entity_schema_violations = lambda k: checked.append(k) or iter_entity_schema_violations(k)
+    violations = list(graph.iter_audit(limit=1))
+    assert messages(violations) == ["Entity p0 is missing required property name"]
+    assert checked == ["london", "a", "b", "p0"]
+
+def test_violation_message_for_wrong_type():
+    violation = Violation("a", "hometown", "wrong_type", "city", "country", "london")
+    assert violation.message() == "Entity 'a' property 'hometown' points to entity 'london' of type 'country'. Expected type 'city'."
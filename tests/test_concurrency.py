@@ -0,0 +1,117 @@
+import threading
+import pytest
+from graph import Graph
+from concurrency import ConcurrentGraph
+from migrations import Migrations
+
+@pytest.fixture()
+def mock_concurrent_graph():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("country")
+    graph.schema.create_type("person")
+    graph.schema.add_property("country", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    graph.schema.add_property("person", "country", "country")
+    graph.insert_entity("se", {"@type": "country", "name": "Sweden"})
+    graph.insert_entity("fi", {"@type": "country", "name": "Finland"})
+    graph.insert_entity("anna", {"@type": "person", "name": "Anna", "age": 30, "country": "se"})
+    graph.insert_entity("bo", {"@type": "person", "name": "Bo", "age": 40, "country": "fi"})
+    return ConcurrentGraph(graph)
+
+def test_snapshot_does_not_see_later_writes(mock_concurrent_graph):
+    concurrent_graph = mock_concurrent_graph
+    with concurrent_graph.snapshot() as snapshot:
+        concurrent_graph.edit_property("anna", "country", "fi")
+        new_id = concurrent_graph.create_from_copy("bo")
+        concurrent_graph.write(concurrent_graph.graph.graph.__delitem__, "bo")
+        assert snapshot.graph["anna"]["country"] == "se"
+        assert new_id not in snapshot.graph
+        assert snapshot.graph["bo"]["name"] == "Bo"
+        assert sorted(snapshot.graph.keys()) == ["anna", "bo", "fi", "se"]
+        assert sorted(snapshot.get_ids_of_type("person")) == ["anna", "bo"]
+        assert snapshot.get_inbound_ids("se") == ["anna"]
+        assert snapshot.get_inbound_ids("fi") == ["bo"]
+    with concurrent_graph.snapshot() as snapshot:
+        assert snapshot.graph["anna"]["country"] == "fi"
+        assert set(snapshot.get_ids_of_type("person")) == set(["anna", new_id])
+        assert set(snapshot.get_inbound_ids("fi")) == set(["anna", new_id])
+
+def test_snapshot_search_uses_values_as_of_snapshot(mock_concurrent_graph):
+    concurrent_graph = mock_concurrent_graph
+    with concurrent_graph.snapshot() as snapshot:
+        concurrent_graph.write(concurrent_graph.graph.set_property, "anna", "name", "Agneta")
+        assert snapshot.search("Anna", type="person") == ["anna"]
+        assert snapshot.search_index.get_exact("person", "name", "Anna") == ["anna"]
+        assert snapshot.search_index.get_exact("person", "name", "Agneta") == []
+    assert concurrent_graph.read("search", "Agneta", type="person") == ["anna"]
+
+def test_snapshot_of_changed_schema_uses_its_own_indexes(mock_concurrent_graph):
+    concurrent_graph = mock_concurrent_graph
+    Migrations(concurrent_graph.graph)
+    with concurrent_graph.snapshot() as snapshot:
+        concurrent_graph.write(concurrent_graph.graph.schema.rename_property, "person", "country", "home")
+        assert "country" in snapshot.schema.schema["person"]["properties"]
+        assert snapshot.get_inbound_edges("se") == [("anna", "country")]
+        assert snapshot.graph["anna"]["country"] == "se"
+        assert snapshot.own_indexes
+    assert concurrent_graph.read("get_inbound_edges", "se") == [("anna", "home")]
+
+def test_snapshot_aggregation(mock_concurrent_graph):
+    concurrent_graph = mock_concurrent_graph
+    with concurrent_graph.snapshot() as snapshot:
+        concurrent_graph.edit_property("bo", "country", "se")
+        aggregated = snapshot.categorical_aggregation(
+            ["anna", "bo"], "age", "mean",
+            [{"depth": 0, "pointing_property": "country", "aggregation_type": "country"}])
+    assert sorted(aggregated, key=lambda x: x["group"]) == [
+        {"value": 40.0, "group": ("fi", )},
+        {"value": 30.0, "group": ("se", )}]
+
+def test_snapshot_is_read_only(mock_concurrent_graph):
+    with mock_concurrent_graph.snapshot() as snapshot:
+        with pytest.raises(AssertionError) as e:
+            snapshot.edit_property("anna", "age", 31)
+    assert "Snapshots are read only." in str(e.value)
+
+def test_write_outside_concurrent_graph_raises(mock_concurrent_graph):
+    with pytest.raises(AssertionError) as e:
+        mock_concurrent_graph.graph.set_property("anna", "age", 31)
+    assert "Entity anna can only be changed through ConcurrentGraph.write." in str(e.value)
+
+def test_history_is_dropped_without_open_snapshots(mock_concurrent_graph):
+    concurrent_graph = mock_concurrent_graph
+    snapshot = concurrent_graph.snapshot()
+    concurrent_graph.edit_property("anna", "age", 31)
+    assert concurrent_graph.history
+    snapshot.close()
+    concurrent_graph.edit_property("anna", "age", 32)
+    assert concurrent_graph.history == {}
+    assert concurrent_graph.changes == []
+
+def test_readers_never_see_half_applied_writes(mock_concurrent_graph):
+    # Every write moves one year from anna to bo, so the total stays 70
+    concurrent_graph = mock_concurrent_graph
+    graph = concurrent_graph.graph
+    errors = []
+
+    def move_year():
+        graph.set_property("anna", "age", graph.graph["anna"]["age"] - 1)
+        graph.set_property("bo", "age", graph.graph["bo"]["age"] + 1)
+
+    def read():
+        for _ in range(300):
+            with concurrent_graph.snapshot() as snapshot:
+                total = snapshot.graph["anna"]["age"] + snapshot.graph["bo"]["age"]
+                if total != 70:
+                    errors.append(total)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for _ in range(300):
+        concurrent_graph.write(move_year)
+    for reader in readers:
+        reader.join()
+    assert errors == []
+    assert graph.graph["anna"]["age"] == -270
@@ -0,0 +1,143 @@
+from entities import EntityStore, LazyEntities, MISSING
+import pytest
+
+@pytest.fixture()
+def type_files():
+    return {
+        "person": {"p1": {"@type": "person"}, "p2": {"@type": "person"}},
+        "city": {"c1": {"@type": "city"}},
+    }
+
+@pytest.fixture()
+def lazy_entities(type_files):
+    loaded = []
+    def load_type(type):
+        loaded.append(type)
+        entities.entities.update(type_files[type])
+    entities = LazyEntities(["person", "city"], load_type)
+    entities.loaded = loaded
+    return entities
+
+def test_lazy_entities_loads_nothing_up_front(lazy_entities):
+    assert lazy_entities.loaded == []
+    assert not lazy_entities.check_if_type_is_loaded("person")
+
+def test_lazy_entities_ensure_type_loaded(lazy_entities):
+    lazy_entities.ensure_type_loaded("city")
+    lazy_entities.ensure_type_loaded("city")
+    assert lazy_entities.loaded == ["city"]
+    assert lazy_entities["c1"] == {"@type": "city"}
+    assert lazy_entities.loaded == ["city"]
+
+def test_lazy_entities_lookup_loads_until_found(lazy_entities):
+    assert lazy_entities["p1"] == {"@type": "person"}
+    assert lazy_entities.loaded == ["person"]
+    assert "c1" in lazy_entities.keys()
+    assert lazy_entities.loaded == ["person", "city"]
+
+def test_lazy_entities_missing_id(lazy_entities):
+    with pytest.raises(KeyError):
+        lazy_entities["x"]
+    assert "x" not in lazy_entities
+
+def test_lazy_entities_iteration_loads_everything(lazy_entities):
+    assert list(lazy_entities) == ["p1", "p2", "c1"]
+    assert len(lazy_entities) == 3
+
+class RecordingListener():
+    def __init__(self):
+        self.calls = []
+
+    def entity_inserted(self, id):
+        self.calls.append(("inserted", id))
+
+    def entity_removing(self, id):
+        self.calls.append(("removing", id))
+
+    def property_changed(self, id, property, old_value, new_value):
+        self.calls.append(("changed", id, property, old_value, new_value))
+
+@pytest.fixture()
+def entity_store():
+    store = EntityStore()
+    store["p1"] = {"@type": "person", "name": "Hamish", "hometown": "c1"}
+    store["c1"] = {"@type": "city", "name": "Syracuse"}
+    store["p2"] = {"@type": "person", "name": "Peter"}
+    return store
+
+def test_entity_store_behaves_like_a_dict(entity_store):
+    assert list(entity_store) == ["p1", "c1", "p2"]
+    assert len(entity_store) == 3
+    assert "p1" in entity_store
+    assert "x" not in entity_store
+    assert entity_store["p1"] == {"@type": "person", "name": "Hamish", "hometown": "c1"}
+    assert entity_store["p2"] == {"@type": "person", "name": "Peter"}
+    assert entity_store["p2"].copy() == {"@type": "person", "name": "Peter"}
+    assert type(entity_store["p2"].copy()) is dict
+    with pytest.raises(KeyError):
+        entity_store["x"]
+
+def test_entity_store_shares_layout_per_type(entity_store):
+    assert set(entity_store.tables) == set(["person", "city"])
+    person_table = entity_store.tables["person"]
+    assert person_table.ids == ["p1", "p2"]
+    assert person_table.columns["name"] == ["Hamish", "Peter"]
+    assert person_table.columns["hometown"] == ["c1", MISSING]
+
+def test_entity_view_edits(entity_store):
+    entity = entity_store["p2"]
+    entity["hometown"] = "c1"
+    entity["age"] = 30
+    entity.pop("name")
+    assert "name" not in entity
+    assert entity_store["p2"] == {"@type": "person", "hometown": "c1", "age": 30}
+    assert entity_store["p1"] == {"@type": "person", "name": "Hamish", "hometown": "c1"}
+
+def test_entity_view_change_type(entity_store):
+    entity_store["p2"]["@type"] = "city"
+    assert entity_store["p2"] == {"@type": "city", "name": "Peter"}
+    assert list(entity_store) == ["p1", "c1", "p2"]
+    assert entity_store.tables["person"].ids == ["p1", None]
+
+def test_entity_view_cannot_remove_type(entity_store):
+    with pytest.raises(AssertionError) as exc_info:
+        del entity_store["p1"]["@type"]
+    assert exc_info.value.args[0] == "Entity p1 property @type cannot be removed."
+
+def test_entity_store_replace_and_delete(entity_store):
+    entity_store["p1"] = {"@type": "person", "name": "Hamish"}
+    assert entity_store["p1"] == {"@type": "person", "name": "Hamish"}
+    del entity_store["p1"]
+    assert list(entity_store) == ["c1", "p2"]
+
+def test_entity_store_notifies_listener(entity_store):
+    listener = RecordingListener()
+    entity_store.listener = listener
+    entity_store["p3"] = {"@type": "person"}
+    entity_store["p3"]["name"] = "Jane"
+    entity_store["p3"]["name"] = "June"
+    del entity_store["p3"]["name"]
+    entity_store["p3"] = {"@type": "person"}
+    del entity_store["p3"]
+    entity_store.load_entity("p4", {"@type": "person"})
+    assert listener.calls == [
+        ("inserted", "p3"),
+        ("changed", "p3", "name", MISSING, "Jane"),
+        ("changed", "p3", "name", "Jane", "June"),
+        ("changed", "p3", "name", "June", MISSING),
+        ("removing", "p3"),
+        ("inserted", "p3"),
+        ("removing", "p3")]
+
+def test_entity_store_reuses_rows_and_handles(entity_store):
+    entity_store["p1"] = {"@type": "person", "name": "Hamish"}
+    assert entity_store.tables["person"].ids == ["p1", "p2"]
+    assert entity_store.tables["person"].columns["hometown"] == [MISSING, MISSING]
+    handle = entity_store.handles["p2"]
+    del entity_store["p2"]
+    entity_store["p3"] = {"@type": "person", "name": "Jane"}
+    assert entity_store.tables["person"].ids == ["p1", "p3"]
+    assert entity_store.handles["p3"] == handle
+    assert len(entity_store.handle_tables) == 3
+    assert entity_store["p3"] == {"@type": "person", "name": "Jane"}
+    assert list(entity_store) == ["p1", "c1", "p3"]
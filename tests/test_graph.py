@@ -3,6 +3,7 @@ import json
 from graph import Graph
 import pandas as pd
 import statistics
+import random
 
 @pytest.fixture()
 def mock_graph_with_person_schema():
@@ -315,3 +316,581 @@ def test_raise_if_id_not_expected_type_riases(mock_graph_with_person_hometown_sc
     with pytest.raises(AssertionError) as exc_info:
         graph.raise_if_id_not_expected_type(city_id, "person")
     assert exc_info.value.args[0] == f"Entity '{city_id}' has type 'city'. Expected type 'person'."
+
+def test_get_ids_of_type_includes_copies(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    person_id = graph.create_from_type("person")
+    city_id = graph.create_from_type("city")
+    copy_id = graph.create_from_copy(person_id)
+    smart_copy_id = graph.create_from_smart_copy(person_id)
+    assert graph.get_ids_of_type("person") == [person_id, copy_id, smart_copy_id]
+    assert graph.get_ids_of_type("city") == [city_id]
+
+def test_type_index_rebuilt_on_load(tmp_path):
+    (tmp_path / "graph").mkdir()
+    (tmp_path / "schema.json").write_text(json.dumps({"person": {"properties": {"name": "string"}}}))
+    (tmp_path / "graph" / "person.json").write_text(json.dumps({"p1": {"@type": "person", "name": "Hamish"}}))
+    graph = Graph(data_path=str(tmp_path))
+    assert graph.get_ids_of_type("person") == ["p1"]
+
+def test_get_inbound_edges(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    person_id1 = graph.create_from_type("person")
+    person_id2 = graph.create_from_type("person")
+    city_id1 = graph.create_from_type("city")
+    city_id2 = graph.create_from_type("city")
+    graph.edit_property(person_id1, "hometown", city_id1)
+    graph.edit_property(person_id2, "hometown", city_id1)
+    graph.edit_property(person_id1, "name", city_id2)
+    assert graph.get_inbound_edges(city_id1) == [(person_id1, "hometown"), (person_id2, "hometown")]
+    assert graph.get_inbound_edges(city_id2) == []
+    graph.edit_property(person_id2, "hometown", city_id2)
+    assert graph.get_inbound_ids(city_id1) == [person_id1]
+    assert graph.get_inbound_ids(city_id2, property="hometown", type="person") == [person_id2]
+
+def test_get_inbound_ids_includes_copies(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    person_id = graph.create_from_type("person")
+    city_id = graph.create_from_type("city")
+    graph.edit_property(person_id, "hometown", city_id)
+    copy_id = graph.create_from_copy(person_id)
+    assert graph.get_inbound_ids(city_id) == [person_id, copy_id]
+
+def test_save_graph_only_rewrites_dirty_types(tmp_path):
+    (tmp_path / "graph").mkdir()
+    (tmp_path / "schema.json").write_text(json.dumps({
+        "person": {"properties": {"name": "string"}},
+        "city": {"properties": {"name": "string"}}}))
+    (tmp_path / "graph" / "city.json").write_text(json.dumps({"c1": {"@type": "city", "name": "Syracuse"}}))
+    graph = Graph(data_path=str(tmp_path))
+    assert graph.dirty_types == set()
+    person_id = graph.create_from_type("person")
+    graph.edit_property(person_id, "name", "Hamish")
+    (tmp_path / "graph" / "city.json").write_text("not rewritten")
+    graph.save_graph()
+    assert graph.dirty_types == set()
+    assert (tmp_path / "graph" / "city.json").read_text() == "not rewritten"
+    with open(tmp_path / "graph" / "person.json") as f:
+        assert json.load(f) == {person_id: {"@type": "person", "name": "Hamish"}}
+    assert [x.name for x in (tmp_path / "graph").iterdir() if x.suffix == ".tmp"] == []
+
+def test_mutation_log_replayed_on_load(tmp_path):
+    (tmp_path / "graph").mkdir()
+    (tmp_path / "schema.json").write_text(json.dumps({"person": {"properties": {"name": "string"}}}))
+    graph = Graph(data_path=str(tmp_path))
+    person_id = graph.create_from_type("person")
+    graph.edit_property(person_id, "name", "Hamish")
+    copy_id = graph.create_from_copy(person_id)
+    graph.close()
+    assert not (tmp_path / "graph" / "person.json").exists()
+    graph = Graph(data_path=str(tmp_path))
+    assert graph.get_ids_of_type("person") == [person_id, copy_id]
+    assert graph.graph[copy_id] == {"@type": "person", "name": "Hamish"}
+    assert graph.dirty_types == {"person"}
+
+def test_replayed_edits_keep_one_row(tmp_path):
+    (tmp_path / "graph").mkdir()
+    (tmp_path / "schema.json").write_text(json.dumps({"person": {"properties": {"age": "integer"}}}))
+    graph = Graph(data_path=str(tmp_path))
+    person_id = graph.create_from_type("person")
+    for i in range(1000):
+        graph.edit_property(person_id, "age", i)
+    graph.close()
+    graph = Graph(data_path=str(tmp_path))
+    assert graph.entities.tables["person"].ids == [person_id]
+    assert graph.graph[person_id] == {"@type": "person", "age": 999}
+
+def test_compact(tmp_path):
+    (tmp_path / "graph").mkdir()
+    (tmp_path / "schema.json").write_text(json.dumps({"person": {"properties": {"name": "string"}}}))
+    graph = Graph(data_path=str(tmp_path))
+    person_id = graph.create_from_type("person")
+    graph.compact()
+    assert (tmp_path / "graph_log.jsonl").read_text() == ""
+    with open(tmp_path / "graph" / "person.json") as f:
+        assert json.load(f) == {person_id: {"@type": "person", "name": "UNKNOWN"}}
+
+@pytest.fixture()
+def data_path_with_person_hometown_graph(tmp_path):
+    (tmp_path / "graph").mkdir()
+    (tmp_path / "schema.json").write_text(json.dumps({
+        "person": {"properties": {"name": "string", "hometown": "city"}},
+        "city": {"properties": {"name": "string"}},
+        "dog": {"properties": {"name": "string"}}}))
+    (tmp_path / "graph" / "person.json").write_text(json.dumps({
+        "p1": {"@type": "person", "name": "Hamish", "hometown": "c1"}}))
+    (tmp_path / "graph" / "city.json").write_text(json.dumps({
+        "c1": {"@type": "city", "name": "Syracuse"}}))
+    (tmp_path / "graph" / "dog.json").write_text(json.dumps({
+        "d1": {"@type": "dog", "name": "Rex"}}))
+    return str(tmp_path)
+
+def test_lazy_graph_loads_types_on_access(data_path_with_person_hometown_graph):
+    graph = Graph(data_path=data_path_with_person_hometown_graph, lazy=True)
+    assert graph.graph.entities == {}
+    assert graph.get_ids_of_type("city") == ["c1"]
+    assert list(graph.graph.entities) == ["c1"]
+    assert graph.get_inbound_ids("c1") == ["p1"]
+    assert not graph.graph.check_if_type_is_loaded("dog")
+
+def test_lazy_graph_search_out_loads_pointed_types(data_path_with_person_hometown_graph):
+    graph = Graph(data_path=data_path_with_person_hometown_graph, lazy=True)
+    graph.graph.ensure_type_loaded("person")
+    res = graph.search_out_from_id_property("p1", "hometown")
+    assert res[0]["pointed_id"] == "c1"
+    assert not graph.graph.check_if_type_is_loaded("dog")
+
+def test_lazy_graph_create_does_not_load(data_path_with_person_hometown_graph):
+    graph = Graph(data_path=data_path_with_person_hometown_graph, lazy=True)
+    dog_id = graph.create_from_type("dog")
+    assert list(graph.graph.entities) == [dog_id]
+    graph = Graph(data_path=data_path_with_person_hometown_graph, lazy=True)
+    assert list(graph.graph.entities) == ["d1", dog_id]
+
+def test_lazy_graph_audit_loads_everything(data_path_with_person_hometown_graph):
+    graph = Graph(data_path=data_path_with_person_hometown_graph, lazy=True)
+    assert graph.audit() == []
+    assert list(graph.graph.entities) == ["p1", "c1", "d1"]
+
+def test_lazy_graph_save_keeps_unloaded_entities(data_path_with_person_hometown_graph):
+    graph = Graph(data_path=data_path_with_person_hometown_graph, lazy=True)
+    dog_id = graph.create_from_type("dog")
+    graph.compact()
+    graph = Graph(data_path=data_path_with_person_hometown_graph)
+    assert set(graph.get_ids_of_type("dog")) == set(["d1", dog_id])
+
+def test_indexes_follow_direct_entity_edits(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    person_id = graph.create_from_type("person")
+    city_id = graph.create_from_type("city")
+    graph.graph[person_id]["hometown"] = city_id
+    assert graph.get_inbound_ids(city_id) == [person_id]
+    graph.graph[person_id]["@type"] = "city"
+    assert graph.get_ids_of_type("person") == []
+    assert graph.get_ids_of_type("city") == [city_id, person_id]
+    assert graph.get_inbound_ids(city_id) == []
+
+def test_search_with_property_constraint(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    graph.schema.add_property("person", "nickname", "string")
+    person_id1 = graph.create_from_type("person")
+    person_id2 = graph.create_from_type("person")
+    graph.edit_property(person_id1, "name", "Hamish")
+    graph.edit_property(person_id2, "nickname", "Hamish")
+    assert graph.search("Hamish", property="nickname") == [person_id2]
+    assert graph.search("Hamish") == [person_id1, person_id2]
+
+def test_search_follows_edits(mock_graph_with_person_schema):
+    graph = mock_graph_with_person_schema
+    person_id1 = graph.create_from_type("person")
+    graph.edit_property(person_id1, "name", "Hamish")
+    graph.edit_property(person_id1, "name", "Peter")
+    assert graph.search("Hamish") == [person_id1]
+    assert "Hamish" not in graph.search_index.fields[("person", "name")].postings
+
+def test_search_top_k(mock_graph_with_person_schema):
+    graph = mock_graph_with_person_schema
+    person_id1 = graph.create_from_type("person")
+    person_id2 = graph.create_from_type("person")
+    graph.edit_property(person_id1, "name", "Hamish")
+    graph.edit_property(person_id2, "name", "Hamis")
+    assert graph.search("Hamish", limit=2) == [person_id1, person_id2]
+
+def test_search_skips_non_string_properties(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    person_id = graph.create_from_type("person")
+    city_id = graph.create_from_type("city")
+    graph.edit_property(person_id, "hometown", city_id)
+    graph.edit_property(city_id, "name", "Syracuse")
+    assert ("person", "hometown") not in graph.search_index.fields
+    assert graph.search(city_id, property="hometown") == []
+
+def test_indexes_follow_schema_property_kinds(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    person_id = graph.create_from_type("person")
+    city_id = graph.create_from_type("city")
+    graph.edit_property(person_id, "hometown", city_id)
+    graph.schema.edit_property("person", "hometown", "string")
+    assert graph.get_inbound_ids(city_id) == []
+    assert graph.search(city_id, property="hometown") == [person_id]
+
+def test_bulk_ingest_resolves_references_in_batch(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    ids = graph.bulk_ingest([
+        {"@type": "person", "name": "Hamish", "hometown": {"@ref": "london"}},
+        {"@type": "city", "@key": "london", "name": "London"},
+        {"@type": "person"}])
+    assert len(ids) == 3
+    assert graph.graph[ids[0]]["hometown"] == ids[1]
+    assert graph.graph[ids[1]].copy() == {"@type": "city", "name": "London"}
+    assert graph.graph[ids[2]].copy() == {"@type": "person", "name": "UNKNOWN", "hometown": "UNKNOWN"}
+    assert graph.get_inbound_ids(ids[1]) == [ids[0]]
+
+def test_bulk_ingest_references_existing_entities(mock_graph_with_person_hometown_schema):
+    graph = mock_graph_with_person_hometown_schema
+    city_id = graph.create_from_type("city")
+    ids = graph.bulk_ingest([{"@type": "person", "hometown": city_id}])
+    assert graph.graph[ids[0]]["hometown"] == city_id
+
+@pytest.mark.parametrize("records, message", [
+    ([{"name": "Hamish"}], "Record 1 has no @type."),
+    ([{"@type": "dog"}], "Type dog not in schema."),
+    ([{"@type": "person", "age": 1}], "Type person has no property age."),
+    ([{"@type": "person", "hometown": {"@ref": "x"}}], "Reference x not in batch."),
+    ([{"@type": "person", "hometown": "x"}], "Entity x not in graph."),
+    ([{"@type": "city", "@key": "x"}, {"@type": "city", "@key": "x"}], "Key x is used by more than one record."),
+    ([{"@type": "person", "@key": "x"}, {"@type": "person", "hometown": {"@ref": "x"}}], "has type 'person'. Expected type 'city'.")])
+def test_bulk_ingest_validates_before_inserting(mock_graph_with_person_hometown_schema, records, message):
+    graph = mock_graph_with_person_hometown_schema
+    with pytest.raises(AssertionError) as e:
+        graph.bulk_ingest([{"@type": "city", "name": "London"}] + records)
+    assert message in str(e.value)
+    assert len(graph.graph) == 0
+
+@pytest.fixture()
+def mock_graph_with_people_in_countries(mock_graph_with_person_with_country_continent):
+    graph = mock_graph_with_person_with_country_continent
+    ids = graph.bulk_ingest([
+        {"@type": "continent", "@key": "europe"},
+        {"@type": "country", "@key": "uk", "continent": {"@ref": "europe"}},
+        {"@type": "country", "@key": "fr", "continent": {"@ref": "europe"}},
+        {"@type": "person", "location": {"@ref": "uk"}, "age": 10},
+        {"@type": "person", "location": {"@ref": "uk"}, "age": 20},
+        {"@type": "person", "location": {"@ref": "uk"}, "age": 60},
+        {"@type": "person", "location": {"@ref": "fr"}, "age": 30},
+        {"@type": "person", "location": {"@ref": "fr"}}])
+    return graph, ids
+
+@pytest.mark.parametrize("aggregation_fun, q, uk, fr", [
+    ("mean", 0.5, 30, 30),
+    ("sum", 0.5, 90, 30),
+    ("count", 0.5, 3, 1),
+    ("min", 0.5, 10, 30),
+    ("max", 0.5, 60, 30),
+    ("median", 0.5, 20, 30),
+    ("quantile", 0.75, 40, 30)])
+def test_categorical_aggregation_builtin_reductions(mock_graph_with_people_in_countries, aggregation_fun, q, uk, fr):
+    graph, ids = mock_graph_with_people_in_countries
+    res = graph.categorical_aggregation(
+        ids = ids[3:],
+        value_property = "age",
+        aggregation_fun = aggregation_fun,
+        aggregations = [{"depth": 0, "pointing_property": "location", "aggregation_type": "country"}],
+        q = q)
+    assert {"value": uk, "group": (ids[1], )} in res
+    assert {"value": fr, "group": (ids[2], )} in res
+    assert len(res) == 2
+
+@pytest.mark.parametrize("value_property, aggregation_fun, uk, fr", [
+    ("name", "count", 2, 1),
+    ("name", "min", "Alice", "Claire"),
+    ("name", "max", "Bob", "Claire"),
+    ("birth_date", "count", 2, 1),
+    ("birth_date", "min", "1980-05-01", "1975-02-03"),
+    ("birth_date", "max", "1990-01-01", "1975-02-03")])
+def test_categorical_aggregation_reduces_strings_and_dates(mock_graph_with_person_with_country_continent, value_property, aggregation_fun, uk, fr):
+    graph = mock_graph_with_person_with_country_continent
+    graph.schema.add_property("person", "birth_date", "date")
+    ids = graph.bulk_ingest([
+        {"@type": "country", "@key": "uk"},
+        {"@type": "country", "@key": "fr"},
+        {"@type": "person", "location": {"@ref": "uk"}, "name": "Bob", "birth_date": "1990-01-01"},
+        {"@type": "person", "location": {"@ref": "uk"}, "name": "Alice", "birth_date": "1980-05-01"},
+        {"@type": "person", "location": {"@ref": "uk"}},
+        {"@type": "person", "location": {"@ref": "fr"}, "name": "Claire", "birth_date": "1975-02-03"}])
+    res = graph.categorical_aggregation(
+        ids = ids[2:],
+        value_property = value_property,
+        aggregation_fun = aggregation_fun,
+        aggregations = [{"depth": 0, "pointing_property": "location", "aggregation_type": "country"}])
+    assert {"value": uk, "group": (ids[0], )} in res
+    assert {"value": fr, "group": (ids[1], )} in res
+
+def test_categorical_aggregation_callable_gets_raw_values(mock_graph_with_people_in_countries):
+    graph, ids = mock_graph_with_people_in_countries
+    res = graph.categorical_aggregation(
+        ids = ids[3:],
+        value_property = "age",
+        aggregation_fun = list,
+        aggregations = [{"depth": 0, "pointing_property": "location", "aggregation_type": "country"}])
+    assert {"value": [10, 20, 60], "group": (ids[1], )} in res
+    assert {"value": [30, "UNKNOWN"], "group": (ids[2], )} in res
+
+def test_categorical_aggregation_callable_gets_none_for_missing_values(mock_graph_with_people_in_countries):
+    graph, ids = mock_graph_with_people_in_countries
+    del graph.graph[ids[3]]["age"]
+    res = graph.categorical_aggregation(
+        ids = ids[3:],
+        value_property = "age",
+        aggregation_fun = list,
+        aggregations = [{"depth": 0, "pointing_property": "location", "aggregation_type": "country"}])
+    assert {"value": [None, 20, 60], "group": (ids[1], )} in res
+
+def test_categorical_aggregation_raises_on_property_not_on_type(mock_graph_with_people_in_countries):
+    graph, ids = mock_graph_with_people_in_countries
+    with pytest.raises(AssertionError) as e:
+        graph.categorical_aggregation(
+            ids = ids[3:],
+            value_property = "height",
+            aggregation_fun = "mean",
+            aggregations = [{"depth": 0, "pointing_property": "location", "aggregation_type": "country"}])
+    assert str(e.value) == "Type person has no property height."
+
+def test_categorical_aggregation_raises_on_unsupported_reduction(mock_graph_with_people_in_countries):
+    graph, ids = mock_graph_with_people_in_countries
+    with pytest.raises(AssertionError) as e:
+        graph.categorical_aggregation(
+            ids = ids[3:],
+            value_property = "age",
+            aggregation_fun = "mode",
+            aggregations = [{"depth": 0, "pointing_property": "location", "aggregation_type": "country"}])
+    assert "Aggregation mode is not supported." in str(e.value)
+
+def breadth_first_paths_out(graph, id, property):
+    if graph.schema.get_property_kind(graph.graph[id]["@type"], property) != "reference":
+        return []
+    ids_to_explore = [(0, id, [property])]
+    paths_out = []
+    while ids_to_explore:
+        depth, id, properties = ids_to_explore.pop(0)
+        for property in properties:
+            pointed_id = graph.graph[id][property]
+            pointed_id_type = graph.graph[pointed_id]["@type"]
+            ids_to_explore.append((depth + 1, pointed_id, graph.schema.get_properties_of_kind(pointed_id_type, "reference")))
+            paths_out.append((depth, property, pointed_id, pointed_id_type))
+    return paths_out
+
+@pytest.fixture()
+def mock_graph_with_shared_targets():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("continent")
+    graph.schema.create_type("country")
+    graph.schema.create_type("city")
+    graph.schema.create_type("person")
+    graph.schema.add_property("country", "continent", "continent")
+    graph.schema.add_property("city", "country", "country")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "location", "city")
+    graph.schema.add_property("person", "birthplace", "country")
+    ids = graph.bulk_ingest([
+        {"@type": "continent", "@key": "europe"},
+        {"@type": "continent", "@key": "asia"},
+        {"@type": "country", "@key": "uk", "continent": {"@ref": "europe"}},
+        {"@type": "country", "@key": "jp", "continent": {"@ref": "asia"}},
+        {"@type": "city", "@key": "london", "country": {"@ref": "uk"}},
+        {"@type": "city", "@key": "tokyo", "country": {"@ref": "jp"}},
+        {"@type": "person", "location": {"@ref": "london"}, "birthplace": {"@ref": "jp"}},
+        {"@type": "person", "location": {"@ref": "tokyo"}, "birthplace": {"@ref": "uk"}},
+        {"@type": "person", "location": {"@ref": "london"}, "birthplace": {"@ref": "uk"}}])
+    return graph, ids
+
+def test_search_out_from_id_property_matches_breadth_first_search(mock_graph_with_shared_targets):
+    graph, ids = mock_graph_with_shared_targets
+    for id in ids[6:]:
+        for property in ["name", "location", "birthplace"]:
+            paths_out = graph.search_out_from_id_property(id, property)
+            expected = breadth_first_paths_out(graph, id, property)
+            assert [(x["depth"], x["pointing_property"], x["pointed_id"], x["pointed_id_type"]) for x in paths_out] == expected
+            assert all(x["original_id"] == id and x["original_property"] == property for x in paths_out)
+
+def test_search_out_from_id_property_reuses_cached_paths(mock_graph_with_shared_targets):
+    graph, ids = mock_graph_with_shared_targets
+    graph.search_out_from_id_property(ids[6], "location")
+    assert (ids[4], "country") in graph.traversal_cache
+    assert (ids[2], "continent") in graph.traversal_cache
+    n_cached = len(graph.traversal_cache)
+    paths_out = graph.search_out_from_id_property(ids[8], "location")
+    # Only the new person's own key had to be built
+    assert len(graph.traversal_cache) == n_cached + 1
+    graph.iter_paths_out = None
+    # Served from the cache without searching again
+    assert graph.search_out_from_id_property(ids[8], "location") == paths_out
+    assert graph.search_out_from_id_property(ids[8], "location", max_depth=0) == paths_out[:1]
+
+def test_search_out_from_id_property_invalidated_by_edit_along_path(mock_graph_with_shared_targets):
+    graph, ids = mock_graph_with_shared_targets
+    graph.search_out_from_id_property(ids[6], "location")
+    graph.search_out_from_id_property(ids[7], "location")
+    graph.edit_property(ids[2], "continent", ids[1])
+    assert (ids[6], "location") not in graph.traversal_cache
+    assert (ids[7], "location") in graph.traversal_cache
+    paths_out = graph.search_out_from_id_property(ids[6], "location")
+    assert paths_out[-1]["pointed_id"] == ids[1]
+
+@pytest.fixture()
+def mock_graph_with_friend_cycle():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("person")
+    graph.schema.add_property("person", "friend", "person")
+    graph.schema.add_property("person", "enemy", "person")
+    graph.graph["a"] = {"@type": "person", "friend": "b", "enemy": "UNKNOWN"}
+    graph.graph["b"] = {"@type": "person", "friend": "c", "enemy": "a"}
+    graph.graph["c"] = {"@type": "person", "friend": "a"}
+    graph.graph["d"] = {"@type": "person", "friend": "d"}
+    return graph
+
+def get_edges(paths_out):
+    return [(x["depth"], x["pointing_property"], x["pointed_id"]) for x in paths_out]
+
+def test_search_out_from_id_property_ends_on_reference_cycle(mock_graph_with_friend_cycle):
+    graph = mock_graph_with_friend_cycle
+    paths_out = graph.search_out_from_id_property("a", "friend")
+    assert get_edges(paths_out) == [
+        (0, "friend", "b"),
+        (1, "friend", "c"), (1, "enemy", "a"),
+        (2, "friend", "a")]
+    assert list(graph.iter_out_from_id_property("a", "friend")) == paths_out
+
+def test_search_out_from_id_property_stops_at_max_depth(mock_graph_with_friend_cycle):
+    graph = mock_graph_with_friend_cycle
+    paths_out = graph.search_out_from_id_property("a", "friend", max_depth=1)
+    assert get_edges(paths_out) == [(0, "friend", "b"), (1, "friend", "c"), (1, "enemy", "a")]
+    assert list(graph.iter_out_from_id_property("a", "friend", max_depth=1)) == paths_out
+
+def test_search_out_from_id_property_handles_unknown_edges(mock_graph_with_friend_cycle):
+    graph = mock_graph_with_friend_cycle
+    assert graph.search_out_from_id_property("c", "friend", max_depth=1) == [
+        x for x in graph.search_out_from_id_property("c", "friend", max_depth=1, unknown="include")
+        if x["pointed_id_type"] != "UNKNOWN"]
+    paths_out = graph.search_out_from_id_property("c", "friend", unknown="include")
+    unknown_edges = [x for x in paths_out if x["pointed_id_type"] == "UNKNOWN"]
+    assert get_edges(unknown_edges) == [(1, "enemy", "UNKNOWN")]
+    with pytest.raises(AssertionError) as e:
+        list(graph.iter_out_from_id_property("c", "friend", unknown="raise"))
+    assert "reach an unknown value of property 'enemy'" in str(e.value)
+
+def test_search_out_from_id_property_treats_missing_ids_as_unknown(mock_graph_with_friend_cycle):
+    graph = mock_graph_with_friend_cycle
+    assert get_edges(graph.search_out_from_id_property("b", "friend")) == [
+        (0, "friend", "c"), (1, "friend", "a"), (2, "friend", "b")]
+    del graph.graph["c"]
+    assert graph.search_out_from_id_property("b", "friend") == []
+    paths_out = graph.search_out_from_id_property("b", "friend", unknown="include")
+    assert [(x["pointed_id"], x["pointed_id_type"]) for x in paths_out] == [("c", "UNKNOWN")]
+    assert list(graph.iter_out_from_id_property("b", "friend", unknown="include")) == paths_out
+    with pytest.raises(AssertionError):
+        list(graph.iter_out_from_id_property("b", "friend", unknown="raise"))
+    res = graph.categorical_aggregation_paths(["a", "b"])
+    assert res[(res["depth"] == 0) & (res["pointing_property"] == "friend")]["aggregation_proportion"].tolist() == [0.5]
+    graph.graph["c"] = {"@type": "person", "friend": "d"}
+    assert get_edges(graph.search_out_from_id_property("b", "friend")) == [
+        (0, "friend", "c"), (1, "friend", "d"), (2, "friend", "d")]
+
+def aggregation_paths_from_groups(graph, ids, max_depth=None):
+    aggregation_groups = graph.categorical_aggregation_groups(ids, max_depth=max_depth)
+    aggregation_paths = aggregation_groups.groupby(
+        ["depth", "pointing_property", "pointed_id_type"], as_index=False
+    ).agg({"pointed_id": [pd.Series.nunique, "count"]})
+    aggregation_paths.columns = ["depth", "pointing_property", "aggregation_type", "n_groups", "aggregation_proportion"]
+    aggregation_paths["aggregation_proportion"] = aggregation_paths["aggregation_proportion"] / len(ids)
+    return aggregation_paths
+
+def test_categorical_aggregation_paths_matches_search_out_of_every_id(mock_graph_with_shared_targets):
+    graph, ids = mock_graph_with_shared_targets
+    graph.schema.create_type("megacity")
+    graph.schema.make_parent("city", "megacity")
+    graph.schema.add_property("megacity", "country", "country")
+    graph.schema.add_property("megacity", "district", "city")
+    megacity_ids = graph.bulk_ingest([{"@type": "megacity", "country": ids[3], "district": ids[5]}])
+    graph.graph[ids[7]]["location"] = megacity_ids[0]
+    res = graph.categorical_aggregation_paths(ids[6:])
+    expected = aggregation_paths_from_groups(graph, ids[6:])
+    pd.testing.assert_frame_equal(res, expected, check_dtype=False)
+    assert "megacity" in list(res["aggregation_type"])
+
+def test_categorical_aggregation_paths_ends_on_reference_cycle(mock_graph_with_friend_cycle):
+    graph = mock_graph_with_friend_cycle
+    res = graph.categorical_aggregation_paths(["a", "b", "c", "d"])
+    expected = aggregation_paths_from_groups(graph, ["a", "b", "c", "d"])
+    pd.testing.assert_frame_equal(res, expected, check_dtype=False)
+
+@pytest.fixture()
+def mock_dense_cyclic_graph():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("person")
+    for property in ["friend", "enemy", "mentor"]:
+        graph.schema.add_property("person", property, "person")
+    graph.schema.add_property("person", "age", "integer")
+    rng = random.Random(0)
+    ids = [f"p{i}" for i in range(50)]
+    for i, id in enumerate(ids):
+        graph.graph[id] = {
+            "@type": "person",
+            "friend": rng.choice(ids),
+            "enemy": rng.choice(ids),
+            "mentor": rng.choice(ids),
+            "age": i}
+    return graph, ids
+
+def test_search_out_of_dense_cyclic_graph_stops_at_cycle_max_depth(mock_dense_cyclic_graph):
+    graph, ids = mock_dense_cyclic_graph
+    graph.cycle_max_depth = 3
+    paths_out = graph.search_out_from_id_property("p0", "friend")
+    assert max(x["depth"] for x in paths_out) == 3
+    assert ("p0", "friend") not in graph.traversal_cache
+    assert list(graph.iter_out_from_id_property("p0", "friend", max_depth=3)) == paths_out
+    paths_out = graph.search_out_from_id_property("p0", "friend", max_depth=4)
+    assert max(x["depth"] for x in paths_out) == 4
+
+@pytest.mark.parametrize("max_depth", [None, 0, 2])
+def test_categorical_aggregation_paths_of_dense_cyclic_graph(mock_dense_cyclic_graph, max_depth):
+    graph, ids = mock_dense_cyclic_graph
+    graph.cycle_max_depth = 3
+    res = graph.categorical_aggregation_paths(ids, max_depth=max_depth)
+    expected = aggregation_paths_from_groups(graph, ids, max_depth=max_depth)
+    pd.testing.assert_frame_equal(res, expected, check_dtype=False)
+    assert res["depth"].max() == (3 if max_depth is None else max_depth)
+
+def test_categorical_aggregation_with_max_depth(mock_dense_cyclic_graph):
+    graph, ids = mock_dense_cyclic_graph
+    res = graph.categorical_aggregation(
+        ids = ids,
+        value_property = "age",
+        aggregation_fun = "count",
+        aggregations = [{"depth": 0, "pointing_property": "friend", "aggregation_type": "person"}],
+        max_depth = 0)
+    assert sum(x["value"] for x in res) == 50
+
+@pytest.fixture()
+def mock_graph_with_diamond():
+    graph = Graph(data_path=None)
+    for type in ["continent", "country", "region", "city", "person"]:
+        graph.schema.create_type(type)
+    graph.schema.add_property("country", "continent", "continent")
+    graph.schema.add_property("region", "country", "country")
+    graph.schema.add_property("city", "country", "country")
+    graph.schema.add_property("city", "region", "region")
+    graph.schema.add_property("person", "hometown", "city")
+    graph.schema.add_property("person", "age", "integer")
+    graph.graph["europe"] = {"@type": "continent"}
+    graph.graph["se"] = {"@type": "country", "continent": "europe"}
+    graph.graph["scania"] = {"@type": "region", "country": "se"}
+    graph.graph["malmo"] = {"@type": "city", "country": "se", "region": "scania"}
+    graph.graph["anna"] = {"@type": "person", "hometown": "malmo", "age": 30}
+    graph.graph["bo"] = {"@type": "person", "hometown": "malmo", "age": 40}
+    return graph
+
+def test_search_out_of_diamond_lists_every_path(mock_graph_with_diamond):
+    # The country is reached both directly and through the region, and each
+    # path goes on to the continent, as in a search without cycle checks
+    graph = mock_graph_with_diamond
+    expected = [
+        (0, "hometown", "malmo"),
+        (1, "country", "se"),
+        (1, "region", "scania"),
+        (2, "continent", "europe"),
+        (2, "country", "se"),
+        (3, "continent", "europe")]
+    assert get_edges(graph.search_out_from_id_property("anna", "hometown")) == expected
+    assert get_edges(graph.iter_out_from_id_property("anna", "hometown")) == expected
+    res = graph.categorical_aggregation_paths(["anna", "bo"])
+    pd.testing.assert_frame_equal(res, aggregation_paths_from_groups(graph, ["anna", "bo"]), check_dtype=False)
+
+def test_categorical_aggregation_through_diamond(mock_graph_with_diamond):
+    graph = mock_graph_with_diamond
+    res = graph.categorical_aggregation(
+        ids = ["anna", "bo"],
+        value_property = "age",
+        aggregation_fun = "mean",
+        aggregations = [{"depth": 3, "pointing_property": "continent", "aggregation_type": "continent"}])
+    assert res == [{"value": 35.0, "group": ("europe", )}]
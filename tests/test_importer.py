@@ -0,0 +1,97 @@
+import pytest
+import json
+from graph import Graph
+from importer import Importer
+
+@pytest.fixture()
+def mock_graph_with_cities():
+    graph = Graph(data_path=None)
+    graph.schema.create_type("city")
+    graph.schema.create_type("person")
+    graph.schema.add_property("city", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "age", "integer")
+    graph.schema.add_property("person", "hometown", "city")
+    graph.bulk_ingest([{"@type": "city", "name": "London"}, {"@type": "city", "name": "Edinburgh"}])
+    return graph
+
+@pytest.fixture()
+def people_csv(tmp_path):
+    fn = tmp_path / "people.csv"
+    fn.write_text(
+        "full_name,years,town,ignored\n"
+        "Hamish,30,London,x\n"
+        "Alice,,Edinburgh,x\n"
+        "Bob,old,London,x\n"
+        "Carol,41,Edinburg,x\n"
+        "Dan,52,,x\n")
+    return str(fn)
+
+def get_people(graph):
+    return sorted([graph.graph[x].copy() for x in graph.get_ids_of_type("person")], key=lambda x: x["name"])
+
+def test_import_file_maps_columns_and_resolves_references(mock_graph_with_cities, people_csv):
+    graph = mock_graph_with_cities
+    london_id = graph.search("London", type="city")[0]
+    importer = Importer(
+        graph, "person", {"full_name": "name", "years": "age", "town": "hometown"},
+        reference_keys={"hometown": "name"}, chunksize=2)
+    report = importer.import_file(people_csv)
+    assert (report.rows, report.imported, report.rejected) == (5, 3, 2)
+    assert [x[0] for x in report.rejections] == [2, 3]
+    people = get_people(graph)
+    assert [x["name"] for x in people] == ["Alice", "Dan", "Hamish"]
+    assert people[0]["age"] == "UNKNOWN"
+    assert people[1]["hometown"] == "UNKNOWN"
+    assert people[2]["age"] == 30
+    assert type(people[2]["age"]) is int
+    assert people[2]["hometown"] == london_id
+    assert "Imported 3 of 5 rows (2 rejected)" in repr(report)
+
+def test_import_file_resolves_references_with_search(mock_graph_with_cities, people_csv):
+    graph = mock_graph_with_cities
+    importer = Importer(
+        graph, "person", {"full_name": "name", "town": "hometown"},
+        reference_keys={"hometown": "name"}, search=True)
+    report = importer.import_file(people_csv)
+    assert report.rejected == 0
+    carol = [x for x in get_people(graph) if x["name"] == "Carol"][0]
+    assert graph.graph[carol["hometown"]]["name"] == "Edinburgh"
+
+def test_import_parquet_file_with_nullable_integers_and_empty_cells(mock_graph_with_cities, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    fn = str(tmp_path / "people.parquet")
+    # A nullable integer column reads back as floats, so as "30.0" strings
+    pq.write_table(pa.table({
+        "full_name": pa.array(["Hamish", None, "Bob"]),
+        "years": pa.array([30, None, 52], type=pa.int64()),
+        "town": pa.array(["London", "", "Edinburgh"])}), fn)
+    graph = mock_graph_with_cities
+    importer = Importer(
+        graph, "person", {"full_name": "name", "years": "age", "town": "hometown"},
+        reference_keys={"hometown": "name"}, chunksize=2)
+    report = importer.import_file(fn)
+    assert (report.rows, report.imported, report.rejected) == (3, 3, 0)
+    people = get_people(graph)
+    assert [x["name"] for x in people] == ["Bob", "Hamish", "UNKNOWN"]
+    assert [x["age"] for x in people] == [52, 30, "UNKNOWN"]
+    assert type(people[0]["age"]) is int
+    assert people[2]["hometown"] == "UNKNOWN"
+    assert graph.graph[people[0]["hometown"]]["name"] == "Edinburgh"
+
+def test_import_file_logs_json_values(tmp_path, people_csv):
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    (data_path / "schema.json").write_text(json.dumps({
+        "person": {"properties": {"name": "string", "age": "integer"}}}))
+    graph = Graph(data_path=str(data_path))
+    Importer(graph, "person", {"full_name": "name"}).import_file(people_csv)
+    graph.close()
+    graph = Graph(data_path=str(data_path))
+    assert len(graph.get_ids_of_type("person")) == 5
+
+def test_importer_raises_on_unknown_property(mock_graph_with_cities):
+    with pytest.raises(AssertionError) as e:
+        Importer(mock_graph_with_cities, "person", {"height": "height"})
+    assert "Type person has no property height." in str(e.value)
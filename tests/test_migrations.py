@@ -0,0 +1,131 @@
+import pytest
+import json
+from graph import Graph
+from migrations import Migrations
+
+def create_schema(graph):
+    graph.schema.create_type("city")
+    graph.schema.create_type("person")
+    graph.schema.create_type("child")
+    graph.schema.make_parent("person", "child")
+    graph.schema.add_property("city", "name", "string")
+    graph.schema.add_property("person", "name", "string")
+    graph.schema.add_property("person", "hometown", "city")
+
+@pytest.fixture()
+def mock_graph_with_people():
+    graph = Graph(data_path=None)
+    create_schema(graph)
+    ids = graph.bulk_ingest([
+        {"@type": "city", "@key": "london", "name": "London"},
+        {"@type": "person", "name": "A", "hometown": {"@ref": "london"}},
+        {"@type": "child", "name": "B", "hometown": {"@ref": "london"}}])
+    return graph, ids
+
+def test_add_property_sets_unknown_on_type_and_subtypes(mock_graph_with_people):
+    graph, ids = mock_graph_with_people
+    migrations = Migrations(graph)
+    graph.schema.add_property("person", "age", "integer")
+    assert graph.graph[ids[1]]["age"] == "UNKNOWN"
+    assert graph.graph[ids[2]]["age"] == "UNKNOWN"
+    assert "age" not in graph.graph[ids[0]]
+    assert migrations.completed[0]["types"] == ["child", "person"]
+    assert graph.audit() == []
+
+def test_remove_and_rename_property_rewrite_entities(mock_graph_with_people):
+    graph, ids = mock_graph_with_people
+    Migrations(graph)
+    graph.schema.rename_property("person", "hometown", "birthplace")
+    assert graph.graph[ids[1]].copy() == {"@type": "person", "name": "A", "birthplace": ids[0]}
+    assert set(graph.get_inbound_ids(ids[0], "birthplace")) == set([ids[1], ids[2]])
+    assert graph.get_inbound_ids(ids[0], "hometown") == []
+    graph.schema.remove_property("person", "name")
+    assert graph.graph[ids[2]].copy() == {"@type": "child", "birthplace": ids[0]}
+    assert graph.search("A", type="person") == []
+
+def test_edit_property_records_values_that_no_longer_fit(mock_graph_with_people):
+    graph, ids = mock_graph_with_people
+    migrations = Migrations(graph)
+    graph.schema.edit_property("person", "hometown", "person")
+    assert [x[0] for x in migrations.completed[0]["violations"]] == [ids[2], ids[1]]
+    assert migrations.completed[0]["violations"][0][2] == "wrong_type"
+    assert graph.graph[ids[1]]["hometown"] == ids[0]
+
+def test_batch_migrations_apply_in_order(mock_graph_with_people):
+    graph, ids = mock_graph_with_people
+    Migrations(graph)
+    with graph.schema.batch():
+        graph.schema.add_property("person", "age", "integer")
+        graph.schema.rename_property("person", "age", "years")
+    assert graph.graph[ids[2]]["years"] == "UNKNOWN"
+    assert "age" not in graph.graph[ids[2]]
+
+def test_migrations_are_logged_and_resumed(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    graph = Graph(data_path=str(tmp_path))
+    create_schema(graph)
+    ids = graph.bulk_ingest([{"@type": "person", "name": str(i)} for i in range(5)])
+    migrations = graph.migrations
+    migrations.chunk_size = 2
+    save = migrations.save
+
+    def save_then_crash():
+        save()
+        if migrations.pending and migrations.pending[0]["position"] == 2:
+            raise KeyboardInterrupt()
+    migrations.save = save_then_crash
+    # Interrupted after the first chunk of people
+    with pytest.raises(KeyboardInterrupt):
+        graph.schema.add_property("person", "age", "integer")
+    with open(tmp_path / "migrations.json") as f:
+        pending = json.load(f)["pending"]
+    assert pending[0]["done_types"] == ["child"]
+    assert pending[0]["position"] == 2
+    assert [x for x in sorted(ids) if "age" in graph.graph[x]] == sorted(ids)[:2]
+    graph.close()
+
+    # Resumed when the graph opens
+    graph = Graph(data_path=str(tmp_path))
+    assert graph.migrations.pending == []
+    assert graph.migrations.completed[0]["args"]["property"] == "age"
+    assert [graph.graph[x]["age"] for x in ids] == ["UNKNOWN"] * 5
+    graph.close()
+    graph = Graph(data_path=str(tmp_path))
+    assert [graph.graph[x]["age"] for x in ids] == ["UNKNOWN"] * 5
+
+def test_migration_is_saved_before_its_schema_change_is_logged(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    graph = Graph(data_path=str(tmp_path))
+    create_schema(graph)
+    ids = graph.bulk_ingest([{"@type": "person", "name": str(i)} for i in range(3)])
+
+    def crash(*args):
+        raise KeyboardInterrupt()
+    # Logged, then interrupted before any listener hears of it
+    graph.schema_changed = crash
+    with pytest.raises(KeyboardInterrupt):
+        graph.schema.add_property("person", "age", "integer")
+    with open(tmp_path / "migrations.json") as f:
+        assert [x["args"]["property"] for x in json.load(f)["pending"]] == ["age"]
+    graph.close()
+    graph = Graph(data_path=str(tmp_path))
+    assert [graph.graph[x]["age"] for x in ids] == ["UNKNOWN"] * 3
+    graph.close()
+
+def test_migration_of_unlogged_schema_change_is_dropped(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    graph = Graph(data_path=str(tmp_path))
+    create_schema(graph)
+    ids = graph.bulk_ingest([{"@type": "person", "name": str(i)} for i in range(3)])
+
+    def crash(record):
+        raise KeyboardInterrupt()
+    # Interrupted after the migration was saved, before the change was logged
+    graph.schema.mutation_log.append = crash
+    with pytest.raises(KeyboardInterrupt):
+        graph.schema.add_property("person", "age", "integer")
+    graph.close()
+    graph = Graph(data_path=str(tmp_path))
+    assert "age" not in graph.schema.schema["person"]["properties"]
+    assert graph.migrations.pending == []
+    assert all("age" not in graph.graph[x] for x in ids)
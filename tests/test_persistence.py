@@ -0,0 +1,43 @@
+from persistence import MutationLog, write_json_atomic, UMASK
+import os
+import json
+
+def test_write_json_atomic(tmp_path):
+    fn = str(tmp_path / "data.json")
+    write_json_atomic(fn, {"b": 1, "a": 2})
+    with open(fn) as f:
+        assert json.load(f) == {"a": 2, "b": 1}
+    assert [x.name for x in tmp_path.iterdir()] == ["data.json"]
+
+def test_write_json_atomic_keeps_file_mode(tmp_path):
+    fn = str(tmp_path / "data.json")
+    write_json_atomic(fn, {})
+    assert os.stat(fn).st_mode & 0o777 == 0o666 & ~UMASK
+    os.chmod(fn, 0o640)
+    write_json_atomic(fn, {"a": 1})
+    assert os.stat(fn).st_mode & 0o777 == 0o640
+
+def test_mutation_log_append_and_replay(tmp_path):
+    log = MutationLog(str(tmp_path / "log.jsonl"))
+    log.append({"op": "a"})
+    log.append_many([{"op": "b"}, {"op": "c"}])
+    log.close()
+    assert [x["op"] for x in MutationLog(str(tmp_path / "log.jsonl")).replay()] == ["a", "b", "c"]
+
+def test_mutation_log_replay_missing_file(tmp_path):
+    assert MutationLog(str(tmp_path / "log.jsonl")).replay() == []
+
+def test_mutation_log_replay_drops_torn_record(tmp_path):
+    fn = tmp_path / "log.jsonl"
+    fn.write_text('{"op": "a"}\n{"op": "b"')
+    log = MutationLog(str(fn))
+    assert log.replay() == [{"op": "a"}]
+    log.append({"op": "c"})
+    log.close()
+    assert MutationLog(str(fn)).replay() == [{"op": "a"}, {"op": "c"}]
+
+def test_mutation_log_truncate(tmp_path):
+    log = MutationLog(str(tmp_path / "log.jsonl"))
+    log.append({"op": "a"})
+    log.truncate()
+    assert log.replay() == []
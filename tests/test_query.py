@@ -0,0 +1,97 @@
+import pytest
+from graph import Graph
+from query import Literal, QueryParser, QueryRow, Step, Query
+
+@pytest.fixture()
+def mock_graph_with_applications():
+    graph = Graph(data_path=None)
+    for type in ["continent", "country", "government", "union", "application"]:
+        graph.schema.create_type(type)
+    graph.schema.add_property("continent", "name", "string")
+    graph.schema.add_property("country", "name", "string")
+    graph.schema.add_property("country", "continent", "continent")
+    graph.schema.add_property("government", "country", "country")
+    graph.schema.add_property("union", "name", "string")
+    graph.schema.add_property("application", "by", "government")
+    graph.schema.add_property("application", "to", "union")
+    graph.schema.add_property("application", "start_date", "date")
+    graph.bulk_ingest([
+        {"@type": "continent", "@key": "europe", "name": "Europe"},
+        {"@type": "continent", "@key": "asia", "name": "Asia"},
+        {"@type": "country", "@key": "sweden", "name": "Sweden", "continent": {"@ref": "europe"}},
+        {"@type": "country", "@key": "finland", "name": "Finland", "continent": {"@ref": "europe"}},
+        {"@type": "country", "@key": "japan", "name": "Japan", "continent": {"@ref": "asia"}},
+        {"@type": "government", "@key": "gs", "country": {"@ref": "sweden"}},
+        {"@type": "government", "@key": "gf", "country": {"@ref": "finland"}},
+        {"@type": "government", "@key": "gj", "country": {"@ref": "japan"}},
+        {"@type": "union", "@key": "eu", "name": "EU"},
+        {"@type": "union", "@key": "asean", "name": "ASEAN"},
+        {"@type": "application", "by": {"@ref": "gs"}, "to": {"@ref": "eu"}, "start_date": "2022-05-16"},
+        {"@type": "application", "by": {"@ref": "gf"}, "to": {"@ref": "eu"}},
+        {"@type": "application", "by": {"@ref": "gj"}, "to": {"@ref": "asean"}}])
+    return graph
+
+def test_parse_query_with_nested_constraints():
+    steps, properties = QueryParser(
+        '@application (constraint: "@application -> by -> @government (constraint: country -> Sweden)") -> start_date -> @date').parse_query()
+    assert properties == ["start_date"]
+    assert steps == [
+        Step("application", [[("by", Step("government", [[("country", Literal("Sweden"))]]))]]),
+        Step("date", [])]
+
+@pytest.mark.parametrize("text, message", [
+    ("application -> by -> @government", "Expected a @type."),
+    ("@application -> by", "Expected more query."),
+    ("@application (constraint: to -> EU -> @government", "Expected ')'."),
+    ("@application @government", "Expected the end of the query.")])
+def test_parse_query_raises_on_bad_syntax(text, message):
+    with pytest.raises(AssertionError) as e:
+        QueryParser(text).parse_query()
+    assert message in str(e.value)
+
+def test_query_raises_on_property_not_in_schema(mock_graph_with_applications):
+    with pytest.raises(AssertionError) as e:
+        mock_graph_with_applications.query("@application -> from -> @government")
+    assert "Type application has no property from." in str(e.value)
+
+def test_query_with_constraints_on_both_steps(mock_graph_with_applications):
+    graph = mock_graph_with_applications
+    rows = graph.query(
+        "@application (constraint: to -> EU) -> by -> "
+        "@government (constraint: country -> @country -> continent -> Europe)")
+    assert len(rows) == 2
+    assert all(x.unknown_edge is None for x in rows)
+    countries = sorted(graph.graph[graph.graph[x.ids[1]]["country"]]["name"] for x in rows)
+    assert countries == ["Finland", "Sweden"]
+
+def test_query_starts_from_most_selective_constraint(mock_graph_with_applications):
+    graph = mock_graph_with_applications
+    query = Query(graph,
+        "@application (constraint: to -> EU) -> by -> "
+        "@government (constraint: country -> Japan)")
+    assert query.explain() == {"start_step": 1, "start_type": "government", "candidates": [2, 1]}
+    assert list(query.iter_rows()) == []
+
+def test_query_without_constraints_follows_every_entity(mock_graph_with_applications):
+    graph = mock_graph_with_applications
+    rows = graph.query("@application -> by -> @government -> country -> @country")
+    assert len(rows) == 3
+    assert [graph.graph[x.ids[2]]["@type"] for x in rows] == ["country"] * 3
+
+def test_query_reports_where_unknown_edges_end(mock_graph_with_applications):
+    graph = mock_graph_with_applications
+    rows = graph.query(
+        '@application (constraint: "@application -> by -> @government (constraint: @government -> country -> Finland)") '
+        '-> start_date -> @date')
+    assert len(rows) == 1
+    assert rows[0].ids[1] == "UNKNOWN"
+    assert rows[0].unknown_edge == (rows[0].ids[0], "start_date")
+    rows = graph.query(
+        "@application (constraint: by -> @government (constraint: country -> Sweden)) -> start_date -> @date")
+    assert rows == [QueryRow([rows[0].ids[0], "2022-05-16"], None)]
+
+def test_query_matches_literal_ids_and_leaf_values(mock_graph_with_applications):
+    graph = mock_graph_with_applications
+    application_id = graph.query("@application (constraint: start_date -> 2022-05-16) -> by -> @government")[0].ids[0]
+    rows = graph.query(f"@application (constraint: by -> {graph.graph[application_id]['by']}) -> to -> @union")
+    assert [x.ids[0] for x in rows] == [application_id]
@@ -0,0 +1,104 @@
+import pytest
+import json
+from graph import Graph
+from questions import QuestionRegistry
+
+def create_schema(graph):
+    for type in ["country", "government", "application", "person"]:
+        graph.schema.create_type(type)
+    graph.schema.add_property("country", "name", "string")
+    graph.schema.add_property("government", "country", "country")
+    graph.schema.add_property("application", "by", "government")
+    graph.schema.add_property("application", "start_date", "date")
+    graph.schema.add_property("person", "name", "string")
+
+@pytest.fixture()
+def mock_graph_with_applications():
+    graph = Graph(data_path=None)
+    create_schema(graph)
+    ids = graph.bulk_ingest([
+        {"@type": "country", "@key": "sweden", "name": "Sweden"},
+        {"@type": "country", "@key": "finland", "name": "Finland"},
+        {"@type": "government", "@key": "gs", "country": {"@ref": "sweden"}},
+        {"@type": "government", "@key": "gf", "country": {"@ref": "finland"}},
+        {"@type": "application", "by": {"@ref": "gs"}, "start_date": "2022-05-16"},
+        {"@type": "application", "by": {"@ref": "gf"}}])
+    return graph, ids
+
+SWEDEN_START = "@application (constraint: by -> @government (constraint: country -> Sweden)) -> start_date -> @date"
+ALL_GOVERNMENTS = "@application -> by -> @government"
+
+def test_ask_caches_answers_with_dependencies(mock_graph_with_applications):
+    graph, ids = mock_graph_with_applications
+    registry = QuestionRegistry(graph)
+    question = registry.ask(SWEDEN_START)
+    assert question["answer"] == [[[ids[4], "2022-05-16"], None]]
+    assert question["error"] is None
+    assert question["dependencies"]["types"] == ["application", "country", "date", "government"]
+    assert ["country", "name"] in question["dependencies"]["properties"]
+    assert ["application", "start_date"] in question["dependencies"]["properties"]
+    assert question["dependencies"]["ids"] == [ids[4]]
+
+def test_refresh_only_reevaluates_affected_questions(mock_graph_with_applications):
+    graph, ids = mock_graph_with_applications
+    registry = QuestionRegistry(graph)
+    registry.ask(SWEDEN_START)
+    registry.ask(ALL_GOVERNMENTS)
+    registry.ask("@person -> name -> @string")
+    graph.graph[ids[4]]["start_date"] = "2022-05-18"
+    assert list(registry.stale) == [SWEDEN_START]
+    changes = registry.refresh()
+    assert [(x["question"], x["status"]) for x in changes] == [(SWEDEN_START, "changed")]
+    assert changes[0]["new_answer"] == [[[ids[4], "2022-05-18"], None]]
+    assert registry.stale == {}
+
+def test_refresh_marks_questions_matching_literals(mock_graph_with_applications):
+    graph, ids = mock_graph_with_applications
+    registry = QuestionRegistry(graph)
+    registry.ask(SWEDEN_START)
+    registry.ask("@person -> name -> @string")
+    graph.edit_property(ids[1], "name", "Sweden")
+    assert list(registry.stale) == [SWEDEN_START]
+    changes = registry.refresh()
+    assert changes[0]["new_answer"] == [[[ids[4], "2022-05-16"], None], [[ids[5], "UNKNOWN"], [ids[5], "start_date"]]]
+
+def test_refresh_reports_failures_after_schema_change(mock_graph_with_applications):
+    graph, ids = mock_graph_with_applications
+    registry = QuestionRegistry(graph)
+    registry.ask(SWEDEN_START)
+    registry.ask("@person -> name -> @string")
+    graph.schema.remove_property("application", "start_date")
+    assert list(registry.stale) == [SWEDEN_START]
+    changes = registry.refresh()
+    assert changes[0]["status"] == "failed"
+    assert changes[0]["error"] == "Type application has no property start_date."
+    graph.schema.add_property("application", "start_date", "date")
+    assert [x["status"] for x in registry.refresh()] == ["resolved"]
+
+def test_refresh_follows_subtypes_joining_a_type(mock_graph_with_applications):
+    graph, ids = mock_graph_with_applications
+    registry = QuestionRegistry(graph)
+    registry.ask(ALL_GOVERNMENTS)
+    graph.schema.create_type("council")
+    graph.schema.add_property("council", "country", "country")
+    council_id = graph.bulk_ingest([{"@type": "council", "country": ids[0]}])[0]
+    graph.graph[ids[5]]["by"] = council_id
+    assert registry.refresh()[0]["new_answer"] == [[[ids[4], ids[2]], None]]
+    graph.schema.make_parent("government", "council")
+    assert list(registry.stale) == [ALL_GOVERNMENTS]
+    assert registry.refresh()[0]["new_answer"][1] == [[ids[5], council_id], None]
+
+def test_registry_is_saved_with_the_graph(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    graph = Graph(data_path=str(tmp_path))
+    create_schema(graph)
+    registry = QuestionRegistry(graph)
+    registry.ask("@application -> by -> @government")
+    registry.ask("@application ->")
+    with open(tmp_path / "questions.json") as f:
+        saved = json.load(f)
+    assert saved["@application -> by -> @government"]["answer"] == []
+    assert "Could not parse query" in saved["@application ->"]["error"]
+    registry = QuestionRegistry(Graph(data_path=str(tmp_path)))
+    assert registry.questions == saved
+    assert len(registry.stale) == 2
@@ -1,4 +1,5 @@
 from schema import Schema
+import json
 import pytest
 
 def test_get_accepted_schema_value():
@@ -280,7 +281,7 @@ def test_raise_if_property_is_from_a_parent():
     schema = Schema(data_path=None)
     schema.create_type("human")
     schema.create_type("child")
-    schema.make_parent("child", "human")
+    schema.make_parent("human", "child")
     schema.add_property("human", "name", "string")
     with pytest.raises(AssertionError) as exc_info:
         schema.raise_if_property_is_from_a_parent("child", "name")
@@ -315,3 +316,219 @@ def test_get_all_string_properties():
     res = schema.get_all_string_properties()
     assert ("child", "name") in res
     assert ("human", "name") in res
+
+def test_mutation_log_replayed_on_load(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    schema = Schema(data_path=str(tmp_path))
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.make_parent("human", "child")
+    schema.add_property("human", "name", "string")
+    schema.close()
+    assert json.loads((tmp_path / "schema.json").read_text()) == {}
+    schema = Schema(data_path=str(tmp_path))
+    assert schema.schema == {
+        "human": {"properties": {"name": "string"}},
+        "child": {"@parent": "human", "properties": {"name": "string"}}}
+
+def test_compact(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    schema = Schema(data_path=str(tmp_path))
+    schema.create_type("human")
+    schema.compact()
+    assert json.loads((tmp_path / "schema.json").read_text()) == {"human": {"properties": {}}}
+    assert (tmp_path / "schema_log.jsonl").read_text() == ""
+    # Replaying records already folded into the snapshot is harmless
+    schema.mutation_log.append({"op": "create_type", "args": {"id": "human"}, "types": {"human": {"properties": {}}}})
+    schema = Schema(data_path=str(tmp_path))
+    assert schema.schema == {"human": {"properties": {}}}
+
+def test_get_child_ids_ignores_siblings():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("adult")
+    schema.create_type("child")
+    schema.make_parent("human", "adult")
+    schema.make_parent("human", "child")
+    assert schema.get_child_ids("adult") == set()
+
+def test_get_parent_ids_does_not_share_results_between_calls():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.create_type("organisation")
+    schema.make_parent("human", "child")
+    assert schema.get_parent_ids("child") == set(["human"])
+    assert schema.get_parent_ids("organisation") == set()
+
+def test_hierarchy_invalidated_by_parent_changes():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("person")
+    schema.create_type("child")
+    schema.make_parent("human", "child")
+    assert schema.get_child_ids("human") == set(["child"])
+    schema.edit_parent("child", "person")
+    assert schema.get_child_ids("human") == set()
+    assert schema.get_type_with_child_ids("person") == frozenset(["person", "child"])
+    schema.remove_parent("child")
+    assert schema.get_child_ids("person") == set()
+    schema.create_type("baby")
+    schema.make_parent("child", "baby")
+    assert schema.get_parent_ids("baby") == set(["child"])
+
+def test_add_property_three_levels():
+    schema = Schema(data_path=None)
+    schema.create_type("thing")
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.make_parent("thing", "human")
+    schema.make_parent("human", "child")
+    schema.add_property("thing", "name", "string")
+    assert schema.schema["child"]["properties"] == {"name": "string"}
+    schema.edit_property("thing", "name", "integer")
+    assert schema.schema["child"]["properties"] == {"name": "integer"}
+    schema.remove_property("thing", "name")
+    assert schema.schema["child"]["properties"] == {}
+
+def test_batch_propagates_on_commit():
+    schema = Schema(data_path=None)
+    schema.create_type("thing")
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.make_parent("thing", "human")
+    schema.make_parent("human", "child")
+    with schema.batch():
+        schema.add_property("thing", "name", "string")
+        schema.add_property("human", "age", "integer")
+        assert schema.schema["child"]["properties"] == {}
+        schema.edit_property("thing", "name", "date")
+    assert schema.schema["human"]["properties"] == {"name": "date", "age": "integer"}
+    assert schema.schema["child"]["properties"] == {"name": "date", "age": "integer"}
+
+def test_batch_rolls_back_on_error():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.make_parent("human", "child")
+    with pytest.raises(AssertionError) as exc_info:
+        with schema.batch():
+            schema.create_type("dog")
+            schema.add_property("human", "name", "string")
+            schema.add_property("child", "name", "string")
+    assert exc_info.value.args[0] == 'Type child has existing property name.'
+    assert schema.schema == {
+        "human": {"properties": {}},
+        "child": {"@parent": "human", "properties": {}}}
+    assert schema.get_child_ids("human") == set(["child"])
+
+def test_batch_writes_one_log_record(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    schema = Schema(data_path=str(tmp_path))
+    with schema.batch():
+        schema.create_type("human")
+        schema.create_type("child")
+        schema.make_parent("human", "child")
+        with schema.batch():
+            schema.add_property("human", "name", "string")
+    schema.close()
+    records = (tmp_path / "schema_log.jsonl").read_text().splitlines()
+    assert len(records) == 1
+    assert [x["op"] for x in json.loads(records[0])["args"]["mutations"]] == [
+        "create_type", "create_type", "make_parent", "add_property"]
+    schema = Schema(data_path=str(tmp_path))
+    assert schema.schema["child"] == {"@parent": "human", "properties": {"name": "string"}}
+
+def test_batch_rollback_writes_nothing(tmp_path):
+    (tmp_path / "schema.json").write_text("{}")
+    schema = Schema(data_path=str(tmp_path))
+    with pytest.raises(AssertionError):
+        with schema.batch():
+            schema.create_type("human")
+            schema.create_type("human")
+    schema.close()
+    assert not (tmp_path / "schema_log.jsonl").exists()
+    assert schema.schema == {}
+
+def test_get_all_string_properties_skips_other_kinds():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("city")
+    schema.add_property("human", "name", "string")
+    schema.add_property("human", "age", "integer")
+    schema.add_property("human", "hometown", "city")
+    assert schema.get_all_string_properties() == [("human", "name")]
+
+def test_get_properties_of_kind():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.create_type("city")
+    schema.make_parent("human", "child")
+    schema.add_property("human", "name", "string")
+    schema.add_property("human", "hometown", "city")
+    assert schema.get_properties_of_kind("child", "reference") == ["hometown"]
+    assert schema.get_property_kind("child", "name") == "string"
+    schema.edit_property("human", "name", "city")
+    assert schema.get_properties_of_kind("child", "string") == []
+    assert schema.get_properties_of_kind("child", "reference") == ["name", "hometown"]
+    schema.remove_property("human", "hometown")
+    assert schema.get_properties_of_kind("human", "reference") == ["name"]
+    assert schema.get_property_kind("human", "hometown") is None
+    assert schema.get_properties_of_kind("dog", "string") == []
+
+def test_listeners_are_told_about_committed_mutations():
+    class Listener():
+        calls = []
+        def schema_changed(self, op, args, types):
+            self.calls.append((op, sorted(types)))
+    schema = Schema(data_path=None)
+    listener = Listener()
+    schema.listeners.append(listener)
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.make_parent("human", "child")
+    with schema.batch():
+        schema.add_property("human", "name", "string")
+    assert listener.calls == [
+        ("create_type", ["human"]),
+        ("create_type", ["child"]),
+        ("make_parent", ["child"]),
+        ("batch", ["child", "human"])]
+
+def test_rename_property_propagates_to_children():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.create_type("child")
+    schema.make_parent("human", "child")
+    schema.add_property("human", "name", "string")
+    schema.add_property("human", "age", "integer")
+    schema.rename_property("human", "name", "full_name")
+    assert list(schema.schema["human"]["properties"]) == ["full_name", "age"]
+    assert list(schema.schema["child"]["properties"]) == ["full_name", "age"]
+
+def test_rename_property_raises_if_new_property_exists():
+    schema = Schema(data_path=None)
+    schema.create_type("human")
+    schema.add_property("human", "name", "string")
+    schema.add_property("human", "age", "integer")
+    with pytest.raises(AssertionError) as exc_info:
+        schema.rename_property("human", "name", "age")
+    assert exc_info.value.args[0] == "Type human has existing property age."
+
+def test_batch_listener_error_does_not_roll_back(tmp_path):
+    class FailingListener():
+        def schema_changed(self, op, args, types):
+            raise RuntimeError("listener failed")
+
+    (tmp_path / "schema.json").write_text("{}")
+    schema = Schema(data_path=str(tmp_path))
+    schema.create_type("person")
+    schema.listeners.append(FailingListener())
+    with pytest.raises(RuntimeError):
+        with schema.batch():
+            schema.add_property("person", "age", "integer")
+    assert schema.schema == {"person": {"properties": {"age": "integer"}}}
+    schema.close()
+    schema = Schema(data_path=str(tmp_path))
+    assert schema.schema == {"person": {"properties": {"age": "integer"}}}
@@ -0,0 +1,57 @@
+from search_index import SearchIndex
+import pytest
+
+@pytest.fixture()
+def search_index():
+    search_index = SearchIndex()
+    search_index.add("person", "name", "p1", "Hamish")
+    search_index.add("person", "name", "p2", "Peter")
+    search_index.add("person", "nickname", "p2", "Hamish")
+    search_index.add("city", "name", "c1", "Syracuse")
+    return search_index
+
+def test_search(search_index):
+    assert search_index.search("Hamish") == ["p1", "p2"]
+    assert search_index.search("Syracuse") == ["c1"]
+
+def test_search_with_filters(search_index):
+    assert search_index.search("Hamish", type="city") == ["c1"]
+    assert search_index.search("Hamish", property="name") == ["p1"]
+    assert search_index.search("Hamish", type="person", property="nickname") == ["p2"]
+
+def test_search_top_k(search_index):
+    search_index.add("person", "name", "p3", "Hamis")
+    assert search_index.search("Hamish", property="name", limit=2) == ["p1", "p3"]
+
+def test_search_sort_key(search_index):
+    assert search_index.search("Hamish", sort_key=lambda x: x != "p2") == ["p2", "p1"]
+
+def test_remove(search_index):
+    search_index.remove("person", "name", "p1", "Hamish")
+    assert search_index.search("Hamish") == ["p2"]
+    search_index.remove("person", "nickname", "p2", "Hamish")
+    assert search_index.search("Hamish", type="person") == ["p2"]
+    assert "Hamish" not in search_index.fields[("person", "name")].postings
+    assert all("Hamish" not in x for x in search_index.fields[("person", "name")].grams.values())
+
+def test_grams_are_updated_on_search(search_index):
+    search_index.add("city", "name", "c2", "Utica")
+    search_index.remove("city", "name", "c1", "Syracuse")
+    field = search_index.fields[("city", "name")]
+    assert field.pending == set(["Utica", "Syracuse"])
+    assert search_index.search("Utica", type="city") == ["c2"]
+    assert field.pending == set()
+    assert all("Syracuse" not in x for x in field.grams.values())
+    # Dropped and added back before a search
+    search_index.remove("city", "name", "c2", "Utica")
+    search_index.add("city", "name", "c3", "Utica")
+    assert search_index.search("Utica", type="city") == ["c3"]
+    assert "Utica" in field.grams[" ut"]
+
+def test_candidates_are_pruned(search_index):
+    search_index.max_candidates = 1
+    fields = search_index.get_fields(type="person")
+    assert search_index.get_candidates("Hamish", fields) == ["Hamish"]
+
+def test_search_empty():
+    assert SearchIndex().search("Hamish") == []
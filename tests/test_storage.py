@@ -0,0 +1,66 @@
+from storage import JsonStorage, ColumnarStorage, convert_storage
+from graph import Graph
+import pytest
+import json
+import os
+
+@pytest.fixture()
+def entities():
+    return {
+        "p1": {"@type": "person", "name": "Hamish", "age": 30, "hometown": "c1"},
+        "p2": {"@type": "person", "name": "Peter", "age": 30, "hometown": "c1"},
+        "p3": {"@type": "person", "name": "UNKNOWN", "hometown": "UNKNOWN"},
+    }
+
+def test_columnar_round_trip(tmp_path, entities):
+    storage = ColumnarStorage(str(tmp_path))
+    storage.save_type("person", entities)
+    assert storage.list_types() == ["person"]
+    assert storage.load_type("person") == entities
+
+def test_columnar_save_keeps_file_mode(tmp_path, entities):
+    storage = ColumnarStorage(str(tmp_path))
+    storage.save_type("person", entities)
+    os.chmod(storage.type_fn("person"), 0o640)
+    storage.save_type("person", entities)
+    assert os.stat(storage.type_fn("person")).st_mode & 0o777 == 0o640
+
+def test_columnar_round_trip_empty_type(tmp_path):
+    storage = ColumnarStorage(str(tmp_path))
+    storage.save_type("person", {})
+    assert storage.load_type("person") == {}
+
+def test_columnar_columns_are_dictionary_encoded(tmp_path, entities):
+    storage = ColumnarStorage(str(tmp_path))
+    storage.save_type("person", entities)
+    ids, columns, dictionaries = storage.load_type_columns("person")
+    assert ids.tolist() == [b"p1", b"p2", b"p3"]
+    assert dictionaries["hometown"] == ["c1", "UNKNOWN"]
+    assert columns["hometown"].tolist() == [0, 0, 1]
+    assert columns["age"].tolist() == [0, 0, -1]
+
+def test_columnar_rejects_other_files(tmp_path):
+    storage = ColumnarStorage(str(tmp_path))
+    (tmp_path / "columnar").mkdir()
+    (tmp_path / "columnar" / "person.lgc").write_bytes(b"{}")
+    with pytest.raises(AssertionError) as exc_info:
+        storage.load_type("person")
+    assert "is not a columnar type file" in exc_info.value.args[0]
+
+def test_convert_storage(tmp_path, entities):
+    JsonStorage(str(tmp_path)).save_type("person", entities)
+    convert_storage(str(tmp_path), source="json", target="columnar")
+    assert ColumnarStorage(str(tmp_path)).load_type("person") == entities
+    (tmp_path / "graph" / "person.json").unlink()
+    convert_storage(str(tmp_path), source="columnar", target="json")
+    assert JsonStorage(str(tmp_path)).load_type("person") == entities
+
+def test_graph_with_columnar_storage(tmp_path):
+    (tmp_path / "schema.json").write_text(json.dumps({"person": {"properties": {"name": "string"}}}))
+    graph = Graph(data_path=str(tmp_path), storage="columnar")
+    person_id = graph.create_from_type("person")
+    graph.edit_property(person_id, "name", "Hamish")
+    graph.compact()
+    graph = Graph(data_path=str(tmp_path), storage="columnar")
+    assert graph.graph == {person_id: {"@type": "person", "name": "Hamish"}}
+    assert not (tmp_path / "graph").exists()
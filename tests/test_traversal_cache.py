@@ -0,0 +1,22 @@
+from traversal_cache import TraversalCache
+
+def test_invalidate_entity_drops_entries_built_from_it():
+    cache = TraversalCache()
+    cache.put(("c", "x"), (), ["c"], [])
+    cache.put(("b", "x"), ((0, "x", "c", "t"), ), ["b", "c"], [("c", "x")])
+    cache.put(("a", "x"), ((0, "x", "b", "t"), ), ["a", "b"], [("b", "x")])
+    cache.put(("d", "x"), (), ["d"], [])
+    cache.invalidate_entity("c")
+    assert ("a", "x") not in cache
+    assert ("b", "x") not in cache
+    assert ("c", "x") not in cache
+    assert ("d", "x") in cache
+
+def test_invalidate_entity_keeps_entries_that_did_not_read_it():
+    cache = TraversalCache()
+    cache.put(("c", "x"), (), ["c"], [])
+    cache.put(("b", "x"), ((0, "x", "c", "t"), ), ["b", "c"], [("c", "x")])
+    cache.invalidate_entity("b")
+    assert ("b", "x") not in cache
+    assert ("c", "x") in cache
+    assert len(cache) == 1